@@ -0,0 +1,212 @@
+import argparse
+import bisect
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+import datos
+import jornada
+import recurrencias
+from configuracion import conectar
+
+# Exportación e importación de la agenda en formato iCalendar (RFC 5545), para verla
+# en el calendario del teléfono o traer los turnos de otra agenda
+PRODID = '-//Consultorio Psicopedagógico//Agenda//ES'
+TRAMO_DIAS = 31  # La exportación consulta la agenda de a un mes, no todo el rango de una vez
+LARGO_LINEA = 75  # Octetos por línea antes de plegarla (RFC 5545, 3.1)
+
+
+def _escapar(texto):
+    return (texto.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _desescapar(texto):
+    resultado, i = [], 0
+    while i < len(texto):
+        if texto[i] == '\\' and i + 1 < len(texto):
+            resultado.append('\n' if texto[i + 1] in 'nN' else texto[i + 1])
+            i += 2
+        else:
+            resultado.append(texto[i])
+            i += 1
+    return ''.join(resultado)
+
+
+def _plegar(linea):
+    """Corta la línea cada 75 octetos sin partir un carácter UTF-8; las continuaciones empiezan con un espacio"""
+    partes, actual, largo = [], [], 0
+    for caracter in linea:
+        octetos = len(caracter.encode('utf-8'))
+        if largo + octetos > LARGO_LINEA:
+            partes.append(''.join(actual))
+            actual, largo = [' '], 1
+        actual.append(caracter)
+        largo += octetos
+    partes.append(''.join(actual))
+    return '\r\n'.join(partes) + '\r\n'
+
+
+def _turnos_por_tramos(conn, desde, hasta):
+    inicio, fin = recurrencias.a_fecha(desde), recurrencias.a_fecha(hasta)
+    while inicio <= fin:
+        tramo = min(inicio + timedelta(days=TRAMO_DIAS - 1), fin)
+        yield from datos.obtener_turnos_rango(conn, inicio, tramo)
+        inicio = tramo + timedelta(days=1)
+
+
+def exportar_ics(conn, desde, hasta, duracion=None, ahora=None):
+    """
+    Genera el calendario línea por línea, leyendo la agenda de a un tramo por vez,
+    sin armar el texto completo en memoria. Los turnos recurrentes salen como eventos sueltos
+    """
+    duracion = duracion or jornada.duracion_turno(conn)
+    sello = (ahora or datetime.now(timezone.utc)).strftime('%Y%m%dT%H%M%SZ')
+    yield from ('BEGIN:VCALENDAR\r\n', 'VERSION:2.0\r\n', f'PRODID:{PRODID}\r\n', 'CALSCALE:GREGORIAN\r\n')
+    for turno in _turnos_por_tramos(conn, desde, hasta):
+        comienzo = datetime.fromisoformat(f'{turno.fecha}T{turno.hora}')
+        yield 'BEGIN:VEVENT\r\n'
+        yield f'UID:turno-{turno.id}@consultorio\r\n'  # Las ocurrencias recurrentes ya llevan la fecha en el id
+        yield f'DTSTAMP:{sello}\r\n'
+        yield f'DTSTART:{comienzo:%Y%m%dT%H%M%S}\r\n'
+        yield f'DTEND:{comienzo + timedelta(minutes=duracion):%Y%m%dT%H%M%S}\r\n'
+        yield _plegar(f'SUMMARY:{_escapar(turno.nombre)}')
+        yield 'END:VEVENT\r\n'
+    yield 'END:VCALENDAR\r\n'
+
+
+def _desplegar(lineas):
+    """Une las líneas plegadas (las que empiezan con espacio o tabulación continúan la anterior)"""
+    anterior = None
+    for linea in lineas:
+        linea = linea.rstrip('\r\n')
+        if linea[:1] in (' ', '\t') and anterior is not None:
+            anterior += linea[1:]
+            continue
+        if anterior is not None:
+            yield anterior
+        anterior = linea
+    if anterior:
+        yield anterior
+
+
+def _fecha_hora(propiedad, valor):
+    """DTSTART -> (fecha, 'HH:MM'); None si es un evento de día completo"""
+    if 'VALUE=DATE' in propiedad.upper() and 'DATE-TIME' not in propiedad.upper():
+        return None
+    momento = datetime.strptime(valor[:15], '%Y%m%dT%H%M%S')
+    if valor.endswith('Z'):  # En UTC: se pasa a la hora local
+        momento = momento.replace(tzinfo=timezone.utc).astimezone()
+    return momento.date(), momento.strftime('%H:%M')
+
+
+def leer_eventos(lineas):
+    """
+    Eventos del archivo como (fecha, hora, resumen, motivo), con motivo None si se
+    puede importar o la razón por la que se omite (día completo, recurrente, sin fecha)
+    """
+    evento = None
+    for linea in _desplegar(lineas):
+        if linea.upper() == 'BEGIN:VEVENT':
+            evento = {}
+        elif linea.upper() == 'END:VEVENT' and evento is not None:
+            inicio = evento.get('DTSTART')
+            resumen = _desescapar(evento.get('SUMMARY', ('', ''))[1]).strip() or 'Sin nombre'
+            if inicio is None:
+                yield None, None, resumen, 'sin fecha'
+            elif 'RRULE' in evento:
+                yield None, None, resumen, 'recurrente'
+            else:
+                try:
+                    momento = _fecha_hora(*inicio)
+                except ValueError:
+                    yield None, None, resumen, 'fecha inválida'
+                else:
+                    if momento is None:
+                        yield None, None, resumen, 'día completo'
+                    else:
+                        yield momento[0], momento[1], resumen, None
+            evento = None
+        elif evento is not None and ':' in linea:
+            propiedad, valor = linea.split(':', 1)
+            evento[propiedad.split(';', 1)[0].upper()] = (propiedad, valor)
+
+
+def _superpone(inicios, minuto, duracion):
+    """`inicios` ordenados: alcanza con mirar el vecino de cada lado"""
+    i = bisect.bisect_left(inicios, minuto)
+    return ((i < len(inicios) and inicios[i] - minuto < duracion)
+            or (i > 0 and minuto - inicios[i - 1] < duracion))
+
+
+def importar_ics(conn, lineas, duracion=None):
+    """
+    Carga los eventos de un calendario como turnos en una sola transacción. La agenda
+    existente del rango se lee una vez; cada evento se compara contra los horarios
+    ordenados de su día (los existentes y los ya importados). Devuelve
+    {'importados': n, 'conflictos': [(fecha, hora, nombre)], 'omitidos': [(nombre, motivo)]}
+    """
+    eventos, omitidos = [], []
+    for fecha, hora, nombre, motivo in leer_eventos(lineas):
+        if motivo:
+            omitidos.append((nombre, motivo))
+        else:
+            eventos.append((fecha, hora, nombre))
+    reporte = {'importados': 0, 'conflictos': [], 'omitidos': omitidos}
+    if not eventos:
+        return reporte
+    eventos.sort()
+    duracion = duracion or jornada.duracion_turno(conn)
+
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        ocupados = {}
+        for turno in datos.obtener_turnos_rango(conn, eventos[0][0], eventos[-1][0]):
+            ocupados.setdefault(turno.fecha, []).append(recurrencias.a_minutos(turno.hora))
+        for inicios in ocupados.values():
+            inicios.sort()
+        nuevos = []
+        for fecha, hora, nombre in eventos:
+            inicios = ocupados.setdefault(fecha.isoformat(), [])
+            minuto = recurrencias.a_minutos(hora)
+            if _superpone(inicios, minuto, duracion):
+                reporte['conflictos'].append((fecha.isoformat(), hora, nombre))
+                continue
+            bisect.insort(inicios, minuto)
+            nuevos.append((nombre, fecha.isoformat(), hora))
+        conn.executemany('INSERT INTO turnos (nombre, fecha, hora) VALUES (?, ?, ?)', nuevos)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    reporte['importados'] = len(nuevos)
+    return reporte
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agenda en formato iCalendar (.ics)")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    exportar = sub.add_parser('exportar', help="Exportar los turnos de un período")
+    exportar.add_argument('desde')
+    exportar.add_argument('hasta')
+    exportar.add_argument('--salida', help="Archivo .ics (por defecto, la salida estándar)")
+    importar = sub.add_parser('importar', help="Cargar los eventos de un archivo .ics como turnos")
+    importar.add_argument('archivo')
+    args = parser.parse_args()
+
+    conn = conectar()
+    if args.accion == 'exportar':
+        salida = open(args.salida, 'w', newline='', encoding='utf-8') if args.salida else sys.stdout
+        for linea in exportar_ics(conn, date.fromisoformat(args.desde), date.fromisoformat(args.hasta)):
+            salida.write(linea)
+        if args.salida:
+            salida.close()
+    else:
+        with open(args.archivo, encoding='utf-8') as archivo_ics:
+            reporte = importar_ics(conn, archivo_ics)
+        print(f"{reporte['importados']} turnos importados")
+        for fecha, hora, nombre in reporte['conflictos']:
+            print(f'Conflicto: {fecha} {hora} {nombre}')
+        for nombre, motivo in reporte['omitidos']:
+            print(f'Omitido ({motivo}): {nombre}')
+    conn.close()
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import re
+import threading
+from datetime import date
+from urllib.parse import parse_qs, urlsplit
+
+import profesionales
+from almacenamiento import abrir_almacen
+from autenticacion import Autenticador, DemasiadosIntentos
+from configuracion import DB_PATH
+
+# API HTTP mínima (JSON) sobre la capa de datos, para consultar la agenda y dar turnos
+# desde el teléfono o la recepción sin abrir la aplicación de Streamlit.
+# Todas las rutas salvo POST /token piden "Authorization: Bearer <token>" (DELETE /token
+# lo revoca); cada pedido
+# trabaja sobre la base del profesional dueño del token (SQLite o una URL de PostgreSQL)
+
+HOST = '127.0.0.1'
+PUERTO = 8600
+TAMAÑO_POOL = 4  # Conexiones abiertas a cada base; también limita las consultas simultáneas
+MAX_CUERPO = 16 * 1024
+MAX_DIAS_AGENDA = 366
+LIMITE_BUSQUEDA = 50
+
+ESTADOS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 429: 'Too Many Requests',
+           500: 'Internal Server Error'}
+
+_HORA = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _fecha(valor, campo='fecha'):
+    try:
+        return date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        raise ErrorHTTP(400, f"'{campo}' debe tener el formato AAAA-MM-DD")
+
+
+def _hora(valor):
+    if not isinstance(valor, str) or not _HORA.match(valor):
+        raise ErrorHTTP(400, "'hora' debe tener el formato HH:MM")
+    return valor
+
+
+def _turno(turno):
+    return turno._asdict()
+
+
+class API:
+    """
+    Atiende los pedidos con asyncio; las consultas corren en hilos aparte, cada una
+    con una conexión tomada del pool, así una consulta lenta no frena a las demás
+    """
+
+    def __init__(self, ruta=DB_PATH, tamaño_pool=TAMAÑO_POOL):
+        self.ruta = ruta
+        self.tamaño_pool = tamaño_pool
+        self.almacenes = {ruta: abrir_almacen(ruta, tamaño_pool)}
+        self._abriendo = threading.Lock()
+        self.autenticador = Autenticador(ruta)
+        self.rutas = {
+            ('POST', '/token'): self.token,
+            ('DELETE', '/token'): self.cerrar_sesion,
+            ('GET', '/agenda'): self.agenda,
+            ('GET', '/disponibilidad'): self.disponibilidad,
+            ('POST', '/turnos'): self.reservar,
+            ('GET', '/pacientes'): self.pacientes,
+        }
+
+    def preparar(self):
+        self.almacenes[self.ruta].preparar()
+        self.autenticador.preparar()
+        with self.autenticador.pool.conexion() as conn:
+            profesionales.preparar(conn)
+
+    def _base(self, usuario):
+        with self.autenticador.pool.conexion() as conn:
+            return profesionales.ruta_base(conn, usuario)
+
+    def _almacen(self, base):
+        with self._abriendo:
+            almacen = self.almacenes.get(base)
+            if almacen is None:
+                almacen = abrir_almacen(base, self.tamaño_pool)
+                almacen.preparar()
+                self.almacenes[base] = almacen
+        return almacen
+
+    async def _consultar(self, base, metodo, *args):
+        """Llama a un método del almacenamiento de la base en un hilo aparte"""
+        almacen = await asyncio.to_thread(self._almacen, base)
+        return await asyncio.to_thread(getattr(almacen, metodo), *args)
+
+    # Rutas
+
+    async def token(self, base, parametros, cuerpo):
+        usuario, password = cuerpo.get('usuario'), cuerpo.get('password')
+        if not isinstance(usuario, str) or not isinstance(password, str):
+            raise ErrorHTTP(400, "Faltan 'usuario' y 'password'")
+        try:
+            correcta = await asyncio.to_thread(self.autenticador.verificar, usuario, password)
+        except DemasiadosIntentos as e:
+            raise ErrorHTTP(429, str(e))
+        if not correcta:
+            raise ErrorHTTP(401, 'Usuario o contraseña incorrectos')
+        return 201, {'token': await asyncio.to_thread(self.autenticador.emitir_token, usuario)}
+
+    async def cerrar_sesion(self, token):
+        await asyncio.to_thread(self.autenticador.revocar_token, token)
+        return 200, {'revocado': True}
+
+    async def agenda(self, base, parametros, cuerpo):
+        """?fecha=AAAA-MM-DD para un día, o ?desde=...&hasta=... para un rango"""
+        if 'fecha' in parametros:
+            turnos = await self._consultar(base, 'obtener_turnos_dia', _fecha(parametros['fecha']))
+        else:
+            desde, hasta = _fecha(parametros.get('desde'), 'desde'), _fecha(parametros.get('hasta'), 'hasta')
+            if not 0 <= (hasta - desde).days < MAX_DIAS_AGENDA:
+                raise ErrorHTTP(400, f'El rango debe ir hacia adelante y abarcar menos de {MAX_DIAS_AGENDA} días')
+            turnos = await self._consultar(base, 'obtener_turnos_rango', desde, hasta)
+        return 200, {'turnos': [_turno(turno) for turno in turnos]}
+
+    async def disponibilidad(self, base, parametros, cuerpo):
+        """Con ?hora= responde si ese horario está libre; sin ella, los horarios libres del día"""
+        fecha = _fecha(parametros.get('fecha'))
+        if 'hora' in parametros:
+            hora = _hora(parametros['hora'])
+            libre = await self._consultar(base, 'verificar_disponibilidad', fecha, hora)
+            return 200, {'fecha': fecha.isoformat(), 'hora': hora, 'disponible': libre}
+        libres = await self._consultar(base, 'horarios_libres', fecha)
+        return 200, {'fecha': fecha.isoformat(), 'libres': libres}
+
+    async def reservar(self, base, parametros, cuerpo):
+        nombre = cuerpo.get('nombre')
+        if not isinstance(nombre, str) or not nombre.strip():
+            raise ErrorHTTP(400, "Falta 'nombre'")
+        fecha, hora = _fecha(cuerpo.get('fecha')), _hora(cuerpo.get('hora'))
+        turno_id = await self._consultar(base, 'reservar_turno', nombre.strip(), fecha, hora)
+        if turno_id is None:
+            raise ErrorHTTP(409, 'El horario seleccionado no está disponible')
+        return 201, {'id': turno_id, 'nombre': nombre.strip(), 'fecha': fecha.isoformat(), 'hora': hora}
+
+    async def pacientes(self, base, parametros, cuerpo):
+        texto = parametros.get('q', '').strip()
+        if len(texto) < 2:
+            raise ErrorHTTP(400, "'q' debe tener al menos 2 caracteres")
+        try:
+            limite = int(parametros.get('limite', 20))
+        except ValueError:
+            raise ErrorHTTP(400, "'limite' debe ser un número")
+        if limite < 1:  # SQLite toma LIMIT -1 como "sin límite" y PostgreSQL lo rechaza
+            raise ErrorHTTP(400, "'limite' debe ser mayor que cero")
+        limite = max(1, min(limite, LIMITE_BUSQUEDA))
+        return 200, {'pacientes': await self._consultar(base, 'buscar_pacientes', texto, limite)}
+
+    # HTTP
+
+    async def _leer_pedido(self, reader):
+        linea = (await reader.readline()).decode('latin-1').strip()
+        if not linea:
+            return None
+        try:
+            metodo, destino, _ = linea.split(' ', 2)
+        except ValueError:
+            raise ErrorHTTP(400, 'Pedido mal formado')
+        cabeceras = {}
+        while True:
+            cabecera = (await reader.readline()).decode('latin-1').strip()
+            if not cabecera:
+                break
+            nombre, _, valor = cabecera.partition(':')
+            cabeceras[nombre.strip().lower()] = valor.strip()
+
+        try:
+            largo = int(cabeceras.get('content-length') or 0)
+        except ValueError:
+            raise ErrorHTTP(400, 'Content-Length inválido')
+        if largo > MAX_CUERPO:
+            raise ErrorHTTP(413, 'Cuerpo demasiado grande')
+        cuerpo = {}
+        if largo:
+            try:
+                cuerpo = json.loads(await reader.readexactly(largo))
+            except ValueError:
+                raise ErrorHTTP(400, 'El cuerpo debe ser JSON')
+            if not isinstance(cuerpo, dict):
+                raise ErrorHTTP(400, 'El cuerpo debe ser un objeto JSON')
+        partes = urlsplit(destino)
+        parametros = {clave: valores[-1] for clave, valores in parse_qs(partes.query).items()}
+        return metodo.upper(), partes.path.rstrip('/') or '/', parametros, cabeceras, cuerpo
+
+    async def _despachar(self, metodo, ruta, parametros, cabeceras, cuerpo):
+        manejador = self.rutas.get((metodo, ruta))
+        if manejador is None:
+            if any(r == ruta for _, r in self.rutas):
+                raise ErrorHTTP(405, 'Método no permitido')
+            raise ErrorHTTP(404, 'Ruta inexistente')
+        base = None
+        if manejador != self.token:
+            tipo, _, token = cabeceras.get('authorization', '').partition(' ')
+            usuario = await asyncio.to_thread(self.autenticador.validar_token, token) if tipo.lower() == 'bearer' else None
+            if not usuario:
+                raise ErrorHTTP(401, 'Token ausente, inválido o vencido')
+            if manejador == self.cerrar_sesion:  # La única ruta que usa el token en sí
+                return await manejador(token)
+            base = await asyncio.to_thread(self._base, usuario)
+        return await manejador(base, parametros, cuerpo)
+
+    async def atender(self, reader, writer):
+        """Un pedido por conexión: se responde y se cierra"""
+        try:
+            try:
+                pedido = await self._leer_pedido(reader)
+                if pedido is None:
+                    return
+                estado, respuesta = await self._despachar(*pedido)
+            except ErrorHTTP as e:
+                estado, respuesta = e.estado, {'error': str(e)}
+            except Exception as e:
+                estado, respuesta = 500, {'error': f'{type(e).__name__}: {e}'}
+            contenido = json.dumps(respuesta, ensure_ascii=False).encode('utf-8')
+            writer.write(
+                f'HTTP/1.1 {estado} {ESTADOS[estado]}\r\n'
+                f'Content-Type: application/json; charset=utf-8\r\n'
+                f'Content-Length: {len(contenido)}\r\n'
+                f'Connection: close\r\n\r\n'.encode('latin-1') + contenido)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def servir(self, host=HOST, puerto=PUERTO):
+        await asyncio.to_thread(self.preparar)
+        servidor = await asyncio.start_server(self.atender, host, puerto)
+        async with servidor:
+            await servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API JSON de la agenda del consultorio")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--pool', type=int, default=TAMAÑO_POOL, help="Conexiones abiertas a la base")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    print(f'Escuchando en http://{args.host}:{args.puerto}')
+    try:
+        asyncio.run(API(args.db, args.pool).servir(args.host, args.puerto))
+    except KeyboardInterrupt:
+        pass
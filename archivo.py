@@ -0,0 +1,168 @@
+import argparse
+import os
+from datetime import date, timedelta
+
+from configuracion import conectar
+
+ARCHIVO_PATH = 'archivo.db'
+ESQUEMA = 'archivo'
+TABLAS = ('pacientes', 'sesiones')
+
+
+def archivo_adjunto(conn):
+    return any(fila[1] == ESQUEMA for fila in conn.execute('PRAGMA database_list'))
+
+
+def archivo_de(ruta_db):
+    """Ruta del archivo de una base: va junto a ella (una por profesional)"""
+    return os.path.join(os.path.dirname(ruta_db), ARCHIVO_PATH)
+
+
+def ruta_archivo(conn):
+    """El archivo de la base principal de la conexión"""
+    principal = next((fila[2] for fila in conn.execute('PRAGMA database_list') if fila[1] == 'main'), '')
+    return archivo_de(principal)
+
+
+def adjuntar_archivo(conn, ruta=None):
+    """
+    Adjunta archivo.db a la conexión (si no lo estaba) y asegura sus tablas
+    """
+    if not archivo_adjunto(conn):
+        conn.commit()  # ATTACH no puede ejecutarse dentro de una transacción
+        conn.execute('ATTACH DATABASE ? AS archivo', (ruta or ruta_archivo(conn),))
+    asegurar_tablas_archivo(conn)
+
+
+def asegurar_tablas_archivo(conn):
+    """
+    Crea en el archivo las tablas con las mismas columnas que las tablas vivas,
+    agregando las columnas que falten si el esquema principal cambió
+    """
+    for tabla in TABLAS:
+        columnas = conn.execute(f'PRAGMA main.table_info({tabla})').fetchall()
+        existentes = {fila[1] for fila in conn.execute(f'PRAGMA {ESQUEMA}.table_info({tabla})')}
+        if not existentes:
+            # Sin claves foráneas: una sesión vieja puede archivarse aunque su paciente siga activo
+            definicion = ', '.join(
+                f'"{c[1]}" {c[2]}' + (' PRIMARY KEY' if c[5] else '') for c in columnas
+            )
+            conn.execute(f'CREATE TABLE {ESQUEMA}.{tabla} ({definicion})')
+        else:
+            for c in columnas:
+                if c[1] not in existentes:
+                    conn.execute(f'ALTER TABLE {ESQUEMA}.{tabla} ADD COLUMN "{c[1]}" {c[2]}')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {ESQUEMA}.idx_archivo_sesiones_paciente ON sesiones (paciente_id, fecha)')
+    conn.commit()
+
+
+def _lista_columnas(conn, tabla):
+    return ', '.join(f'"{fila[1]}"' for fila in conn.execute(f'PRAGMA main.table_info({tabla})'))
+
+
+def fuente(conn, tabla, incluir_archivo=False):
+    """
+    Devuelve la expresión SQL para leer una tabla, incluyendo o no los datos archivados.
+    La columna extra `archivado` indica de dónde viene cada fila
+    """
+    if not incluir_archivo:
+        return f'(SELECT *, 0 AS archivado FROM main.{tabla})'
+    adjuntar_archivo(conn)
+    columnas = _lista_columnas(conn, tabla)
+    return (f'(SELECT {columnas}, 0 AS archivado FROM main.{tabla} '
+            f'UNION ALL SELECT {columnas}, 1 AS archivado FROM {ESQUEMA}.{tabla})')
+
+
+def _mover(conn, tabla, condicion, parametros, origen='main', destino=ESQUEMA):
+    columnas = _lista_columnas(conn, tabla)
+    conn.execute(f'''
+    INSERT OR REPLACE INTO {destino}.{tabla} ({columnas})
+    SELECT {columnas} FROM {origen}.{tabla} WHERE {condicion}
+    ''', parametros)
+    cursor = conn.execute(f'DELETE FROM {origen}.{tabla} WHERE {condicion}', parametros)
+    return cursor.rowcount
+
+
+def _en_transaccion(conn, funcion):
+    try:
+        resultado = funcion()
+        conn.commit()
+        return resultado
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def archivar(conn, años=3, lote=200):
+    """
+    Mueve al archivo los pacientes inactivos (con todas sus sesiones) y las sesiones
+    con más de `años` de antigüedad. Cada lote se mueve en su propia transacción
+    """
+    adjuntar_archivo(conn)
+    limite = (date.today() - timedelta(days=365 * años)).isoformat()
+    reporte = {'pacientes': 0, 'sesiones': 0, 'lotes': 0}
+
+    while True:
+        ids = [fila[0] for fila in conn.execute(
+            'SELECT id FROM main.pacientes WHERE NOT actividad ORDER BY id LIMIT ?', (lote,))]
+        if not ids:
+            break
+        marcas = ','.join('?' * len(ids))
+
+        def mover_pacientes():
+            reporte['sesiones'] += _mover(conn, 'sesiones', f'paciente_id IN ({marcas})', ids)
+            reporte['pacientes'] += _mover(conn, 'pacientes', f'id IN ({marcas})', ids)
+
+        _en_transaccion(conn, mover_pacientes)
+        reporte['lotes'] += 1
+
+    while True:
+        ids = [fila[0] for fila in conn.execute(
+            'SELECT id FROM main.sesiones WHERE fecha < ? ORDER BY id LIMIT ?', (limite, lote))]
+        if not ids:
+            break
+        marcas = ','.join('?' * len(ids))
+
+        def mover_sesiones():
+            reporte['sesiones'] += _mover(conn, 'sesiones', f'id IN ({marcas})', ids)
+
+        _en_transaccion(conn, mover_sesiones)
+        reporte['lotes'] += 1
+
+    return reporte
+
+
+def restaurar_paciente(conn, paciente_id):
+    """
+    Devuelve a las tablas vivas un paciente archivado y todas sus sesiones, marcándolo activo
+    """
+    adjuntar_archivo(conn)
+
+    def restaurar():
+        # Primero el paciente: con las claves foráneas activas, sus sesiones lo necesitan
+        pacientes = _mover(conn, 'pacientes', 'id = ?', (paciente_id,), origen=ESQUEMA, destino='main')
+        sesiones = _mover(conn, 'sesiones', 'paciente_id = ?', (paciente_id,), origen=ESQUEMA, destino='main')
+        conn.execute('UPDATE main.pacientes SET actividad = 1 WHERE id = ?', (paciente_id,))
+        return {'pacientes': pacientes, 'sesiones': sesiones}
+
+    return _en_transaccion(conn, restaurar)
+
+
+def esta_archivado(conn, paciente_id):
+    adjuntar_archivo(conn)
+    return conn.execute(f'SELECT 1 FROM {ESQUEMA}.pacientes WHERE id = ?', (paciente_id,)).fetchone() is not None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archivo de pacientes inactivos y sesiones antiguas")
+    parser.add_argument('--años', type=int, default=3)
+    parser.add_argument('--lote', type=int, default=200)
+    parser.add_argument('--restaurar', type=int, metavar='PACIENTE_ID')
+    args = parser.parse_args()
+
+    conn = conectar()
+    if args.restaurar:
+        print(restaurar_paciente(conn, args.restaurar))
+    else:
+        print(archivar(conn, args.años, args.lote))
+    conn.close()
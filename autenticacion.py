@@ -0,0 +1,262 @@
+import base64
+import hashlib
+import hmac
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+from configuracion import DB_PATH, conectar, crear_tabla_configuracion, obtener_config, guardar_config
+
+ALGORITMO = 'pbkdf2_sha256'
+ITERACIONES = 600_000
+MAX_INTENTOS = 5  # Intentos fallidos permitidos por usuario dentro de la ventana
+VENTANA_SEGUNDOS = 300
+MAX_USUARIOS_VIGILADOS = 10_000  # Tope de nombres con fallos recientes que se recuerdan
+DURACION_TOKEN = 12 * 3600
+CLAVE_SECRETO = 'auth_secreto'
+USUARIO_INICIAL = ('Mariel', 'kenti')
+
+
+class DemasiadosIntentos(Exception):
+    """El usuario superó los intentos fallidos permitidos; `espera` son los segundos que faltan"""
+
+    def __init__(self, espera):
+        super().__init__(f'Demasiados intentos fallidos. Vuelva a intentar en {int(espera) + 1} segundos')
+        self.espera = espera
+
+
+def hashear(password, iteraciones=ITERACIONES):
+    """Hash con sal y PBKDF2-SHA256, guardado como algoritmo$iteraciones$sal$hash"""
+    sal = secrets.token_bytes(16)
+    derivado = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), sal, iteraciones)
+    return f'{ALGORITMO}${iteraciones}${sal.hex()}${derivado.hex()}'
+
+
+def verificar_hash(password, guardado):
+    """
+    Compara una contraseña con el hash guardado. Devuelve (correcta, hay_que_actualizar):
+    los hashes viejos (SHA-256 sin sal) o con menos iteraciones se actualizan al entrar
+    """
+    if '$' not in guardado:
+        viejo = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(viejo, guardado), True
+    algoritmo, iteraciones, sal, esperado = guardado.split('$')
+    if algoritmo != ALGORITMO:
+        return False, False
+    derivado = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(sal), int(iteraciones))
+    correcta = hmac.compare_digest(derivado.hex(), esperado)
+    return correcta, correcta and int(iteraciones) < ITERACIONES
+
+
+@lru_cache(maxsize=1)
+def _hash_ficticio():
+    """Hash de referencia para usuarios inexistentes: la respuesta tarda lo mismo exista o no el usuario"""
+    return hashear(secrets.token_hex(8))
+
+
+class PoolConexiones:
+    """Conexiones abiertas una vez y reutilizadas entre pedidos (y entre hilos)"""
+
+    def __init__(self, ruta=DB_PATH, tamaño=2):
+        self.ruta = ruta
+        self._libres = queue.Queue()
+        for _ in range(tamaño):
+            self._libres.put(conectar(ruta, check_same_thread=False, timeout=30))
+
+    @contextmanager
+    def conexion(self):
+        conn = self._libres.get()
+        try:
+            yield conn
+        finally:
+            self._libres.put(conn)
+
+    def cerrar(self):
+        while not self._libres.empty():
+            self._libres.get_nowait().close()
+
+
+class LimiteIntentos:
+    """Cuenta los intentos fallidos recientes de cada usuario para frenar la fuerza bruta"""
+
+    def __init__(self, maximo=MAX_INTENTOS, ventana=VENTANA_SEGUNDOS, max_usuarios=MAX_USUARIOS_VIGILADOS):
+        self.maximo = maximo
+        self.ventana = ventana
+        self.max_usuarios = max_usuarios
+        self._fallos = {}
+        self._lock = threading.Lock()
+
+    def _recientes(self, usuario, ahora):
+        """Fallos dentro de la ventana; consultar no agrega al usuario, y si no le queda ninguno se lo olvida"""
+        fallos = self._fallos.get(usuario)
+        if fallos is None:
+            return ()
+        while fallos and fallos[0] <= ahora - self.ventana:
+            fallos.popleft()
+        if not fallos:
+            del self._fallos[usuario]
+        return fallos
+
+    def comprobar(self, usuario):
+        """Lanza DemasiadosIntentos si el usuario está bloqueado"""
+        ahora = time.monotonic()
+        with self._lock:
+            fallos = self._recientes(usuario, ahora)
+            if len(fallos) >= self.maximo:
+                raise DemasiadosIntentos(fallos[0] + self.ventana - ahora)
+
+    def fallo(self, usuario):
+        ahora = time.monotonic()
+        with self._lock:
+            fallos = self._recientes(usuario, ahora) or None
+            if fallos is None:
+                if len(self._fallos) >= self.max_usuarios:
+                    # Ante una lluvia de nombres inventados se olvidan primero los fallos más viejos
+                    for viejo in list(self._fallos):
+                        self._recientes(viejo, ahora)
+                    while len(self._fallos) >= self.max_usuarios:
+                        del self._fallos[next(iter(self._fallos))]
+                fallos = self._fallos[usuario] = deque()
+            fallos.append(ahora)
+
+    def limpiar(self, usuario):
+        with self._lock:
+            self._fallos.pop(usuario, None)
+
+
+def crear_tabla_usuarios(conn, usuario_inicial=USUARIO_INICIAL):
+    """Crea la tabla de usuarios y, si no existe, el usuario inicial"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL
+    )
+    ''')
+    if usuario_inicial:
+        usuario, password = usuario_inicial
+        if not conn.execute('SELECT 1 FROM users WHERE username = ?', (usuario,)).fetchone():
+            conn.execute('INSERT INTO users (username, password) VALUES (?, ?)', (usuario, hashear(password)))
+    conn.commit()
+
+
+def crear_tabla_sesiones(conn):
+    """Sesiones abiertas con un token: cerrar la sesión borra la fila y el token deja de valer"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sesiones_auth (
+        id TEXT PRIMARY KEY,
+        usuario TEXT NOT NULL,
+        expira INTEGER NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+def _b64(datos):
+    return base64.urlsafe_b64encode(datos).rstrip(b'=').decode('ascii')
+
+
+def _desde_b64(texto):
+    return base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4))
+
+
+class Autenticador:
+    """
+    Verificación de usuarios con conexiones reutilizadas, límite de intentos por usuario
+    y tokens firmados para retomar una sesión sin volver a calcular el hash
+    """
+
+    def __init__(self, ruta=DB_PATH, tamaño_pool=2):
+        self.pool = PoolConexiones(ruta, tamaño_pool)
+        self.limite = LimiteIntentos()
+        self._secreto = None
+
+    def preparar(self):
+        """Crea las tablas y el secreto de firma (una sola vez por proceso, no en cada rerun)"""
+        with self.pool.conexion() as conn:
+            crear_tabla_configuracion(conn)
+            crear_tabla_usuarios(conn)
+            crear_tabla_sesiones(conn)
+            secreto = obtener_config(conn, CLAVE_SECRETO)
+            if secreto is None:
+                secreto = secrets.token_hex(32)
+                guardar_config(conn, CLAVE_SECRETO, secreto)
+        self._secreto = bytes.fromhex(secreto)
+
+    def _hash_guardado(self, usuario):
+        with self.pool.conexion() as conn:
+            fila = conn.execute('SELECT password FROM users WHERE username = ?', (usuario,)).fetchone()
+        return fila[0] if fila else None
+
+    def verificar(self, usuario, password):
+        """
+        True si las credenciales son correctas. Un hash viejo se reemplaza por uno nuevo
+        en el momento. Lanza DemasiadosIntentos sin calcular ningún hash si el usuario está bloqueado
+        """
+        self.limite.comprobar(usuario)
+        guardado = self._hash_guardado(usuario)
+        correcta, actualizar = verificar_hash(password, guardado or _hash_ficticio())
+        correcta = correcta and guardado is not None
+        if not correcta:
+            self.limite.fallo(usuario)
+            return False
+        self.limite.limpiar(usuario)
+        if actualizar:
+            with self.pool.conexion() as conn:
+                conn.execute('UPDATE users SET password = ? WHERE username = ?', (hashear(password), usuario))
+                conn.commit()
+        return True
+
+    def _firma(self, carga, guardado):
+        # La firma incluye el hash guardado: cambiar la contraseña invalida los tokens emitidos
+        return hmac.new(self._secreto, carga.encode('utf-8') + guardado.encode('ascii'), hashlib.sha256).digest()
+
+    def emitir_token(self, usuario, duracion=DURACION_TOKEN):
+        """
+        Token firmado con el id de una sesión guardada en la base: además de vencer,
+        se puede revocar (revocar_token) antes de tiempo
+        """
+        sesion, expira = secrets.token_urlsafe(16), int(time.time()) + duracion
+        with self.pool.conexion() as conn:
+            conn.execute('DELETE FROM sesiones_auth WHERE expira < ?', (int(time.time()),))
+            conn.execute('INSERT INTO sesiones_auth (id, usuario, expira) VALUES (?, ?, ?)', (sesion, usuario, expira))
+            conn.commit()
+        carga = _b64(f'{usuario}|{expira}|{sesion}'.encode('utf-8'))
+        return f'{carga}.{_b64(self._firma(carga, self._hash_guardado(usuario)))}'
+
+    def _leer_token(self, token):
+        """(usuario, id de sesión) si la firma es auténtica y no venció; si no, None"""
+        try:
+            carga, firma = token.split('.')
+            usuario, expira, sesion = _desde_b64(carga).decode('utf-8').rsplit('|', 2)
+            if int(expira) < time.time():
+                return None
+            guardado = self._hash_guardado(usuario)
+            if guardado is None or not hmac.compare_digest(_desde_b64(firma), self._firma(carga, guardado)):
+                return None
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return usuario, sesion
+
+    def validar_token(self, token):
+        """Devuelve el usuario si el token es auténtico, no venció y su sesión sigue abierta; si no, None"""
+        leido = self._leer_token(token)
+        if leido is None:
+            return None
+        usuario, sesion = leido
+        with self.pool.conexion() as conn:
+            abierta = conn.execute('SELECT 1 FROM sesiones_auth WHERE id = ? AND usuario = ?',
+                                   (sesion, usuario)).fetchone()
+        return usuario if abierta else None
+
+    def revocar_token(self, token):
+        """Cierra la sesión del token: desde ese momento ya no se acepta"""
+        leido = self._leer_token(token)
+        if leido is not None:
+            with self.pool.conexion() as conn:
+                conn.execute('DELETE FROM sesiones_auth WHERE id = ?', (leido[1],))
+                conn.commit()
@@ -0,0 +1,217 @@
+"""
+Mediciones de rendimiento sobre bases en memoria con datos sintéticos.
+Uso: python benchmarks.py <nombre>   (sin argumentos corre todas)
+"""
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+import cifrado
+import compresion
+import dataframes
+import datos
+import duplicados
+import modelos
+
+PALABRAS = ("el paciente trabajó lectura comprensiva con buena atención sostenida "
+            "se observan avances en escritura y cálculo mental dificultades en la "
+            "organización de tareas escolares se acuerda con la familia rutina semanal").split()
+
+
+def _nota_aleatoria(rng, palabras=80):
+    return ' '.join(rng.choice(PALABRAS) for _ in range(palabras))
+
+
+def _medir(funcion, repeticiones=5):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+
+def bench_notas(n=5000):
+    """Latencia de lectura de notas con y sin compresión"""
+    rng = random.Random(0)
+    notas = [_nota_aleatoria(rng) for _ in range(n)]
+    resultados = {}
+    for modo in ('plano', 'comprimido'):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE sesiones (id INTEGER PRIMARY KEY, paciente_id INTEGER, notas TEXT)')
+        filas = [(i % 50, compresion.comprimir_nota(t) if modo == 'comprimido' else t)
+                 for i, t in enumerate(notas)]
+        conn.executemany('INSERT INTO sesiones (paciente_id, notas) VALUES (?, ?)', filas)
+        conn.commit()
+
+        def leer():
+            for paciente_id in range(50):
+                filas = conn.execute('SELECT id, paciente_id, NULL, notas FROM sesiones WHERE paciente_id = ?',
+                                     (paciente_id,)).fetchall()
+                compresion.descomprimir_filas(filas)
+
+        bytes_totales = conn.execute('SELECT SUM(length(CAST(notas AS BLOB))) FROM sesiones').fetchone()[0]
+        resultados[modo] = {'segundos': round(_medir(leer), 4), 'bytes': bytes_totales}
+        conn.close()
+    return resultados
+
+
+class _SesionSlots:
+    __slots__ = modelos.Sesion._fields
+
+    def __init__(self, *valores):
+        for campo, valor in zip(self.__slots__, valores):
+            setattr(self, campo, valor)
+
+
+def bench_filas(n=500_000):
+    """Memoria y costo de construcción de n filas de sesiones según el tipo de fila"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f'CREATE TABLE sesiones ({modelos.columnas(modelos.Sesion)})')
+    conn.executemany('INSERT INTO sesiones VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     ((i, i % 300, '2025-01-01', 'nota', 1, i % 2, 1500.0, None) for i in range(n)))
+    fabricas = {
+        'tupla': None,
+        'Sesion (NamedTuple)': modelos.fabrica(modelos.Sesion),
+        '__slots__': lambda cursor, fila: _SesionSlots(*fila),
+        'sqlite3.Row': sqlite3.Row,
+        'dict': lambda cursor, fila: dict(zip(modelos.Sesion._fields, fila)),
+    }
+    resultados = {}
+    for nombre, fabrica in fabricas.items():
+        cursor = conn.cursor()
+        cursor.row_factory = fabrica
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        filas = cursor.execute('SELECT * FROM sesiones').fetchall()
+        segundos = time.perf_counter() - inicio
+        memoria = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        resultados[nombre] = {'segundos': round(segundos, 3), 'MB': round(memoria / 2**20, 1)}
+        del filas
+    conn.close()
+    return resultados
+
+
+def bench_pacientes_df(n=100_000):
+    """Memoria del DataFrame de pacientes: fetchall + object contra la carga tipada por tandas"""
+    import pandas as pd
+
+    conn = sqlite3.connect(':memory:')
+    campos = modelos.Paciente._fields
+    conn.execute(f'CREATE TABLE pacientes ({", ".join(campos)}, archivado)')
+    obras_sociales = ['Ninguna', 'Prensa', 'Galeno', 'OSDE', 'Swiss Medical', 'Medife', 'PAMI', 'Sancor Salud']
+    conn.executemany(f'INSERT INTO pacientes VALUES ({", ".join("?" * (len(campos) + 1))})', (
+        (i, f'Nombre{i}', f'Apellido{i}', 20_000_000 + i, '2015-03-01', 'Padre', '351555', 'Madre', '351556',
+         None, None, 'Calle 123', 'Motivo', 'Escuela', 2015 + i % 10, None,
+         random.choice(obras_sociales), str(i), 'Diagnóstico', i % 3 != 0, 0)
+        for i in range(n)))
+    sql = f'SELECT {modelos.columnas(modelos.Paciente)}, archivado FROM pacientes'
+
+    def medir(cargar):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        df = cargar()
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return df, {'segundos': round(segundos, 3), 'pico_MB': round(pico / 2**20, 1),
+                    'df_MB': round(dataframes.memoria_df(df)['total'] / 2**20, 1)}
+
+    _, antes = medir(lambda: pd.DataFrame(conn.execute(sql).fetchall(), columns=list(campos) + ['archivado']))
+    df, despues = medir(lambda: dataframes.leer_df(conn, sql, tipos=dataframes.TIPOS_PACIENTES))
+    _, subconjunto = medir(lambda: dataframes.leer_df(
+        conn, 'SELECT id, nombre, apellido, obra_social, actividad FROM pacientes', tipos=dataframes.TIPOS_PACIENTES))
+    conn.close()
+    columnas = dataframes.memoria_df(df)['columnas']
+    return {'fetchall + object': antes, 'leer_df': despues, 'leer_df (5 columnas)': subconjunto,
+            'KB por columna tipada': {c: round(columnas[c] / 1024) for c in dataframes.TIPOS_PACIENTES}}
+
+
+def bench_duplicados(n=100_000, repetidos=1000):
+    """Búsqueda de pacientes duplicados por bloques sobre n pacientes con algunos cargados dos veces"""
+    rng = random.Random(0)
+    nombres = ['María', 'Juan', 'José', 'Ana', 'Carlos', 'Lucía', 'Sofía', 'Mateo', 'Martina', 'Valentina']
+    apellidos = ['González', 'Rodríguez', 'Gómez', 'Fernández', 'López', 'Díaz', 'Martínez', 'Pérez', 'Vázquez', 'Sosa']
+    filas = [(rng.choice(nombres), f'{rng.choice(apellidos)} {rng.choice(apellidos)}', 20_000_000 + i,
+              f'{rng.randint(2005, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}') for i in range(n)]
+    # Copias con el apellido sin tildes, o sin DNI, o con otra fecha de nacimiento
+    for nombre, apellido, dni, nacimiento in rng.sample(filas, repetidos):
+        cambio = rng.randrange(3)
+        filas.append((nombre, duplicados.normalizar(apellido).title() if cambio == 0 else apellido,
+                      0 if cambio == 1 else dni, None if cambio == 2 else nacimiento))
+    conn = sqlite3.connect(':memory:')
+    datos.crear_esquema(conn)
+    conn.executemany('INSERT INTO pacientes (nombre, apellido, dni, fecha_nacimiento) VALUES (?, ?, ?, ?)', filas)
+    conn.commit()
+
+    inicio = time.perf_counter()
+    encontradas = duplicados.sugerencias(conn)
+    segundos = time.perf_counter() - inicio
+    conn.close()
+    return {'pacientes': len(filas), 'segundos': round(segundos, 2), 'sugerencias': len(encontradas),
+            'repetidos': repetidos}
+
+
+def bench_cifrado(n_pacientes=2000, sesiones_por_paciente=20, pagina=20):
+    """
+    Lista de pacientes e historial de sesiones con los datos clínicos cifrados y sin cifrar.
+    La lista se lee como está guardada y solo se descifran las fichas que se muestran;
+    'lista descifrando todo' es lo que costaría descifrar cada fila al leerla
+    """
+    os.environ.setdefault(cifrado.VARIABLE_CLAVE, 'frase de prueba para benchmarks')
+    rng = random.Random(0)
+    notas = [_nota_aleatoria(rng) for _ in range(n_pacientes * sesiones_por_paciente)]
+    resultados = {}
+    for modo in ('plano', 'cifrado'):
+        conn = sqlite3.connect(':memory:')
+        datos.crear_esquema(conn)
+        inicio = time.perf_counter()
+        cifrado.activar_cifrado(conn, modo == 'cifrado')  # La primera vez deriva la clave del proceso
+        derivacion = time.perf_counter() - inicio
+        sellar = cifrado.cifrador(conn) or (lambda valor: valor)
+        conn.executemany('INSERT INTO pacientes (id, nombre, apellido, dni, motivo_consulta, diagnostico) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         ((i, f'Nombre{i}', f'Apellido{i}', 20_000_000 + i, sellar(_nota_aleatoria(rng, 30)),
+                           sellar('Dislexia')) for i in range(n_pacientes)))
+        conn.executemany('INSERT INTO sesiones (paciente_id, fecha, notas) VALUES (?, ?, ?)',
+                         ((i % n_pacientes, f'2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}', sellar(nota))
+                          for i, nota in enumerate(notas)))
+        conn.commit()
+
+        def lista():
+            pacientes = datos.obtener_pacientes(conn)
+            for paciente in pacientes[:pagina]:
+                cifrado.descifrar_paciente(paciente)
+
+        def lista_completa():
+            for paciente in datos.obtener_pacientes(conn):
+                cifrado.descifrar_paciente(paciente)
+
+        def historial():
+            for paciente_id in range(0, n_pacientes, n_pacientes // 50):
+                datos.obtener_sesiones(conn, paciente_id)
+
+        resultados[modo] = {'derivar_clave': round(derivacion, 3), 'lista': round(_medir(lista), 4),
+                            'lista descifrando todo': round(_medir(lista_completa), 4),
+                            'historial (50 pacientes)': round(_medir(historial), 4)}
+        conn.close()
+    return resultados
+
+
+BENCHMARKS = {
+    'notas': bench_notas,
+    'filas': bench_filas,
+    'pacientes_df': bench_pacientes_df,
+    'duplicados': bench_duplicados,
+    'cifrado': bench_cifrado,
+}
+
+
+if __name__ == "__main__":
+    nombres = sys.argv[1:] or list(BENCHMARKS)
+    for nombre in nombres:
+        print(nombre, BENCHMARKS[nombre]())
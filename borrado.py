@@ -0,0 +1,207 @@
+import argparse
+import os
+import re
+
+import archivo
+from configuracion import conectar, obtener_bool, guardar_bool, crear_tabla_configuracion
+
+CLAVE_CONFIG = 'borrado_logico'
+# Los turnos guardan el nombre como texto libre, no el id: se buscan por nombre completo
+NOMBRES_TURNO = "lower(trim(nombre)) IN (lower(:nombre || ' ' || :apellido), lower(:apellido || ' ' || :nombre))"
+# Pacientes con ese mismo nombre completo: si hay más de uno, un turno no se sabe de quién es
+NOMBRES_PACIENTE = ("lower(trim(nombre) || ' ' || trim(apellido)) "
+                    "IN (lower(:nombre || ' ' || :apellido), lower(:apellido || ' ' || :nombre))")
+
+
+def preparar_borrado(conn):
+    """
+    Activa las claves foráneas en la conexión, migra `sesiones` a ON DELETE CASCADE
+    y crea la columna e índices parciales del borrado lógico
+    """
+    conn.execute('PRAGMA foreign_keys = ON')
+    migrar_cascada(conn)
+    if 'eliminado' not in {fila[1] for fila in conn.execute('PRAGMA table_info(pacientes)')}:
+        conn.execute('ALTER TABLE pacientes ADD COLUMN eliminado DATE')
+    # Índices parciales: los pacientes vigentes (lo que se lista siempre) y la papelera por separado
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pacientes_vigentes ON pacientes (apellido, nombre) WHERE eliminado IS NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pacientes_eliminados ON pacientes (eliminado) WHERE eliminado IS NOT NULL')
+    conn.commit()
+
+
+def migrar_cascada(conn):
+    """
+    Reconstruye `sesiones` con su clave foránea en ON DELETE CASCADE (SQLite no permite
+    cambiar una FOREIGN KEY con ALTER TABLE), conservando datos, índices y triggers.
+    Devuelve True si hizo falta migrar
+    """
+    claves = conn.execute('PRAGMA foreign_key_list(sesiones)').fetchall()
+    if any(clave[2] == 'pacientes' and clave[6] == 'CASCADE' for clave in claves):
+        return False
+
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sesiones'").fetchone()[0]
+    nuevo, reemplazos = re.subn(r'REFERENCES\s+pacientes\s*\(\s*id\s*\)(\s+ON\s+DELETE\s+(SET\s+NULL|SET\s+DEFAULT|NO\s+ACTION|\w+))?',
+                                'REFERENCES pacientes(id) ON DELETE CASCADE', sql, flags=re.IGNORECASE)
+    if not reemplazos:
+        nuevo = sql.rstrip().rstrip(')') + ',\n    FOREIGN KEY (paciente_id) REFERENCES pacientes(id) ON DELETE CASCADE\n)'
+    nuevo = re.sub(r'CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?"?sesiones"?', 'CREATE TABLE sesiones_nueva',
+                   nuevo, count=1, flags=re.IGNORECASE)
+    dependientes = [fila[0] for fila in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'sesiones' AND type IN ('index', 'trigger') AND sql IS NOT NULL")]
+    columnas = ', '.join(f'"{fila[1]}"' for fila in conn.execute('PRAGMA table_info(sesiones)'))
+
+    conn.commit()  # Los PRAGMA de abajo no tienen efecto dentro de una transacción
+    conn.execute('PRAGMA foreign_keys = OFF')
+    # Sin esto, el RENAME falla por los triggers de otras tablas que nombran a `sesiones`
+    conn.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(nuevo)
+        conn.execute(f'INSERT INTO sesiones_nueva ({columnas}) SELECT {columnas} FROM sesiones')
+        conn.execute('DROP TABLE sesiones')
+        conn.execute('ALTER TABLE sesiones_nueva RENAME TO sesiones')
+        for sql in dependientes:
+            conn.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('PRAGMA legacy_alter_table = OFF')
+        conn.execute('PRAGMA foreign_keys = ON')
+    return True
+
+
+def sesiones_huerfanas(conn):
+    """Sesiones cuyo paciente no existe (quedaron de antes de activar las claves foráneas)"""
+    return len(conn.execute('PRAGMA foreign_key_check(sesiones)').fetchall())
+
+
+def borrado_logico_activo(conn):
+    return obtener_bool(conn, CLAVE_CONFIG, False)
+
+
+def activar_borrado_logico(conn, activo=True):
+    guardar_bool(conn, CLAVE_CONFIG, activo)
+
+
+def nombre_compartido(conn, nombres, excluir):
+    """
+    True si otro paciente (fuera de los ids de `excluir`; vigente, en la papelera o archivado)
+    tiene el mismo nombre completo. Entonces sus turnos no se distinguen y no se tocan
+    """
+    esquemas = ['main'] + ([archivo.ESQUEMA] if archivo.archivo_adjunto(conn) else [])
+    for esquema in esquemas:
+        consulta = f'SELECT id FROM {esquema}.pacientes WHERE {NOMBRES_PACIENTE}'
+        if any(fila[0] not in excluir for fila in conn.execute(consulta, nombres)):
+            return True
+    return False
+
+
+def _borrar(conn, paciente_ids):
+    """
+    Borrado físico: las sesiones caen en cascada; los turnos y reglas se buscan por nombre,
+    salvo que otro paciente se llame igual (se cuentan en 'ambiguos' y quedan como están).
+    Si el archivo está adjunto, lo que el paciente tenga archivado se borra también
+    """
+    reporte = {'pacientes': 0, 'sesiones': 0, 'turnos': 0, 'reglas': 0, 'ambiguos': 0}
+    esquemas = ['main'] + ([archivo.ESQUEMA] if archivo.archivo_adjunto(conn) else [])
+    for paciente_id in paciente_ids:
+        fila = next(filter(None, (conn.execute(f'SELECT nombre, apellido FROM {esquema}.pacientes WHERE id = ?',
+                                               (paciente_id,)).fetchone() for esquema in esquemas)), None)
+        if fila is None:
+            continue
+        nombres = {'nombre': fila[0].strip(), 'apellido': fila[1].strip()}
+        reporte['sesiones'] += conn.execute('SELECT COUNT(*) FROM main.sesiones WHERE paciente_id = ?',
+                                            (paciente_id,)).fetchone()[0]
+        if nombre_compartido(conn, nombres, set(paciente_ids)):
+            reporte['ambiguos'] += 1
+        else:
+            reporte['turnos'] += conn.execute(f'DELETE FROM turnos WHERE {NOMBRES_TURNO}', nombres).rowcount
+            # Las excepciones de cada regla caen en cascada
+            reporte['reglas'] += conn.execute(f'DELETE FROM turnos_recurrentes WHERE {NOMBRES_TURNO}',
+                                              nombres).rowcount
+        reporte['pacientes'] += conn.execute('DELETE FROM main.pacientes WHERE id = ?', (paciente_id,)).rowcount
+        if archivo.ESQUEMA in esquemas:
+            # El archivo no tiene claves foráneas: ahí las sesiones no caen en cascada
+            reporte['sesiones'] += conn.execute(f'DELETE FROM {archivo.ESQUEMA}.sesiones WHERE paciente_id = ?',
+                                                (paciente_id,)).rowcount
+            reporte['pacientes'] += conn.execute(f'DELETE FROM {archivo.ESQUEMA}.pacientes WHERE id = ?',
+                                                 (paciente_id,)).rowcount
+    return reporte
+
+
+def _adjuntar_archivo(conn):
+    """ATTACH no puede ir dentro de la transacción del borrado: se adjunta antes, si el archivo existe"""
+    if not archivo.archivo_adjunto(conn) and os.path.exists(archivo.ruta_archivo(conn)):
+        archivo.adjuntar_archivo(conn)
+
+
+def _en_transaccion(conn, funcion):
+    conn.commit()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        resultado = funcion()
+        conn.commit()
+        return resultado
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def eliminar_paciente(conn, paciente_id, logico=None):
+    """
+    Elimina un paciente en una sola transacción. Con borrado lógico (por defecto, según
+    la configuración) solo se lo marca como eliminado y deja de aparecer en las listas;
+    si no, se borran el paciente, sus sesiones y sus turnos
+    """
+    if logico is None:
+        logico = borrado_logico_activo(conn)
+    if logico:
+        return _en_transaccion(conn, lambda: {'pacientes': conn.execute(
+            "UPDATE pacientes SET eliminado = date('now') WHERE id = ? AND eliminado IS NULL",
+            (paciente_id,)).rowcount})
+    _adjuntar_archivo(conn)
+    return _en_transaccion(conn, lambda: _borrar(conn, [paciente_id]))
+
+
+def restaurar_paciente(conn, paciente_id):
+    """Saca a un paciente de la papelera"""
+    conn.execute('UPDATE pacientes SET eliminado = NULL WHERE id = ?', (paciente_id,))
+    conn.commit()
+
+
+def pacientes_eliminados(conn):
+    return conn.execute('''
+    SELECT id, nombre, apellido, eliminado FROM pacientes
+    WHERE eliminado IS NOT NULL
+    ORDER BY eliminado
+    ''').fetchall()
+
+
+def vaciar_papelera(conn, antes=None):
+    """Borra físicamente los pacientes marcados como eliminados (opcionalmente, solo los anteriores a una fecha)"""
+    ids = [fila[0] for fila in conn.execute('''
+    SELECT id FROM pacientes
+    WHERE eliminado IS NOT NULL AND (:antes IS NULL OR eliminado < :antes)
+    ''', {'antes': antes})]
+    _adjuntar_archivo(conn)
+    return _en_transaccion(conn, lambda: _borrar(conn, ids))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Borrado de pacientes y papelera")
+    parser.add_argument('accion', choices=['migrar', 'papelera', 'vaciar'])
+    parser.add_argument('--antes', help="Con 'vaciar', solo los eliminados antes de esta fecha (AAAA-MM-DD)")
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tabla_configuracion(conn)
+    preparar_borrado(conn)
+    if args.accion == 'migrar':
+        print(f"Sesiones sin paciente: {sesiones_huerfanas(conn)}")
+    elif args.accion == 'papelera':
+        for fila in pacientes_eliminados(conn):
+            print(*fila, sep='\t')
+    else:
+        print(vaciar_papelera(conn, args.antes))
+    conn.close()
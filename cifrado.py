@@ -0,0 +1,281 @@
+import argparse
+import hashlib
+import os
+import secrets
+import threading
+
+import archivo
+import compresion  # compresion importa este módulo: solo se usa dentro de las funciones
+from configuracion import conectar, obtener_config, obtener_bool, guardar_bool, crear_tabla_configuracion
+
+# Cifrado autenticado (AES-GCM) de los datos clínicos: notas de sesión, diagnóstico y
+# motivo de consulta. Los valores cifrados se guardan como BLOB con este prefijo, la sal
+# de la base y el nonce; los que siguen en texto plano conviven sin problema.
+# La clave sale de una frase que no se guarda en la base (variable de entorno) y se
+# deriva una sola vez por proceso: derivarla cuesta lo mismo que verificar una contraseña
+PREFIJO = b'CF1'
+LARGO_SAL = 16
+LARGO_NONCE = 12
+ITERACIONES = 600_000  # Las mismas que las contraseñas de autenticacion.py
+VARIABLE_CLAVE = 'CONSULTORIO_CLAVE'
+CLAVE_CONFIG = 'cifrar_datos_clinicos'
+CLAVE_SAL = 'cifrado_sal'
+CLAVE_VERIFICADOR = 'cifrado_verificador'
+VERIFICACION = b'consultorio'
+CAMPOS_PACIENTE = ('diagnostico', 'motivo_consulta')
+
+_claves = {}  # sal -> AESGCM, una derivación por proceso y por sal
+_verificadas = set()  # sales cuya frase ya se comprobó contra el verificador de la base
+_bloqueo = threading.Lock()  # La API y los repartidores usan el módulo desde varios hilos
+
+
+class ClaveIncorrecta(Exception):
+    """La frase de la variable de entorno no es la que se usó para cifrar"""
+
+
+def _aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise RuntimeError('Para cifrar los datos clínicos hace falta instalar cryptography')
+    return AESGCM
+
+
+def _clave(sal):
+    """Clave derivada de la frase y la sal; se calcula la primera vez y queda en memoria"""
+    clave = _claves.get(sal)
+    if clave is None:
+        AESGCM = _aesgcm()
+        frase = os.environ.get(VARIABLE_CLAVE)
+        if not frase:
+            raise RuntimeError(f'Falta la frase de cifrado (variable de entorno {VARIABLE_CLAVE})')
+        with _bloqueo:
+            clave = _claves.get(sal)
+            if clave is None:
+                clave = AESGCM(hashlib.pbkdf2_hmac('sha256', frase.encode('utf-8'), sal, ITERACIONES))
+                _claves[sal] = clave
+    return clave
+
+
+def _sellar(sal, datos):
+    nonce = secrets.token_bytes(LARGO_NONCE)
+    return PREFIJO + sal + nonce + _clave(sal).encrypt(nonce, datos, None)
+
+
+def _abrir(valor):
+    from cryptography.exceptions import InvalidTag
+
+    inicio = len(PREFIJO)
+    sal = valor[inicio:inicio + LARGO_SAL]
+    nonce = valor[inicio + LARGO_SAL:inicio + LARGO_SAL + LARGO_NONCE]
+    try:
+        return _clave(sal).decrypt(nonce, valor[inicio + LARGO_SAL + LARGO_NONCE:], None)
+    except InvalidTag:
+        raise ClaveIncorrecta('No se pudo descifrar: la frase de cifrado no es la correcta o el dato está dañado')
+
+
+def cifrado_activo(conn):
+    return obtener_bool(conn, CLAVE_CONFIG, False)
+
+
+def activar_cifrado(conn, activo=True):
+    """
+    Al activarlo por primera vez se genera la sal de la base y un verificador, así una
+    frase equivocada se detecta antes de cifrar nada con ella
+    """
+    if activo:
+        _sal(conn)
+    guardar_bool(conn, CLAVE_CONFIG, activo)
+
+
+def _muestra_cifrada(conn, sal):
+    """Algún valor ya sellado con la sal, para comprobar la frase si falta el verificador"""
+    for tabla, campo in (('sesiones', 'notas'), ('pacientes', 'diagnostico'), ('pacientes', 'motivo_consulta')):
+        fila = conn.execute(f'''
+        SELECT {campo} FROM {tabla} WHERE substr(CAST({campo} AS BLOB), 1, ?) = ? LIMIT 1
+        ''', (len(PREFIJO) + LARGO_SAL, PREFIJO + sal)).fetchone()
+        if fila:
+            return fila[0]
+    return None
+
+
+def _guardar_sal(conn, sal, verificador):
+    """La sal y el verificador se guardan juntos: nunca queda una sal sin verificador"""
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('''
+        INSERT INTO configuracion (clave, valor) VALUES (?, ?)
+        ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor
+        ''', [(CLAVE_SAL, sal.hex()), (CLAVE_VERIFICADOR, verificador.hex())])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _sal(conn):
+    """
+    Sal de la base (se crea la primera vez), con la frase ya comprobada contra el verificador.
+    La clave se deriva y el verificador se sella antes de guardar nada: sin frase no queda
+    una sal a medias. Una sal sin verificador (de una versión anterior) se acepta solo si
+    la frase abre lo que ya se cifró con ella, y entonces se le agrega el verificador
+    """
+    sal = obtener_config(conn, CLAVE_SAL)
+    if sal is None:
+        sal = secrets.token_bytes(LARGO_SAL)
+        _guardar_sal(conn, sal, _sellar(sal, VERIFICACION))
+        _verificadas.add(sal)
+        return sal
+    sal = bytes.fromhex(sal)
+    if sal not in _verificadas:
+        verificador = obtener_config(conn, CLAVE_VERIFICADOR)
+        if verificador is None:
+            muestra = _muestra_cifrada(conn, sal)
+            if muestra is not None:
+                _abrir(muestra)  # ClaveIncorrecta si la frase no es la que se usó
+            _guardar_sal(conn, sal, _sellar(sal, VERIFICACION))
+        elif _abrir(bytes.fromhex(verificador)) != VERIFICACION:
+            raise ClaveIncorrecta('La frase de cifrado no es la de esta base')
+        _verificadas.add(sal)
+    return sal
+
+
+def cifrador(conn):
+    """
+    Función que sella un valor (texto o bytes) con la clave de la base, o None si el
+    cifrado no está activo. Conviene pedirla una vez por tanda de escrituras
+    """
+    if not cifrado_activo(conn):
+        return None
+    sal = _sal(conn)
+
+    def sellar(valor):
+        if not valor or cifrado(valor):
+            return valor
+        return _sellar(sal, valor.encode('utf-8') if isinstance(valor, str) else valor)
+    return sellar
+
+
+def cifrar(conn, valor):
+    """El valor listo para guardar según el modo configurado"""
+    sellar = cifrador(conn)
+    return sellar(valor) if sellar else valor
+
+
+def cifrado(valor):
+    return isinstance(valor, bytes) and valor.startswith(PREFIJO)
+
+
+def descifrar(valor):
+    """Los bytes que se cifraron (que pueden ser una nota comprimida) o el valor tal cual"""
+    return _abrir(valor) if cifrado(valor) else valor
+
+
+def texto(valor):
+    """Devuelve siempre el texto del campo, esté o no cifrado"""
+    valor = descifrar(valor)
+    return valor.decode('utf-8') if isinstance(valor, bytes) else valor
+
+
+def cifrar_paciente(conn, paciente):
+    """El Paciente listo para guardar: diagnóstico y motivo de consulta cifrados si corresponde"""
+    sellar = cifrador(conn)
+    if sellar is None:
+        return paciente
+    return paciente._replace(**{campo: sellar(getattr(paciente, campo)) for campo in CAMPOS_PACIENTE})
+
+
+def descifrar_paciente(paciente):
+    """El mismo Paciente con el diagnóstico y el motivo de consulta legibles"""
+    if not any(cifrado(getattr(paciente, campo)) for campo in CAMPOS_PACIENTE):
+        return paciente
+    return paciente._replace(**{campo: texto(getattr(paciente, campo)) for campo in CAMPOS_PACIENTE})
+
+
+def _migrar_tabla(conn, tabla, campos, sal, lote, reporte):
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(f'''
+        SELECT id, {', '.join(campos)} FROM {tabla}
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+        ''', (ultimo_id, lote)).fetchall()
+        if not filas:
+            break
+
+        cambios = []
+        for fila in filas:
+            originales = fila[1:]
+            nuevos = []
+            for valor in originales:
+                if sal is not None and cifrado(valor) and valor[len(PREFIJO):len(PREFIJO) + LARGO_SAL] == sal:
+                    nuevos.append(valor)  # Ya está cifrado con la sal de esta base
+                    continue
+                contenido = descifrar(valor)
+                if sal is not None and contenido is not None:
+                    nuevos.append(_sellar(sal, contenido.encode('utf-8') if isinstance(contenido, str) else contenido))
+                elif isinstance(contenido, bytes) and not contenido.startswith(compresion.PREFIJO):
+                    nuevos.append(contenido.decode('utf-8'))
+                else:
+                    nuevos.append(contenido)  # Las notas comprimidas siguen siendo BLOB
+            if any(nuevo is not viejo for nuevo, viejo in zip(nuevos, originales)):
+                cambios.append((*nuevos, fila[0]))
+
+        if cambios:
+            conn.executemany(f'''
+            UPDATE {tabla} SET {', '.join(f'{campo} = ?' for campo in campos)} WHERE id = ?
+            ''', cambios)
+        conn.commit()
+
+        reporte['filas_revisadas'] += len(filas)
+        reporte['filas_modificadas'] += len(cambios)
+        ultimo_id = filas[-1][0]
+
+
+def _tablas_clinicas(conn):
+    """Las tablas con datos clínicos y sus campos, incluidas las del archivo si existe"""
+    tablas = [('sesiones', ('notas',)), ('pacientes', CAMPOS_PACIENTE)]
+    if archivo.archivo_adjunto(conn) or os.path.exists(archivo.ruta_archivo(conn)):
+        archivo.adjuntar_archivo(conn)
+        tablas += [(f'{archivo.ESQUEMA}.{tabla}', campos) for tabla, campos in tablas]
+    return tablas
+
+
+def migrar(conn, cifrar=True, lote=500):
+    """
+    Cifra (o descifra) los datos clínicos existentes por lotes, un commit por lote: una
+    base grande no queda bloqueada mientras tanto y si se corta se puede retomar.
+    También las sesiones y pacientes archivados en archivo.db. Lo que estaba cifrado con
+    otra sal (datos traídos de otra base) se vuelve a sellar con la de esta.
+    Devuelve {tabla: reporte}
+    """
+    sal = _sal(conn) if cifrar else None
+    resultado = {}
+    for tabla, campos in _tablas_clinicas(conn):
+        resultado[tabla] = {'filas_revisadas': 0, 'filas_modificadas': 0}
+        _migrar_tabla(conn, tabla, campos, sal, lote, resultado[tabla])
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Cifrado de datos clínicos (frase en {VARIABLE_CLAVE})")
+    parser.add_argument('accion', choices=['migrar', 'revertir', 'estado'])
+    parser.add_argument('--lote', type=int, default=500)
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tabla_configuracion(conn)
+    if args.accion == 'migrar':
+        activar_cifrado(conn, True)
+        print(migrar(conn, cifrar=True, lote=args.lote))
+    elif args.accion == 'revertir':
+        activar_cifrado(conn, False)
+        print(migrar(conn, cifrar=False, lote=args.lote))
+    for tabla, campo in [(tabla, campo) for tabla, campos in _tablas_clinicas(conn) for campo in campos]:
+        total, cifrados = conn.execute(f'''
+        SELECT COUNT({campo}), COUNT(CASE WHEN substr(CAST({campo} AS BLOB), 1, 3) = ? THEN 1 END) FROM {tabla}
+        ''', (PREFIJO,)).fetchone()
+        print(f'{tabla}.{campo}: {cifrados} de {total} cifrados')
+    conn.close()
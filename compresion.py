@@ -0,0 +1,156 @@
+import argparse
+import zlib
+
+import cifrado
+from configuracion import conectar, obtener_bool, guardar_bool, crear_tabla_configuracion
+
+# Las notas comprimidas se guardan como BLOB con este prefijo;
+# las notas en texto plano siguen siendo TEXT, así conviven ambos formatos.
+PREFIJO = b'ZN1'
+UMBRAL_BYTES = 128
+NIVEL = 6
+CLAVE_CONFIG = 'comprimir_notas'
+
+
+def comprimir_nota(texto):
+    """
+    Comprime una nota con zlib. Las notas cortas (o que no se achican) quedan en texto plano
+    """
+    if texto is None:
+        return None
+    datos = texto.encode('utf-8')
+    if len(datos) < UMBRAL_BYTES:
+        return texto
+    comprimido = PREFIJO + zlib.compress(datos, NIVEL)
+    if len(comprimido) >= len(datos):
+        return texto
+    return comprimido
+
+
+def descomprimir_nota(valor):
+    """
+    Devuelve siempre el texto de la nota, esté o no comprimida (o cifrada)
+    """
+    valor = cifrado.descifrar(valor)
+    if isinstance(valor, bytes):
+        if valor.startswith(PREFIJO):
+            return zlib.decompress(valor[len(PREFIJO):]).decode('utf-8')
+        return valor.decode('utf-8')
+    return valor
+
+
+def compresion_activa(conn):
+    return obtener_bool(conn, CLAVE_CONFIG, False)
+
+
+def activar_compresion(conn, activo=True):
+    guardar_bool(conn, CLAVE_CONFIG, activo)
+
+
+def preparar_nota(conn, texto):
+    """
+    Devuelve la nota lista para guardar según el modo configurado: primero se comprime
+    (cifrada ya no se achicaría) y después se cifra
+    """
+    if compresion_activa(conn):
+        texto = comprimir_nota(texto)
+    return cifrado.cifrar(conn, texto)
+
+
+def descomprimir_filas(filas, indice=3):
+    """
+    Descomprime la columna de notas en una lista de filas de sesiones,
+    conservando el tipo de fila (tupla o Sesion)
+    """
+    resultado = []
+    for fila in filas:
+        if isinstance(fila[indice], bytes):
+            valores = list(fila)
+            valores[indice] = descomprimir_nota(valores[indice])
+            fila = type(fila)._make(valores) if hasattr(fila, '_make') else tuple(valores)
+        resultado.append(fila)
+    return resultado
+
+
+def migrar_notas(conn, lote=500, comprimir=True):
+    """
+    Comprime (o descomprime) las notas existentes por lotes, un commit por lote.
+    Devuelve un reporte con las filas modificadas y los bytes antes y después
+    """
+    reporte = {'filas_revisadas': 0, 'filas_modificadas': 0, 'bytes_antes': 0, 'bytes_despues': 0}
+    sellar = cifrado.cifrador(conn)
+    ultimo_id = 0
+    while True:
+        filas = conn.execute('''
+        SELECT id, notas FROM sesiones
+        WHERE id > ? AND notas IS NOT NULL
+        ORDER BY id
+        LIMIT ?
+        ''', (ultimo_id, lote)).fetchall()
+        if not filas:
+            break
+
+        cambios = []
+        for sesion_id, notas in filas:
+            texto = descomprimir_nota(notas)
+            nuevo = comprimir_nota(texto) if comprimir else texto
+            # Se compara contra lo que había debajo del cifrado: una nota cifrada que no
+            # cambia de formato no se vuelve a escribir, y la que cambia se vuelve a cifrar
+            guardada = cifrado.descifrar(notas)
+            if cifrado.cifrado(notas) and not guardada.startswith(PREFIJO):
+                guardada = guardada.decode('utf-8')
+            antes = len(guardada) if isinstance(guardada, bytes) else len(guardada.encode('utf-8'))
+            despues = len(nuevo) if isinstance(nuevo, bytes) else len(nuevo.encode('utf-8'))
+            reporte['bytes_antes'] += antes
+            reporte['bytes_despues'] += despues
+            if type(nuevo) is not type(guardada) or nuevo != guardada:
+                cambios.append((sellar(nuevo) if sellar and cifrado.cifrado(notas) else nuevo, sesion_id))
+
+        if cambios:
+            conn.executemany('UPDATE sesiones SET notas = ? WHERE id = ?', cambios)
+        conn.commit()
+
+        reporte['filas_revisadas'] += len(filas)
+        reporte['filas_modificadas'] += len(cambios)
+        ultimo_id = filas[-1][0]
+
+    reporte['bytes_ahorrados'] = reporte['bytes_antes'] - reporte['bytes_despues']
+    return reporte
+
+
+def reporte_espacio(conn):
+    """
+    Informa cuánto ocupan las notas guardadas y cuánto ocuparían sin comprimir
+    """
+    reporte = {'notas': 0, 'comprimidas': 0, 'bytes_guardados': 0, 'bytes_sin_comprimir': 0}
+    for (notas,) in conn.execute('SELECT notas FROM sesiones WHERE notas IS NOT NULL'):
+        reporte['notas'] += 1
+        if isinstance(notas, bytes) and cifrado.descifrar(notas).startswith(PREFIJO):
+            reporte['comprimidas'] += 1
+            reporte['bytes_guardados'] += len(notas)
+            reporte['bytes_sin_comprimir'] += len(descomprimir_nota(notas).encode('utf-8'))
+        else:
+            tamaño = len(notas) if isinstance(notas, bytes) else len(notas.encode('utf-8'))
+            reporte['bytes_guardados'] += tamaño
+            reporte['bytes_sin_comprimir'] += tamaño
+    reporte['bytes_ahorrados'] = reporte['bytes_sin_comprimir'] - reporte['bytes_guardados']
+    reporte['paginas_libres'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return reporte
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compresión de notas de sesión")
+    parser.add_argument('accion', choices=['migrar', 'revertir', 'reporte'])
+    parser.add_argument('--lote', type=int, default=500)
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tabla_configuracion(conn)
+    if args.accion == 'migrar':
+        activar_compresion(conn, True)
+        print(migrar_notas(conn, args.lote, comprimir=True))
+    elif args.accion == 'revertir':
+        activar_compresion(conn, False)
+        print(migrar_notas(conn, args.lote, comprimir=False))
+    print(reporte_espacio(conn))
+    conn.close()
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+
+DB_PATH = 'consultorio.db'
+
+
+def conectar(ruta=DB_PATH, **opciones):
+    """
+    Abre una conexión a la base de datos del consultorio, con las claves foráneas activas.
+    Las opciones se pasan a sqlite3.connect (p. ej. check_same_thread, timeout)
+    """
+    conn = sqlite3.connect(ruta, **opciones)
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+
+def carpeta_de(ruta, nombre):
+    """
+    Carpeta de archivos generados (respaldos, historias, facturas) junto a una base.
+    Cada profesional tiene su propia base y, con ella, sus propias carpetas
+    """
+    return os.path.join(os.path.dirname(ruta), nombre)
+
+
+def crear_tabla_configuracion(conn):
+    """Crea la tabla de parámetros (clave/valor) si no existe"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS configuracion (
+        clave TEXT PRIMARY KEY,
+        valor TEXT
+    )
+    ''')
+    conn.commit()
+
+
+def obtener_config(conn, clave, defecto=None):
+    """Devuelve el valor guardado para una clave o el valor por defecto"""
+    fila = conn.execute('SELECT valor FROM configuracion WHERE clave = ?', (clave,)).fetchone()
+    return fila[0] if fila else defecto
+
+
+def guardar_config(conn, clave, valor):
+    """Guarda (o reemplaza) el valor de una clave"""
+    conn.execute('''
+    INSERT INTO configuracion (clave, valor) VALUES (?, ?)
+    ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor
+    ''', (clave, None if valor is None else str(valor)))
+    conn.commit()
+
+
+def obtener_bool(conn, clave, defecto=False):
+    """Lee una clave guardada como '1'/'0'"""
+    valor = obtener_config(conn, clave)
+    if valor is None:
+        return defecto
+    return valor == '1'
+
+
+def guardar_bool(conn, clave, valor):
+    guardar_config(conn, clave, '1' if valor else '0')
@@ -0,0 +1,263 @@
+"""
+Comprobaciones de conformidad de los almacenamientos: las mismas operaciones tienen que
+dar los mismos resultados en SQLite y en PostgreSQL.
+Uso: python conformidad.py                      (SQLite, en una base temporal)
+     python conformidad.py --postgres URL       (además, contra una base PostgreSQL vacía)
+     python conformidad.py --postgres-local     (además, contra un PostgreSQL levantado para la ocasión)
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager, nullcontext
+
+from almacenamiento import AlmacenPostgres, AlmacenSQLite
+from modelos import Paciente
+
+
+def _paciente(nombre, apellido, dni, **campos):
+    return Paciente(None, nombre, apellido, dni, **campos)
+
+
+def comprobar_pacientes(almacen):
+    ana = almacen.agregar_paciente(_paciente('Ana', 'Pérez', 30111222, obra_social='OSDE', email='ana@x.com'))
+    beto = almacen.agregar_paciente(_paciente('Beto', 'Alvarez', 28999000, diagnostico='Dislexia'))
+    assert [p.apellido for p in almacen.obtener_pacientes()] == ['Alvarez', 'Pérez']
+
+    paciente = almacen.obtener_paciente(ana)
+    assert (paciente.nombre, paciente.dni, paciente.obra_social, paciente.email) == ('Ana', 30111222, 'OSDE', 'ana@x.com')
+    assert almacen.obtener_paciente(beto).diagnostico == 'Dislexia'
+    assert almacen.obtener_paciente(ana + beto + 1) is None
+
+    almacen.actualizar_paciente(paciente._replace(domicilio='Mitre 123', actividad=False))
+    paciente = almacen.obtener_paciente(ana)
+    assert paciente.domicilio == 'Mitre 123' and not paciente.actividad
+
+
+def comprobar_busqueda(almacen):
+    almacen.agregar_paciente(_paciente('Ana', 'Pérez', 30111222))
+    almacen.agregar_paciente(_paciente('Anabel', 'Gómez', 40222333))
+    almacen.agregar_paciente(_paciente('Beto', 'Alvarez', 28999000))
+    assert [p['apellido'] for p in almacen.buscar_pacientes('ana')] == ['Gómez', 'Pérez']
+    assert [p['apellido'] for p in almacen.buscar_pacientes('Ana Pérez')] == ['Pérez']
+    assert [p['apellido'] for p in almacen.buscar_pacientes('Pérez Ana')] == ['Pérez']
+    assert [p['nombre'] for p in almacen.buscar_pacientes('2899')] == ['Beto']
+    assert len(almacen.buscar_pacientes('a', limite=2)) == 2
+    assert set(almacen.buscar_pacientes('beto')[0]) == {'id', 'nombre', 'apellido', 'dni', 'obra_social',
+                                                        'telefono_paciente', 'email', 'actividad'}
+
+
+def comprobar_sesiones(almacen):
+    paciente = almacen.agregar_paciente(_paciente('Ana', 'Pérez', 30111222))
+    nota_larga = 'Trabajó comprensión lectora con buena atención sostenida. ' * 20
+    primera = almacen.agregar_sesion(paciente, '2026-03-02', 'Primera', True, True, 1000.0, 'A-1')
+    almacen.agregar_sesion(paciente, '2026-03-09', nota_larga, True, False, 1500.0, None)
+    almacen.agregar_sesion(paciente, '2026-03-16', '', False, False, 0.0, None)
+
+    sesiones = almacen.obtener_sesiones(paciente)
+    assert [s.fecha for s in sesiones] == ['2026-03-16', '2026-03-09', '2026-03-02']
+    assert sesiones[1].notas == nota_larga and sesiones[1].monto == 1500.0
+    assert bool(sesiones[2].pago) and sesiones[2].numero_factura == 'A-1'
+    assert [s.fecha for s in almacen.obtener_sesiones(paciente, limite=2)] == ['2026-03-16', '2026-03-09']
+
+    almacen.actualizar_sesion(primera, '2026-03-03', 'Corregida', False, True, 1200.0, 'A-2')
+    sesion = almacen.obtener_sesiones(paciente)[-1]
+    assert (sesion.fecha, sesion.notas, bool(sesion.asistio), sesion.monto) == ('2026-03-03', 'Corregida', False, 1200.0)
+
+    almacen.eliminar_sesion(primera)
+    assert len(almacen.obtener_sesiones(paciente)) == 2
+
+
+def comprobar_turnos(almacen):
+    almacen.agregar_turno('Ana Pérez', '2026-03-02', '10:00')
+    almacen.agregar_turno('Beto Alvarez', '2026-03-02', '08:40')
+    almacen.agregar_turno('Ana Pérez', '2026-03-05', '09:20')
+    assert [(t.nombre, t.hora) for t in almacen.obtener_turnos_dia('2026-03-02')] == [
+        ('Beto Alvarez', '08:40'), ('Ana Pérez', '10:00')]
+    assert [(t.fecha, t.hora) for t in almacen.obtener_turnos_rango('2026-03-01', '2026-03-31')] == [
+        ('2026-03-02', '08:40'), ('2026-03-02', '10:00'), ('2026-03-05', '09:20')]
+
+    assert not almacen.verificar_disponibilidad('2026-03-02', '10:30')
+    assert not almacen.verificar_disponibilidad('2026-03-02', '09:30')
+    assert almacen.verificar_disponibilidad('2026-03-02', '10:40')
+    libres = almacen.horarios_libres('2026-03-02')
+    assert '08:40' not in libres and '10:00' not in libres
+    assert '08:00' in libres and '09:20' in libres and '10:40' in libres
+
+    turno = almacen.obtener_turnos_dia('2026-03-05')[0]
+    almacen.eliminar_turno(turno.id)
+    assert almacen.obtener_turnos_dia('2026-03-05') == []
+    assert almacen.eliminar_turnos_por_nombre('Ana Pérez') == 1
+
+
+def comprobar_reservas(almacen):
+    assert almacen.reservar_turno('Ana Pérez', '2026-03-02', '10:00') is not None
+    assert almacen.reservar_turno('Beto Alvarez', '2026-03-02', '10:20') is None
+    assert almacen.reservar_turno('Beto Alvarez', '2026-03-03', '10:20') is not None
+
+    # Muchos pedidos a la vez por el mismo horario: uno solo lo consigue
+    resultados = []
+    hilos = [threading.Thread(target=lambda i=i: resultados.append(
+        almacen.reservar_turno(f'Paciente {i}', '2026-03-04', '11:00'))) for i in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert sum(resultado is not None for resultado in resultados) == 1
+    assert len(almacen.obtener_turnos_dia('2026-03-04')) == 1
+
+
+def comprobar_recurrentes(almacen):
+    almacen.agregar_turno('Beto Alvarez', '2026-03-09', '10:20')
+    # Lunes a las 10:00 durante marzo: el 9 choca con el turno de Beto
+    regla, conflictos = almacen.agregar_regla('Ana Pérez', 0, '10:00', '2026-03-01', '2026-03-31')
+    assert conflictos == ['2026-03-09']
+    turnos = [t for t in almacen.obtener_turnos_rango('2026-03-01', '2026-03-31') if t.nombre == 'Ana Pérez']
+    assert [t.fecha for t in turnos] == ['2026-03-02', '2026-03-16', '2026-03-23', '2026-03-30']
+    assert turnos[0].id == f'R{regla}-2026-03-02'
+    assert not almacen.verificar_disponibilidad('2026-03-16', '10:00')
+
+    almacen.eliminar_turno(turnos[1].id)  # Cancela solo el 16
+    assert almacen.verificar_disponibilidad('2026-03-16', '10:00')
+    assert [t.fecha for t in almacen.obtener_turnos_rango('2026-03-01', '2026-03-31')
+            if t.nombre == 'Ana Pérez'] == ['2026-03-02', '2026-03-23', '2026-03-30']
+    assert almacen.reservar_turno('Carla Ruiz', '2026-03-23', '10:20') is None
+
+    assert almacen.eliminar_turnos_por_nombre('Ana Pérez') == 1
+    assert almacen.obtener_turnos_dia('2026-03-23') == []
+
+    # Miércoles sin fecha de fin: se revisa hasta el último turno concreto, aunque pase del año
+    almacen.agregar_turno('Beto Alvarez', '2028-06-14', '10:20')
+    _, conflictos = almacen.agregar_regla('Dora Gil', 2, '10:00', '2026-03-04')
+    assert conflictos == ['2028-06-14']
+    try:
+        almacen.agregar_regla('Eva Paz', 2, '10:20', '2027-06-02')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Dos reglas sin fin superpuestas deberían rechazarse')
+    assert [t.nombre for t in almacen.obtener_turnos_dia('2029-01-03')] == ['Dora Gil']
+
+
+def comprobar_jornada(almacen):
+    # Martes de 09:00 a 13:00 con una pausa, turnos de 30 minutos, sin lunes y con un feriado
+    almacen.guardar_duracion(30)
+    almacen.guardar_dia(1, '9:00', '13:00', [('11:00', '11:30')])
+    almacen.quitar_dia(0)
+    almacen.agregar_feriado('2026-03-10', 'Feriado')
+    assert almacen.duracion_turno() == 30
+    assert almacen.obtener_jornada()[1] == ('09:00', '13:00', [('11:00', '11:30')])
+    assert 0 not in almacen.obtener_jornada()
+    assert almacen.obtener_feriados() == [('2026-03-10', 'Feriado')]
+
+    assert almacen.horarios_libres('2026-03-03') == ['09:00', '09:30', '10:00', '10:30', '11:30', '12:00', '12:30']
+    assert almacen.horarios_libres('2026-03-10') == []  # Feriado
+    assert almacen.horarios_libres('2026-03-02') == []  # Lunes
+    assert not almacen.verificar_disponibilidad('2026-03-03', '10:45')  # Pisa la pausa
+    assert almacen.reservar_turno('Ana Pérez', '2026-03-03', '12:45') is None  # Pasa el cierre
+    assert almacen.reservar_turno('Ana Pérez', '2026-03-02', '10:00') is None
+    assert almacen.reservar_turno('Ana Pérez', '2026-03-10', '10:00') is None
+    assert almacen.reservar_turno('Ana Pérez', '2026-03-08', '03:00') is None  # Domingo de madrugada
+    assert almacen.reservar_turno('Ana Pérez', '2026-03-03', '10:00') is not None
+    assert almacen.reservar_turno('Beto Alvarez', '2026-03-03', '10:15') is None
+    assert almacen.horarios_libres('2026-03-03') == ['09:00', '09:30', '10:30', '11:30', '12:00', '12:30']
+
+    almacen.quitar_feriado('2026-03-10')
+    assert almacen.verificar_disponibilidad('2026-03-10', '10:00')
+
+
+COMPROBACIONES = {
+    'pacientes': comprobar_pacientes,
+    'busqueda': comprobar_busqueda,
+    'sesiones': comprobar_sesiones,
+    'turnos': comprobar_turnos,
+    'reservas': comprobar_reservas,
+    'recurrentes': comprobar_recurrentes,
+    'jornada': comprobar_jornada,
+}
+
+
+def correr(almacen, nombres=None):
+    """Corre cada comprobación sobre el almacenamiento vacío. Devuelve [(nombre, error o None)]"""
+    almacen.preparar()
+    resultados = []
+    for nombre in nombres or COMPROBACIONES:
+        almacen.vaciar()
+        try:
+            COMPROBACIONES[nombre](almacen)
+            resultados.append((nombre, None))
+        except Exception:
+            resultados.append((nombre, traceback.format_exc()))
+    return resultados
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _binario(nombre):
+    encontrado = shutil.which(nombre)
+    if encontrado:
+        return encontrado
+    try:
+        carpeta = subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        raise RuntimeError(f'No se encontró {nombre}: instale PostgreSQL o use --postgres URL')
+    return os.path.join(carpeta, nombre)
+
+
+@contextmanager
+def postgres_local():
+    """Levanta un PostgreSQL en una carpeta temporal (initdb + pg_ctl) y lo borra al terminar"""
+    carpeta = tempfile.mkdtemp(prefix='conformidad_pg_')
+    datos_pg = os.path.join(carpeta, 'datos')
+    puerto = _puerto_libre()
+    subprocess.run([_binario('initdb'), '-D', datos_pg, '-U', 'consultorio', '--auth=trust', '-E', 'UTF8'],
+                   check=True, capture_output=True)
+    subprocess.run([_binario('pg_ctl'), '-D', datos_pg, '-l', os.path.join(carpeta, 'log'), '-w',
+                    '-o', f"-p {puerto} -k {carpeta} -c listen_addresses=''", 'start'], check=True, capture_output=True)
+    try:
+        yield f'postgresql://consultorio@/postgres?host={carpeta}&port={puerto}'
+    finally:
+        subprocess.run([_binario('pg_ctl'), '-D', datos_pg, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+def _informar(almacen, resultados):
+    for nombre, error in resultados:
+        print(f'{almacen.nombre:8} {nombre:12} {"ok" if error is None else "FALLA"}')
+        if error:
+            print(error)
+    return all(error is None for _, error in resultados)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comprobaciones de conformidad de los almacenamientos")
+    parser.add_argument('nombres', nargs='*', help=f"Por defecto, todas: {', '.join(COMPROBACIONES)}")
+    parser.add_argument('--postgres', help="URL de una base PostgreSQL vacía (se borran sus datos)")
+    parser.add_argument('--postgres-local', action='store_true', help="Levantar un PostgreSQL temporal")
+    args = parser.parse_args()
+    desconocidas = set(args.nombres) - set(COMPROBACIONES)
+    if desconocidas:
+        parser.error(f"Comprobaciones desconocidas: {', '.join(sorted(desconocidas))}")
+
+    correcto = True
+    with tempfile.TemporaryDirectory() as carpeta:
+        almacen = AlmacenSQLite(os.path.join(carpeta, 'conformidad.db'))
+        correcto &= _informar(almacen, correr(almacen, args.nombres))
+        almacen.cerrar()
+
+    urls = [args.postgres] if args.postgres else []
+    with postgres_local() if args.postgres_local else nullcontext() as url_local:
+        for url in urls + ([url_local] if url_local else []):
+            almacen = AlmacenPostgres(url)
+            correcto &= _informar(almacen, correr(almacen, args.nombres))
+            almacen.cerrar()
+    sys.exit(0 if correcto else 1)
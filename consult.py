@@ -1,12 +1,40 @@
 import streamlit as st
 import sqlite3
 import pathlib
-from datetime import datetime,timedelta
+from datetime import datetime
+import io
+import zipfile
 import pandas as pd
 import calendar
+import threading
+from functools import wraps
 from PIL import Image
 
-from login import login_required, logout
+from login import login_required, logout, current_user, database_path, obtener_autenticador
+from configuracion import conectar, carpeta_de, obtener_config, guardar_config
+import cifrado
+import compresion
+import archivo
+import respaldo
+import mantenimiento
+from versiones import Versiones
+import estadisticas
+import deudas
+import recurrencias
+import borrado
+import facturacion
+import historia
+import recordatorios
+import espera
+import duplicados
+import agenda_ics
+import jornada
+import edicion_sesiones
+import datos
+import profesionales
+from estado_ui import EstadoUI, limpiar_ambitos, tamaño_estado
+from modelos import Paciente, Sesion, Turno, columnas
+from dataframes import leer_df, TIPOS_PACIENTES
 
 #CARGAR IMAGEN
 img = Image.open('./img/KENTI-SOLO.png')
@@ -24,53 +52,67 @@ css_path = pathlib.Path("estilo.css")
 load_css(css_path)
 
 
-def obtener_estadisticas_sesiones(paciente_id):
+# Lecturas cacheadas entre sesiones: la clave incluye la base (cada profesional tiene la suya)
+# y la versión de las tablas que leen, así un cambio hecho desde otra sesión (u otro proceso)
+# invalida solo lo que corresponde
+_lecturas_cacheadas = {}
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def _leer_con_version(nombre, ruta, version, args):
+    return _lecturas_cacheadas[nombre](*args)
+
+def cacheado_por_version(*tablas):
+    """
+    Cachea el resultado de una lectura hasta que alguna de las tablas indicadas cambie
+    """
+    def decorador(funcion):
+        _lecturas_cacheadas[funcion.__name__] = funcion
+
+        @wraps(funcion)
+        def envoltorio(*args):
+            return _leer_con_version(funcion.__name__, ruta_db, versiones_tablas.clave(*tablas), args)
+        return envoltorio
+    return decorador
+
+
+@cacheado_por_version('sesiones')
+def obtener_estadisticas_sesiones(paciente_id, incluir_archivo=False):
     """
     Obtiene estadísticas de sesiones para un paciente específico
     """
-    cursor.execute('''
-    SELECT 
-        COUNT(*) as total_sesiones,
-        SUM(CASE WHEN pago = 1 THEN 1 ELSE 0 END) as sesiones_pagadas,
-        SUM(CASE WHEN asistio = 1 THEN 1 ELSE 0 END) as sesiones_asistidas,
-        SUM(CASE WHEN pago = 0 THEN monto ELSE 0 END) as deuda_total
-    FROM sesiones 
-    WHERE paciente_id = ?
-    ''', (paciente_id,))
-    
-    result = cursor.fetchone()
-    return {
-        'total_sesiones': result[0],
-        'sesiones_pagadas': result[1] or 0,
-        'sesiones_asistidas': result[2] or 0,
-        'deuda_total': result[3] or 0
-    }
-
-def obtener_ultima_sesion(paciente_id):
+    return datos.estadisticas_sesiones(conn, paciente_id, incluir_archivo)
+
+@cacheado_por_version('sesiones')
+def obtener_ultima_sesion(paciente_id, incluir_archivo=False):
     """
     Obtiene la fecha de la última sesión del paciente
     """
-    cursor.execute('''
-    SELECT fecha 
-    FROM sesiones 
-    WHERE paciente_id = ? 
-    ORDER BY fecha DESC 
-    LIMIT 1
-    ''', (paciente_id,))
-    
-    result = cursor.fetchone()
-    return result[0] if result else None
-
-def obtener_pacientes_df():
-    """Obtiene todos los pacientes y los devuelve como un DataFrame"""
-    cursor.execute('SELECT * FROM pacientes')
-    pacientes = cursor.fetchall()
-    columnas = ['id', 'nombre', 'apellido', 'dni', 'fecha_nacimiento', 'nombre_padre', 
-                'telefono_padre', 'nombre_madre', 'telefono_madre', 'nombre_familiar', 
-                'telefono_familiar', 'domicilio', 'motivo_consulta', 'datos_escolares', 
-                'año_inicio_consulta','telefono_paciente','obra_social','numero_afiliado','diagnostico', 'actividad']
-    df = pd.DataFrame(pacientes, columns=columnas)
-    return df
+    return datos.ultima_sesion(conn, paciente_id, incluir_archivo)
+
+@cacheado_por_version('pacientes')
+def obtener_pacientes_df(incluir_archivados=False, campos=None):
+    """Obtiene los pacientes como un DataFrame con tipos compactos (obra social como
+    categoría, enteros nulables, booleanos), armado directamente desde el cursor.
+    Por defecto solo lee los pacientes vivos; con incluir_archivados suma los del archivo.
+    `campos` (tupla) limita las columnas que se leen"""
+    seleccion = ', '.join(campos) if campos else columnas(Paciente)
+    return leer_df(conn, f'''
+    SELECT {seleccion}, archivado FROM {archivo.fuente(conn, "pacientes", incluir_archivados)}
+    WHERE eliminado IS NULL
+    ''', tipos=TIPOS_PACIENTES)
+
+
+def datos_clinicos(paciente):
+    """
+    Diagnóstico y motivo de consulta de una ficha. La lista de pacientes los trae como
+    están guardados: si están cifrados, se descifran solo cuando se pide verlos
+    """
+    clinicos = {campo: paciente[campo] for campo in cifrado.CAMPOS_PACIENTE}
+    if not any(cifrado.cifrado(valor) for valor in clinicos.values()):
+        return clinicos
+    if st.checkbox("🔒 Mostrar diagnóstico y motivo de consulta", key=f"clinicos_{paciente['id']}"):
+        return {campo: cifrado.texto(valor) for campo, valor in clinicos.items()}
+    return dict.fromkeys(clinicos, "🔒")
 
 
 # Función para calcular la edad
@@ -95,204 +137,129 @@ def calcular_edad(fecha_nacimiento):
     
 
 
-# Conexión a la base de datos SQLite
-conn = sqlite3.connect('consultorio.db')
-cursor = conn.cursor()
-
-# Creación de tablas si no existen (ahora incluye los nuevos campos)
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS pacientes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    nombre TEXT NOT NULL,
-    apellido TEXT NOT NULL,
-    dni INTEGER NOT NULL,
-    fecha_nacimiento TEXT,
-    nombre_padre TEXT,
-    telefono_padre TEXT,
-    nombre_madre TEXT,
-    telefono_madre TEXT,
-    nombre_familiar TEXT,
-    telefono_familiar TEXT,
-    domicilio TEXT,
-    motivo_consulta TEXT,
-    datos_escolares TEXT,
-    año_inicio_consulta INTEGER,
-    telefono_paciente INTEGRER,
-    obra_social TEXT,
-    numero_afiliado INTEGRER,
-    diagnostico TEXT,
-    actividad BOOL 
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS sesiones (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    paciente_id INTEGER,
-    fecha TEXT,
-    notas TEXT,
-    asistio BOOLEAN,
-    pago BOOLEAN,
-    monto REAL,
-    numero_factura TEXT,
-    FOREIGN KEY (paciente_id) REFERENCES pacientes(id)
-)
-''')
-conn.commit()
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS turnos (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    nombre TEXT NOT NULL,
-    fecha DATE NOT NULL,
-    hora TIME NOT NULL
-)
-''')
-conn.commit()
-
-# Funciones para manejar la base de datos
-def agregar_paciente(nombre, apellido, dni, fecha_nacimiento, nombre_padre, telefono_padre, 
-                     nombre_madre, telefono_madre, nombre_familiar, telefono_familiar, 
-                     domicilio, motivo_consulta, datos_escolares, 
-                     año_inicio_consulta,telefono_paciente,obra_social,numero_afiliado,diagnostico, actividad):
-    cursor.execute('''
-    INSERT INTO pacientes (
-        nombre, apellido, dni, fecha_nacimiento, nombre_padre, telefono_padre, 
-        nombre_madre, telefono_madre, nombre_familiar, telefono_familiar, 
-        domicilio, motivo_consulta, datos_escolares, año_inicio_consulta, telefono_paciente, obra_social, numero_afiliado, diagnostico, actividad )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (nombre, apellido, dni, fecha_nacimiento, nombre_padre, telefono_padre, 
-          nombre_madre, telefono_madre, nombre_familiar, telefono_familiar, 
-          domicilio, motivo_consulta, datos_escolares,
-          año_inicio_consulta,telefono_paciente,obra_social,numero_afiliado, diagnostico, actividad))
-    conn.commit()
+# Conexión a la base de datos SQLite del profesional que inició sesión
+ruta_db = database_path(current_user())
+conn = conectar(ruta_db)
 
-def obtener_pacientes():
-    cursor.execute('SELECT * FROM pacientes')
-    return cursor.fetchall()
+# Creación de tablas si no existen
+datos.crear_esquema(conn)
+versiones_tablas = Versiones(conn)
 
+MAX_SUGERENCIAS = 20  # Fusiones sugeridas que se muestran a la vez
+AVISO_TURNOS_AMBIGUOS = "Hay otro paciente con el mismo nombre: sus turnos quedaron sin tocar, revíselos en la agenda"
+rango_mes = datos.rango_mes
 
+# Funciones para manejar la base de datos (las lecturas, cacheadas por versión)
+def agregar_paciente(paciente):
+    """
+    Inserta un Paciente (el id se ignora, lo asigna la base)
+    """
+    return datos.agregar_paciente(conn, paciente)
 
+@cacheado_por_version('pacientes')
+def obtener_pacientes():
+    return datos.obtener_pacientes(conn)
 
-def actualizar_paciente(paciente_id, nombre, apellido, dni, fecha_nacimiento, nombre_padre, telefono_padre, nombre_madre, telefono_madre, nombre_familiar, telefono_familiar, domicilio, motivo_consulta, datos_escolares,año_inicio_consulta,telefono_paciente,obra_social,numero_afiliado, diagnostico, actividad):
-    cursor.execute('''
-    UPDATE pacientes SET nombre = ?, apellido = ?, dni = ?, fecha_nacimiento = ?, nombre_padre = ?, telefono_padre = ?, nombre_madre = ?, telefono_madre = ?, nombre_familiar = ?, telefono_familiar = ?, domicilio = ?, motivo_consulta = ?, datos_escolares = ?, año_inicio_consulta = ?,telefono_paciente = ?,obra_social = ?,numero_afiliado = ?, diagnostico = ?, actividad = ? WHERE id = ?
-    ''', (nombre, apellido, dni, fecha_nacimiento, nombre_padre, telefono_padre, nombre_madre, telefono_madre, nombre_familiar, telefono_familiar, domicilio, motivo_consulta, datos_escolares,año_inicio_consulta,telefono_paciente,obra_social,numero_afiliado, diagnostico , actividad ,paciente_id))
-    conn.commit()
+def actualizar_paciente(paciente):
+    """
+    Guarda todos los campos de un Paciente existente
+    """
+    datos.actualizar_paciente(conn, paciente)
 
 def eliminar_paciente(paciente_id):
-    cursor.execute('DELETE FROM pacientes WHERE id = ?', (paciente_id,))
-    cursor.execute('DELETE FROM sesiones WHERE paciente_id = ?', (paciente_id,))  # Elimina las sesiones relacionadas
-    conn.commit()
+    """
+    Elimina al paciente con sus sesiones y turnos en una sola transacción
+    (o lo manda a la papelera si el borrado lógico está activo)
+    """
+    return borrado.eliminar_paciente(conn, paciente_id)
 
 def agregar_sesion(paciente_id, fecha, notas, asistio, pago, monto, numero_factura):
-    cursor.execute('''
-    INSERT INTO sesiones (paciente_id, fecha, notas, asistio, pago, monto, numero_factura) 
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (paciente_id, fecha, notas, asistio, pago, monto, numero_factura))
-    conn.commit()
+    datos.agregar_sesion(conn, paciente_id, fecha, notas, asistio, pago, monto, numero_factura)
 
+@cacheado_por_version('sesiones')
 def obtener_sesiones(paciente_id):
-    cursor.execute('''
-    SELECT id, paciente_id, fecha, notas, asistio, pago, monto, numero_factura 
-    FROM sesiones 
-    WHERE paciente_id = ?
-    ORDER BY fecha DESC
-    ''', (paciente_id,))
-    return cursor.fetchall()
+    return datos.obtener_sesiones(conn, paciente_id)
 
 def actualizar_sesion(sesion_id, fecha, notas, asistio, pago, monto, numero_factura):
-    cursor.execute('''
-    UPDATE sesiones 
-    SET fecha = ?, notas = ?, asistio = ?, pago = ?, monto = ?, numero_factura = ?
-    WHERE id = ?
-    ''', (fecha, notas, asistio, pago, monto, numero_factura, sesion_id))
-    conn.commit()
+    datos.actualizar_sesion(conn, sesion_id, fecha, notas, asistio, pago, monto, numero_factura)
 
 def eliminar_sesion(sesion_id):
-    cursor.execute('DELETE FROM sesiones WHERE id = ?', (sesion_id,))
-    conn.commit()
+    datos.eliminar_sesion(conn, sesion_id)
 
 
 def agregar_turno(nombre, fecha, hora):
-    cursor.execute('''
-    INSERT INTO turnos (nombre, fecha, hora)
-    VALUES (?, ?, ?)
-    ''', (nombre, fecha, hora))
-    conn.commit()
+    return datos.agregar_turno(conn, nombre, fecha, hora)
 
+@cacheado_por_version(*recurrencias.TABLAS)
 def obtener_turnos_dia(fecha):
-    cursor.execute('''
-    SELECT id, nombre, fecha, hora
-    FROM turnos
-    WHERE fecha = ?
-    ORDER BY hora
-    ''', (fecha,))
-    return cursor.fetchall()
+    return datos.obtener_turnos_dia(conn, fecha)
 
+@cacheado_por_version(*recurrencias.TABLAS)
 def obtener_turnos_mes(año, mes):
-    cursor.execute('''
-    SELECT id, nombre, fecha, hora
-    FROM turnos
-    WHERE strftime('%Y', fecha) = ? AND strftime('%m', fecha) = ?
-    ORDER BY fecha, hora
-    ''', (str(año), str(mes).zfill(2)))
-    return cursor.fetchall()
-
-def verificar_disponibilidad(fecha, hora_consulta):
     """
-    Verifica si hay disponibilidad para un turno en la fecha y hora especificadas
+    Turnos concretos del mes más las ocurrencias de los turnos recurrentes
     """
-    # Convertir la hora de consulta a minutos desde medianoche para facilitar comparación
-    hora_inicio_mins = int(hora_consulta.split(':')[0]) * 60 + int(hora_consulta.split(':')[1])
-    hora_fin_mins = hora_inicio_mins + 40  # 40 minutos de duración
-    
-    # Obtener todos los turnos para esa fecha
-    cursor.execute('''
-    SELECT hora FROM turnos
-    WHERE fecha = ?
-    ''', (fecha,))
-    
-    turnos_existentes = cursor.fetchall()
-    
-    # Verificar superposición con turnos existentes
-    for turno in turnos_existentes:
-        turno_hora = turno[0]
-        # Convertir hora del turno existente a minutos
-        turno_mins = int(turno_hora.split(':')[0]) * 60 + int(turno_hora.split(':')[1])
-        turno_fin_mins = turno_mins + 40
-        
-        # Verificar si hay superposición
-        if not (hora_fin_mins <= turno_mins or hora_inicio_mins >= turno_fin_mins):
-            return False
-    
-    return True
+    return datos.obtener_turnos_mes(conn, año, mes)
 
-def eliminar_turno(turno_id):
-    cursor.execute('DELETE FROM turnos WHERE id = ?', (turno_id,))
-    conn.commit()
+@cacheado_por_version(*recurrencias.TABLAS, *jornada.TABLAS)
+def horarios_disponibles(fecha):
+    """
+    Horarios libres del día según el horario de atención
+    """
+    return datos.horarios_libres(conn, fecha)
 
+def reservar_turno(nombre, fecha, hora):
+    """
+    Agenda el turno si el horario está libre, en una sola transacción. Devuelve el id o None
+    """
+    return datos.reservar_turno(conn, nombre, fecha, hora)
 
+def eliminar_turno(turno_id):
+    """
+    Elimina un turno concreto, o cancela solo esa fecha si es parte de un turno recurrente
+    """
+    datos.eliminar_turno(conn, turno_id)
 
 def eliminar_turnos_por_nombre(nombre):
     """
-    Elimina todos los turnos de un paciente específico
+    Elimina todos los turnos de un paciente específico, incluidos sus turnos recurrentes
+    """
+    return datos.eliminar_turnos_por_nombre(conn, nombre)  # Retorna el número de turnos eliminados
+
+def ofrecer_horarios_liberados(turnos):
+    """
+    Busca en la lista de espera quién puede ocupar los horarios futuros que dejaron los
+    turnos cancelados; las propuestas (o las asignaciones automáticas) se muestran al recargar
+    """
+    huecos = espera.huecos_liberados(conn, turnos)
+    if huecos:
+        st.session_state['huecos_espera'] = huecos
+
+@cacheado_por_version('pacientes', 'sesiones')
+def sugerencias_duplicados():
+    """
+    Pares de pacientes que parecen ser la misma persona; se recalcula solo si cambian los datos
+    """
+    return duplicados.sugerencias(conn)
+
+@cacheado_por_version(*espera.TABLAS)
+def obtener_lista_espera():
+    return espera.lista_espera(conn)
+
+@cacheado_por_version(*recurrencias.TABLAS, *jornada.TABLAS)
+def agenda_en_ics(desde, hasta):
     """
-    cursor.execute('DELETE FROM turnos WHERE nombre = ?', (nombre,))
-    conn.commit()
-    return cursor.rowcount  # Retorna el número de turnos eliminados
+    Calendario .ics de los turnos del período; se vuelve a generar solo si cambian los turnos
+    o la duración de los turnos (el DTEND sale de la jornada)
+    """
+    return ''.join(agenda_ics.exportar_ics(conn, desde, hasta)).encode('utf-8')
 
+@cacheado_por_version(*recurrencias.TABLAS)
 def obtener_nombres_pacientes_con_turnos(año, mes):
     """
     Obtiene una lista única de nombres de pacientes que tienen turnos en el mes seleccionado
     """
-    cursor.execute('''
-    SELECT DISTINCT nombre
-    FROM turnos
-    WHERE strftime('%Y', fecha) = ? AND strftime('%m', fecha) = ?
-    ORDER BY nombre
-    ''', (str(año), str(mes).zfill(2)))
-    return [row[0] for row in cursor.fetchall()]
+    return sorted({turno.nombre for turno in obtener_turnos_mes(año, mes)})
 
 
 def num_txt(mes_n):
@@ -302,21 +269,86 @@ def num_txt(mes_n):
         return meses[mes_n - 1]
 
 
+@cacheado_por_version('sesiones')
 def obtener_ultimas_sesiones(paciente_id, limite=None):
     """
     Obtiene las últimas sesiones de un paciente, con opción de límite
     """
-    query = '''
-    SELECT id, paciente_id, fecha, notas, asistio, pago, monto, numero_factura 
-    FROM sesiones 
-    WHERE paciente_id = ?
-    ORDER BY fecha DESC
-    '''
-    if limite:
-        query += f' LIMIT {limite}'
-    
-    cursor.execute(query, (paciente_id,))
-    return cursor.fetchall()
+    return datos.obtener_sesiones(conn, paciente_id, limite)
+
+@cacheado_por_version('sesiones')
+def obtener_sesiones_mes(año, mes):
+    return datos.obtener_sesiones_mes(conn, año, mes)
+
+def editor_sesiones(sesiones, clave, nombres=None):
+    """
+    Grilla para editar varias sesiones a la vez y guardarlas en una sola transacción.
+    Las filas se congelan al abrir la grilla: si otra sesión las modifica mientras tanto,
+    al guardar se informan como conflicto en lugar de pisarlas
+    """
+    editores = EstadoUI(st.session_state, 'editores', maximo=3)
+    clave_grilla = f'editor_grilla_{clave}'
+    if clave not in editores:
+        editores.guardar(clave, sesiones)
+    originales = editores.obtener(clave)
+
+    if not originales:
+        st.info("No hay sesiones para editar")
+        return
+
+    df = pd.DataFrame([edicion_sesiones.normalizar(s) for s in originales], columns=Sesion._fields)
+    df['fecha'] = pd.to_datetime(df['fecha']).dt.date
+    if nombres:
+        df.insert(2, 'paciente', df['paciente_id'].map(nombres))
+
+    editado = st.data_editor(
+        df,
+        key=clave_grilla,
+        hide_index=True,
+        use_container_width=True,
+        disabled=['id', 'paciente_id', 'paciente'],
+        column_order=[c for c in df.columns if c not in ('id', 'paciente_id')],
+        column_config={
+            'paciente': st.column_config.TextColumn("Paciente"),
+            'fecha': st.column_config.DateColumn("Fecha", format="YYYY-MM-DD", required=True),
+            'notas': st.column_config.TextColumn("Notas", width="large"),
+            'asistio': st.column_config.CheckboxColumn("Asistió"),
+            'pago': st.column_config.CheckboxColumn("Pagó"),
+            'monto': st.column_config.NumberColumn("Monto ($)", min_value=0.0, step=100.0),
+            'numero_factura': st.column_config.TextColumn("Factura N°"),
+        },
+    )
+
+    def cerrar_grilla():
+        editores.quitar(clave)
+        st.session_state.pop(clave_grilla, None)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("💾 Guardar cambios", key=f"guardar_{clave}"):
+            editadas = [
+                Sesion(**{campo: None if pd.isna(valor) else valor
+                          for campo, valor in fila.items() if campo in Sesion._fields})
+                for fila in editado.to_dict('records')
+            ]
+            cambios = edicion_sesiones.diferencias(originales, editadas)
+            actualizadas, conflictos = edicion_sesiones.aplicar_cambios(conn, cambios)
+            cerrar_grilla()
+            st.session_state['mensaje_edicion'] = (actualizadas, conflictos)
+            st.rerun()
+    with col2:
+        if st.button("↩️ Descartar / recargar", key=f"descartar_{clave}"):
+            cerrar_grilla()
+            st.rerun()
+
+    if 'mensaje_edicion' in st.session_state:
+        actualizadas, conflictos = st.session_state.pop('mensaje_edicion')
+        st.success(f"Se actualizaron {actualizadas} sesiones")
+        if conflictos:
+            st.warning(
+                f"{len(conflictos)} sesiones no se guardaron porque fueron modificadas o eliminadas "
+                "desde otra sesión mientras se editaban. La grilla muestra ahora sus valores actuales"
+            )
 
 obras_sociales = [
                 "Ninguna",
@@ -331,14 +363,279 @@ obras_sociales = [
                 "Otra"]
 
 
+@st.cache_resource
+def iniciar_mantenimiento(ruta):
+    """
+    Arranca una única vez (por proceso y por base) el hilo de mantenimiento en segundo plano
+    """
+    programador = mantenimiento.Programador(ruta)
+    programador.iniciar()
+    return programador
+
+@st.cache_resource
+def iniciar_recordatorios(ruta):
+    """
+    Arranca una única vez (por proceso y por base) el repartidor de recordatorios en segundo plano
+    """
+    repartidor = recordatorios.Repartidor(ruta)
+    repartidor.iniciar()
+    return repartidor
+
+
+def es_administrador():
+    with obtener_autenticador().pool.conexion() as central:
+        return profesionales.es_administrador(central, current_user())
+
+@st.cache_resource
+def _versiones_de_base(ruta):
+    """
+    Contadores de versión de la base de un profesional, con una conexión que dura todo el
+    proceso (la comparten las sesiones, de ahí el lock): no se abre una por rerun
+    """
+    return Versiones(conectar(ruta, check_same_thread=False)), threading.Lock()
+
+def version_centro(bases_centro, *tablas):
+    """Versión de las tablas en cada base del centro: clave de caché de las vistas de todo el centro"""
+    claves = []
+    for _, ruta in bases_centro:
+        versiones_base, bloqueo = _versiones_de_base(ruta)
+        with bloqueo:
+            claves.append(versiones_base.clave(*tablas))
+    return tuple(claves)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _agenda_centro(bases_centro, desde, hasta, version):
+    return profesionales.agenda_compartida(bases_centro, desde, hasta)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _facturacion_centro(bases_centro, mes, version):
+    return profesionales.facturacion_centro(bases_centro, mes)
+
+
+def panel_mantenimiento():
+    """
+    Opciones de mantenimiento de la base de datos en la barra lateral
+    """
+    with st.sidebar.expander("⚙️ Mantenimiento"):
+        st.markdown("**Compresión de notas**")
+        activa = compresion.compresion_activa(conn)
+        nueva = st.checkbox("Comprimir notas nuevas", value=activa, key="comprimir_notas")
+        if nueva != activa:
+            compresion.activar_compresion(conn, nueva)
+        if st.button("Comprimir notas existentes" if nueva else "Descomprimir notas existentes"):
+            reporte = compresion.migrar_notas(conn, comprimir=nueva)
+            st.success(f"{reporte['filas_modificadas']} notas actualizadas, "
+                       f"{reporte['bytes_ahorrados'] / 1024:.1f} KB ahorrados")
+        if st.button("Ver espacio de notas"):
+            reporte = compresion.reporte_espacio(conn)
+            st.write(f"Notas: {reporte['notas']} ({reporte['comprimidas']} comprimidas)")
+            st.write(f"Ocupan: {reporte['bytes_guardados'] / 1024:.1f} KB "
+                     f"(sin comprimir: {reporte['bytes_sin_comprimir'] / 1024:.1f} KB)")
+
+        st.markdown("**Cifrado de datos clínicos**")
+        cifrar = cifrado.cifrado_activo(conn)
+        nuevo_cifrar = st.checkbox("Cifrar notas, diagnóstico y motivo de consulta", value=cifrar, key="cifrar_datos")
+        try:
+            if nuevo_cifrar != cifrar:
+                cifrado.activar_cifrado(conn, nuevo_cifrar)
+                if nuevo_cifrar:
+                    # Las historias ya generadas tienen los datos clínicos en texto plano
+                    historia.borrar_historias(carpeta_de(ruta_db, historia.HISTORIAS_DIR))
+            if st.button("Cifrar datos existentes" if nuevo_cifrar else "Descifrar datos existentes"):
+                reporte = cifrado.migrar(conn, cifrar=nuevo_cifrar)
+                st.success(f"{sum(r['filas_modificadas'] for r in reporte.values())} filas actualizadas")
+        except (RuntimeError, cifrado.ClaveIncorrecta) as e:
+            st.error(str(e))
+
+        st.markdown("**Archivo**")
+        años_archivo = st.number_input("Archivar sesiones con más de (años)", min_value=1, value=3, step=1)
+        if st.button("Archivar inactivos y sesiones antiguas"):
+            reporte = archivo.archivar(conn, años=int(años_archivo))
+            st.success(f"Se archivaron {reporte['pacientes']} pacientes y {reporte['sesiones']} sesiones")
+
+        st.markdown("**Papelera**")
+        logico = borrado.borrado_logico_activo(conn)
+        nuevo_logico = st.checkbox("Enviar pacientes eliminados a la papelera", value=logico, key="borrado_logico")
+        if nuevo_logico != logico:
+            borrado.activar_borrado_logico(conn, nuevo_logico)
+        eliminados = borrado.pacientes_eliminados(conn)
+        for paciente_id, nombre, apellido, fecha_eliminado in eliminados:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.caption(f"{apellido}, {nombre} ({fecha_eliminado})")
+            with col2:
+                if st.button("♻️", key=f"papelera_restaurar_{paciente_id}"):
+                    borrado.restaurar_paciente(conn, paciente_id)
+                    st.rerun()
+        if eliminados and st.button("Vaciar papelera"):
+            reporte = borrado.vaciar_papelera(conn)
+            st.success(f"Se borraron {reporte['pacientes']} pacientes, {reporte['sesiones']} sesiones "
+                       f"y {reporte['turnos']} turnos")
+            if reporte['ambiguos']:
+                st.warning(f"{reporte['ambiguos']} pacientes comparten el nombre con otro: "
+                           "sus turnos quedaron sin tocar, revíselos en la agenda")
+
+        st.markdown("**Respaldos**")
+        if st.button("Crear respaldo ahora"):
+            barra = st.progress(0.0)
+            try:
+                metricas = respaldo.crear_respaldo(ruta_db, carpeta_de(ruta_db, respaldo.RESPALDOS_DIR), progreso=lambda hechas, total: barra.progress(hechas / total if total else 1.0))
+                st.success(f"Respaldo creado: {metricas['bytes'] / 1024:.1f} KB en {metricas['segundos_total']} s")
+            except respaldo.RespaldoInvalido as e:
+                st.error(str(e))
+        if 'mensaje_restauracion' in st.session_state:
+            st.success(st.session_state.pop('mensaje_restauracion'))  # Se guardó antes del rerun
+        respaldos = respaldo.listar_respaldos(carpeta_de(ruta_db, respaldo.RESPALDOS_DIR))
+        if respaldos:
+            elegido = st.selectbox("Respaldos disponibles", respaldos, format_func=lambda ruta: pathlib.Path(ruta).name)
+            if st.button("Restaurar respaldo seleccionado"):
+                resultado = respaldo.restaurar_respaldo(elegido, ruta_db, carpeta_de(ruta_db, respaldo.RESPALDOS_DIR))
+                st.session_state['mensaje_restauracion'] = (
+                    f"Base restaurada (se guardó una copia previa en {resultado['respaldo_previo']})")
+                st.rerun()
+
+        st.markdown("**Tareas programadas**")
+        programador = iniciar_mantenimiento(ruta_db)
+        col1, col2 = st.columns(2)
+        with col1:
+            hora_inicio = st.number_input("Desde (hora)", 0, 23,
+                                          int(obtener_config(conn, 'mantenimiento_hora_inicio', mantenimiento.HORA_INICIO)))
+        with col2:
+            hora_fin = st.number_input("Hasta (hora)", 0, 23,
+                                       int(obtener_config(conn, 'mantenimiento_hora_fin', mantenimiento.HORA_FIN)))
+        if st.button("Guardar horario"):
+            guardar_config(conn, 'mantenimiento_hora_inicio', hora_inicio)
+            guardar_config(conn, 'mantenimiento_hora_fin', hora_fin)
+            st.success("Horario guardado")
+        for nombre, estado_tarea in programador.estado().items():
+            resultado = "✅" if estado_tarea['ok'] is not False else f"❌ {estado_tarea['error']}"
+            if estado_tarea['ultima']:
+                duracion = f" ({estado_tarea['segundos']} s)" if estado_tarea['segundos'] is not None else ""
+                st.write(f"{nombre}: {estado_tarea['ultima']}{duracion} {resultado}")
+            else:
+                st.write(f"{nombre}: nunca" + (f" {resultado}" if estado_tarea['ok'] is False else ""))
+        tarea = st.selectbox("Correr tarea ahora", list(mantenimiento.TAREAS))
+        if st.button("Encolar tarea"):
+            programador.solicitar(tarea)
+            st.info("La tarea se ejecutará en segundo plano")
+
+        st.markdown("**Recordatorios de turnos**")
+        repartidor = iniciar_recordatorios(ruta_db)
+        transportes = list(recordatorios.TRANSPORTES)
+        transporte = obtener_config(conn, recordatorios.CLAVE_TRANSPORTE, 'debug')
+        nuevo_transporte = st.selectbox("Envío", transportes, index=transportes.index(transporte),
+                                        format_func={'debug': "Prueba (sin enviar)", 'smtp': "Email (SMTP)"}.get)
+        if nuevo_transporte != transporte:
+            guardar_config(conn, recordatorios.CLAVE_TRANSPORTE, nuevo_transporte)
+        if st.button("Encolar recordatorios de mañana"):
+            encolados, sin_contacto = recordatorios.encolar_recordatorios(conn)
+            repartidor.despertar()
+            st.success(f"{encolados} recordatorios encolados")
+            if sin_contacto:
+                st.caption(f"Sin email: {', '.join(sorted(set(sin_contacto)))}")
+        bandeja = recordatorios.estado_bandeja(conn)
+        st.write(f"Pendientes: {bandeja.get('pendiente', 0)} · Enviados: {bandeja.get('enviado', 0)} "
+                 f"· Fallidos: {bandeja.get('fallido', 0)}")
+        if bandeja.get('fallido') and st.button("Reintentar fallidos"):
+            recordatorios.reintentar_fallidos(conn)
+            repartidor.despertar()
+            st.rerun()
+
+        # Crear cuentas y ver dónde está la base de cada uno es cosa del usuario principal
+        if es_administrador():
+            st.markdown("**Profesionales**")
+            with obtener_autenticador().pool.conexion() as central:
+                for usuario, ruta in profesionales.bases(central):
+                    st.caption(f"{usuario}: {ruta}")
+            nuevo_usuario = st.text_input("Usuario nuevo", key="profesional_usuario")
+            nueva_clave = st.text_input("Contraseña", type="password", key="profesional_clave")
+            if st.button("Agregar profesional") and nuevo_usuario and nueva_clave:
+                try:
+                    with obtener_autenticador().pool.conexion() as central:
+                        profesionales.agregar_profesional(central, nuevo_usuario, nueva_clave, por=current_user())
+                    st.success(f"{nuevo_usuario} ya puede iniciar sesión con su propia base")
+                except (ValueError, PermissionError) as e:
+                    st.error(str(e))
+
+        st.markdown("**Diagnóstico**")
+        tamaño = tamaño_estado(st.session_state)
+        st.write(f"Estado de la sesión: {tamaño['claves']} claves, {tamaño['bytes'] / 1024:.1f} KB")
+        for clave, bytes_clave in tamaño['mayores']:
+            st.caption(f"{clave}: {bytes_clave / 1024:.1f} KB")
+
+
+def panel_horario():
+    """
+    Horario de atención en la barra lateral: días, horas, pausas, feriados y duración de los turnos
+    """
+    with st.sidebar.expander("🕘 Horario de atención"):
+        duracion = st.number_input("Duración del turno (minutos)", 5, 240, jornada.duracion_turno(conn), step=5)
+        if duracion != jornada.duracion_turno(conn):
+            jornada.guardar_duracion(conn, duracion)
+
+        actual = jornada.obtener_jornada(conn)
+        for dia, nombre_dia in enumerate(jornada.DIAS):
+            inicio, fin, pausas = actual.get(dia, (jornada.HORA_INICIO, jornada.HORA_FIN, []))
+            atiende = st.checkbox(nombre_dia, value=dia in actual, key=f"jornada_atiende_{dia}")
+            if not atiende:
+                if dia in actual:
+                    jornada.quitar_dia(conn, dia)
+                continue
+            col1, col2 = st.columns(2)
+            with col1:
+                nuevo_inicio = st.text_input("Desde", inicio, key=f"jornada_inicio_{dia}")
+            with col2:
+                nuevo_fin = st.text_input("Hasta", fin, key=f"jornada_fin_{dia}")
+            texto_pausas = st.text_input("Pausas (p. ej. 12:00-13:00, 16:00-16:30)",
+                                         ", ".join(f"{a}-{b}" for a, b in pausas), key=f"jornada_pausas_{dia}")
+            try:
+                nuevas_pausas = [tuple(pausa.split('-', 1)) for pausa in texto_pausas.split(',') if pausa.strip()]
+                if any(len(pausa) != 2 for pausa in nuevas_pausas):
+                    raise ValueError("Las pausas se escriben como 12:00-13:00")
+                # Se compara ya normalizado: '8:00' o '12:00 - 13:00' no son un cambio en cada recarga
+                nuevo = jornada.normalizar_dia(nuevo_inicio, nuevo_fin, nuevas_pausas)
+                if dia not in actual or nuevo != (inicio, fin, pausas):
+                    jornada.guardar_dia(conn, dia, *nuevo)
+            except ValueError as e:
+                st.error(f"{nombre_dia}: {e}")
+
+        st.markdown("**Feriados**")
+        col1, col2 = st.columns(2)
+        with col1:
+            fecha_feriado = st.date_input("Fecha", datetime.today(), key="feriado_fecha")
+        with col2:
+            descripcion_feriado = st.text_input("Motivo", key="feriado_descripcion")
+        if st.button("Agregar feriado"):
+            jornada.agregar_feriado(conn, fecha_feriado, descripcion_feriado or None)
+            st.rerun()
+        for fecha_feriado, descripcion_feriado in jornada.obtener_feriados(conn, datetime.today().date()):
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.caption(f"{fecha_feriado} {descripcion_feriado or ''}")
+            with col2:
+                if st.button("✖", key=f"quitar_feriado_{fecha_feriado}"):
+                    jornada.quitar_feriado(conn, fecha_feriado)
+                    st.rerun()
+
+
 @login_required
 def main():
     st.title("Sistema Gestor de Pacientes")
     menu = st.sidebar.selectbox(
         "Seleccione una opción", 
-        ["Inicio", "Registrar Paciente", "Lista de Pacientes", "Registrar Sesión", "Calendario de Turnos"]
+        ["Inicio", "Registrar Paciente", "Lista de Pacientes", "Registrar Sesión", "Calendario de Turnos", "Estadísticas", "Facturación"]
     )
     logout()
+    panel_mantenimiento()
+    panel_horario()
+
+    # Al cambiar de pantalla se descartan las ediciones a medio hacer
+    if st.session_state.get('menu_actual') != menu:
+        limpiar_ambitos(st.session_state)
+        st.session_state.pop('editing', None)
+        st.session_state.pop('viewing_sessions', None)
+        st.session_state.menu_actual = menu
+    sesiones_en_edicion = EstadoUI(st.session_state, 'edicion_sesiones', maximo=10)
 
                 #### INICIO ####
     if menu == "Inicio":
@@ -358,6 +655,8 @@ def main():
         3. **Lista de Pacientes**: Tabla con todos los pacientes registrados para acceder a la informacion de cada uno.
         4. **Registrar Sesiones**: Documenta cada sesión con sus observaciones para tener un historial detallado.
         5. **Calendario de Turnos**: Agrega y administra los turnos de los pacientes.
+        6. **Estadísticas**: Facturación mensual, asistencia por obra social y pacientes por año.
+        7. **Facturación**: Emite de una vez las facturas del mes de una obra social.
 
         ¡Gracias por confiar en nuestro sistema para una mejor organización!
 
@@ -422,7 +721,7 @@ def main():
             # Organizar turnos por fecha
         turnos_por_fecha = {}
         for turno in turnos_mes:
-            fecha = turno[2]
+            fecha = turno.fecha
             if fecha not in turnos_por_fecha:
                 turnos_por_fecha[fecha] = []
             turnos_por_fecha[fecha].append(turno)
@@ -440,7 +739,7 @@ def main():
                         # Añadir turnos del día
                     if fecha in turnos_por_fecha:
                         for turno in turnos_por_fecha[fecha]:
-                            tabla_html += f"<div class='turno'>{turno[3]} - {turno[1]}</div>"
+                            tabla_html += f"<div class='turno'>{turno.hora} - {turno.nombre}</div>"
                         
                     tabla_html += "</td>"
             tabla_html += "</tr>"
@@ -482,6 +781,7 @@ def main():
                                             list(range(2021, datetime.now().year + 1)))
         
             telefono_paciente = st.text_input("Teléfono del Paciente")
+            email = st.text_input("Email (para recordatorios de turnos)")
             nombre_padre = st.text_input("Nombre del Padre/Tutor")
             telefono_padre = st.text_input("Teléfono del Padre/Tutor")
             nombre_madre = st.text_input("Nombre de la Madre/Tutora")
@@ -508,12 +808,16 @@ def main():
             
             if st.form_submit_button("Guardar"):
                 if nombre and apellido and dni and domicilio:
-                    agregar_paciente(nombre, apellido, dni, fecha_nacimiento,
-                                    nombre_padre, telefono_padre, nombre_madre, 
-                                    telefono_madre, nombre_familiar, telefono_familiar, 
-                                    domicilio, motivo_consulta, datos_escolares,
-                                    año_inicio_consulta,telefono_paciente,obra_social,
-                                    numero_afiliado,diagnostico, actividad)
+                    agregar_paciente(Paciente(
+                        id=None, nombre=nombre, apellido=apellido, dni=dni,
+                        fecha_nacimiento=fecha_nacimiento, nombre_padre=nombre_padre,
+                        telefono_padre=telefono_padre, nombre_madre=nombre_madre,
+                        telefono_madre=telefono_madre, nombre_familiar=nombre_familiar,
+                        telefono_familiar=telefono_familiar, domicilio=domicilio,
+                        motivo_consulta=motivo_consulta, datos_escolares=datos_escolares,
+                        año_inicio_consulta=año_inicio_consulta, telefono_paciente=telefono_paciente,
+                        obra_social=obra_social, numero_afiliado=numero_afiliado,
+                        diagnostico=diagnostico, actividad=actividad, email=email))
                     st.success("Paciente registrado correctamente")
                     
                 else:
@@ -523,9 +827,38 @@ def main():
             #### LISTA DE PACIENTES ####
     elif menu == "Lista de Pacientes":
         st.header("Lista de Pacientes")
+
+        sugerencias = sugerencias_duplicados()
+        if sugerencias:
+            with st.expander(f"🔁 Posibles pacientes duplicados ({len(sugerencias)})"):
+                por_id = {paciente.id: paciente for paciente in obtener_pacientes()}
+                for sugerencia in sugerencias[:MAX_SUGERENCIAS]:
+                    conservar, duplicado = por_id.get(sugerencia.conservar), por_id.get(sugerencia.duplicado)
+                    if conservar is None or duplicado is None:
+                        continue
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.write(f"**{conservar.apellido}, {conservar.nombre}** (DNI {conservar.dni}) ← "
+                                 f"{duplicado.apellido}, {duplicado.nombre} (DNI {duplicado.dni})")
+                        st.caption(f"Coinciden: {', '.join(sugerencia.motivos) or 'nombre parecido'} "
+                                   f"· puntaje {sugerencia.puntaje:.2f}")
+                    with col2:
+                        if st.button("Fusionar", key=f"fusionar_{sugerencia.conservar}_{sugerencia.duplicado}"):
+                            reporte = duplicados.fusionar(conn, sugerencia.conservar, sugerencia.duplicado)
+                            st.session_state['mensaje_fusion'] = (
+                                f"Pacientes fusionados: se movieron {reporte['sesiones']} sesiones "
+                                f"y {reporte['turnos'] + reporte['reglas']} turnos")
+                            if reporte['ambiguos']:
+                                st.session_state['aviso_turnos'] = AVISO_TURNOS_AMBIGUOS
+                            st.rerun()
+        if 'mensaje_fusion' in st.session_state:
+            st.success(st.session_state.pop('mensaje_fusion'))
+        if 'aviso_turnos' in st.session_state:
+            st.warning(st.session_state.pop('aviso_turnos'))
         
         # Obtener DataFrame de pacientes
-        df_pacientes = obtener_pacientes_df()
+        incluir_archivados = st.checkbox("Incluir pacientes archivados", value=False)
+        df_pacientes = obtener_pacientes_df(incluir_archivados)
         
         # Agregar columna de edad
         df_pacientes['edad'] = df_pacientes['fecha_nacimiento'].apply(calcular_edad)
@@ -594,17 +927,32 @@ def main():
 
             st.dataframe(tabla_resumen, use_container_width=True)
 
+            if st.button("📚 Generar historias clínicas de los pacientes listados"):
+                barra = st.progress(0.0)
+                historias = historia.historias_pacientes([int(i) for i in df_filtrado['id']], ruta_db,
+                                                         carpeta_de(ruta_db, historia.HISTORIAS_DIR),
+                                                         progreso=lambda hechas, total: barra.progress(hechas / total))
+                comprimido = io.BytesIO()
+                with zipfile.ZipFile(comprimido, 'w', zipfile.ZIP_DEFLATED) as zip_historias:
+                    for nombre, contenido in historias.values():
+                        zip_historias.writestr(nombre, contenido)
+                st.download_button("⬇️ Descargar historias (.zip)", comprimido.getvalue(),
+                                   file_name="historias_clinicas.zip", mime="application/zip")
+
    
 
             # Lista de pacientes con detalles expandibles
             for _, paciente in df_filtrado.iterrows():
                 # Obtener estadísticas de sesiones
-                stats = obtener_estadisticas_sesiones(paciente['id'])
-                ultima_sesion = obtener_ultima_sesion(paciente['id'])
+                stats = obtener_estadisticas_sesiones(paciente['id'], incluir_archivados)
+                ultima_sesion = obtener_ultima_sesion(paciente['id'], incluir_archivados)
                 estado = "🟢 Activo" if paciente['actividad'] else "🔴 Inactivo"
+                if paciente['archivado']:
+                    estado += " 🗄️ Archivado"
                 
                 with st.expander(f"📋 {paciente['nombre']} {paciente['apellido']} - DNI: {paciente['dni']} - {estado}" ):
                     st.markdown(f"**Estado:** {estado}")
+                    clinicos = datos_clinicos(paciente)
                     # Primera fila: Información general y estadísticas
                     col1, col2 = st.columns(2)
 
@@ -614,7 +962,7 @@ def main():
                         st.write(f"Edad: {paciente['edad']} años")
                         st.write(f"Domicilio: {paciente['domicilio']}")                        
                         st.write(f"Obra Social: {paciente['obra_social']} N°: {paciente['numero_afiliado']}")                        
-                        st.write(f"Diagnostico: {paciente['diagnostico']}")              
+                        st.write(f"Diagnostico: {clinicos['diagnostico']}")              
                                           
                     with col2:
                         st.subheader("Información de Contacto")
@@ -623,6 +971,7 @@ def main():
                         st.write(f"Madre/Tutora: {paciente['nombre_madre']}")
                         st.write(f"Tel. Madre: {paciente['telefono_madre']}")
                         st.write(f"Tel. Paciente: {paciente['telefono_paciente']}")
+                        st.write(f"Email: {paciente['email'] or '-'}")
 
                     st.markdown("---")
 
@@ -650,7 +999,7 @@ def main():
                     
                     with col1:
                         st.markdown("**Motivo de Consulta:**")
-                        st.text_area("", paciente['motivo_consulta'], height=100, 
+                        st.text_area("", clinicos['motivo_consulta'], height=100, 
                                 key=f"motivo_{paciente['id']}", disabled=True)
                     
                     with col2:
@@ -660,19 +1009,42 @@ def main():
 
                     # Botones de acción
                     st.markdown("---")
+                    if paciente['archivado']:
+                        if st.button("♻️ Reactivar paciente", key=f"restore_{paciente['id']}"):
+                            archivo.restaurar_paciente(conn, int(paciente['id']))
+                            st.success("Paciente reactivado")
+                            st.rerun()
+                        continue
                     col1, col2, col3 = st.columns(3)
                     with col1:
                         if st.button("✏️ Editar", key=f"edit_{paciente['id']}"):
                             st.session_state.editing = paciente['id']
                     with col2:
                         if st.button("🗑️ Eliminar", key=f"delete_{paciente['id']}"):
-                            eliminar_paciente(paciente['id'])
+                            if eliminar_paciente(int(paciente['id'])).get('ambiguos'):
+                                st.session_state['aviso_turnos'] = AVISO_TURNOS_AMBIGUOS
                             st.success("Paciente eliminado correctamente")
                             st.rerun()
                     with col3:
                         if st.button("📝 Sesiones", key=f"sessions_{paciente['id']}"):
                             st.session_state.viewing_sessions = paciente['id']
 
+                    # La historia clínica se arma en segundo plano; la página no se bloquea
+                    if st.button("📄 Historia clínica", key=f"historia_{paciente['id']}"):
+                        historia.solicitar_historia(int(paciente['id']), ruta_db,
+                                                    carpeta_de(ruta_db, historia.HISTORIAS_DIR))
+                    pedido = historia.pedido_historia(int(paciente['id']), ruta_db)
+                    if pedido is not None:
+                        if not pedido.done():
+                            st.info("Generando la historia clínica... vuelva a abrir la ficha en unos segundos")
+                        elif pedido.exception() is not None:
+                            st.error(f"No se pudo generar la historia clínica: {pedido.exception()}")
+                        else:
+                            nombre, contenido = pedido.result()
+                            st.download_button("⬇️ Descargar historia clínica", contenido,
+                                               file_name=nombre, mime="text/html",
+                                               key=f"descargar_historia_{paciente['id']}")
+
                     # Mostrar formulario de edición
                     if st.session_state.get('editing') == paciente['id']:
                         st.markdown("### Editar Paciente")
@@ -686,6 +1058,7 @@ def main():
                         nuevo_año_inicio_consulta = st.selectbox("Año de Inicio de Consulta", 
                                            list(range(2021, datetime.now().year + 1))) 
                         nuevo_telefono_paciente = st.text_input("Teléfono del Paciente")                                           
+                        nuevo_email = st.text_input("Email", paciente['email'] or "")
                         nuevo_nombre_padre = st.text_input("Nombre del Padre", paciente['nombre_padre'])
                         nuevo_tel_padre = st.text_input("Teléfono del Padre", paciente['telefono_padre'])
                         nuevo_nombre_madre = st.text_input("Nombre de la Madre", paciente['nombre_madre'])
@@ -704,7 +1077,7 @@ def main():
                                 nuevo_numero_afiliado = st.text_input("Numero de Afiliado")
                         else:
                             nuevo_numero_afiliado = ""                           
-                        nuevo_motivo = st.text_area("Motivo de Consulta", paciente['motivo_consulta'])
+                        nuevo_motivo = st.text_area("Motivo de Consulta", cifrado.texto(paciente['motivo_consulta']))
                         nuevos_datos_escolares = st.text_area("Datos Escolares", paciente['datos_escolares'])
                         nuevo_diagnostico = st.text_input("Diagnostico del Paciente")
 
@@ -712,13 +1085,19 @@ def main():
                         col1, col2 = st.columns(2)
                         with col1:
                             if st.button("Guardar Cambios"):
-                                actualizar_paciente(
-                                    paciente['id'], nuevo_nombre, nuevo_apellido, nuevo_dni, 
-                                    nueva_fecha, nuevo_nombre_padre, nuevo_tel_padre,
-                                    nuevo_nombre_madre, nuevo_tel_madre, nuevo_nombre_familiar,
-                                    nuevo_tel_familiar, nuevo_domicilio, nuevo_motivo, nuevos_datos_escolares,
-                                    nuevo_año_inicio_consulta,nuevo_telefono_paciente,nueva_obra_social,nuevo_numero_afiliado,nuevo_diagnostico, nueva_actividad
-                                )
+                                actualizar_paciente(Paciente(
+                                    id=int(paciente['id']), nombre=nuevo_nombre, apellido=nuevo_apellido,
+                                    dni=nuevo_dni, fecha_nacimiento=nueva_fecha,
+                                    nombre_padre=nuevo_nombre_padre, telefono_padre=nuevo_tel_padre,
+                                    nombre_madre=nuevo_nombre_madre, telefono_madre=nuevo_tel_madre,
+                                    nombre_familiar=nuevo_nombre_familiar, telefono_familiar=nuevo_tel_familiar,
+                                    domicilio=nuevo_domicilio, motivo_consulta=nuevo_motivo,
+                                    datos_escolares=nuevos_datos_escolares,
+                                    año_inicio_consulta=nuevo_año_inicio_consulta,
+                                    telefono_paciente=nuevo_telefono_paciente, obra_social=nueva_obra_social,
+                                    numero_afiliado=nuevo_numero_afiliado, diagnostico=nuevo_diagnostico,
+                                    actividad=nueva_actividad, email=nuevo_email
+                                ))
                                 st.success("Paciente actualizado correctamente")
                                 st.session_state.editing = None
                                 st.rerun()
@@ -747,12 +1126,13 @@ def main():
                             """, unsafe_allow_html=True)
                             
                             for sesion in sesiones:
-                                sesion_id, _, fecha, notas, asistio, pago, monto, numero_factura = sesion
+                                sesion_id, fecha, notas = sesion.id, sesion.fecha, sesion.notas
+                                asistio, pago, monto, numero_factura = sesion.asistio, sesion.pago, sesion.monto, sesion.numero_factura
                                 
                                 st.markdown(f'<div class="session-container">', unsafe_allow_html=True)
                                 
                                 # Verificar si esta sesión está en modo edición
-                                is_editing = st.session_state.get(f'editing_session_{sesion_id}', False)
+                                is_editing = sesiones_en_edicion.obtener(sesion_id, False)
                                 
                                 if is_editing:
                                     # Modo edición
@@ -782,12 +1162,12 @@ def main():
                                                     nuevo_asistio, nuevo_pago, nuevo_monto, 
                                                     nuevo_numero_factura
                                                 )
-                                                st.session_state[f'editing_session_{sesion_id}'] = False
+                                                sesiones_en_edicion.quitar(sesion_id)
                                                 st.success("Sesión actualizada")
                                                 st.rerun()
                                         with col4:
                                             if st.button("❌", key=f"cancel_edit_{sesion_id}"):
-                                                st.session_state[f'editing_session_{sesion_id}'] = False
+                                                sesiones_en_edicion.quitar(sesion_id)
                                                 st.rerun()
                                 else:
                                     # Modo visualización
@@ -809,7 +1189,7 @@ def main():
                                         col3, col4 = st.columns(2)
                                         with col3:
                                             if st.button("✏️", key=f"edit_session_{sesion_id}"):
-                                                st.session_state[f'editing_session_{sesion_id}'] = True
+                                                sesiones_en_edicion.guardar(sesion_id)
                                                 st.rerun()
                                         with col4:
                                             if st.button("🗑️", key=f"del_session_{sesion_id}"):
@@ -823,6 +1203,7 @@ def main():
                         
                         if st.button("❌ Cerrar Sesiones", key=f"close_sessions_{paciente['id']}"):
                             st.session_state.viewing_sessions = None
+                            sesiones_en_edicion.limpiar()
                             st.rerun()
                     
 
@@ -834,8 +1215,8 @@ def main():
         pacientes = obtener_pacientes()
         if pacientes:
             paciente_seleccionado = st.selectbox("Seleccione un paciente", 
-                                            [f"{p[1]} {p[2]}" for p in pacientes])
-            paciente_id = [p[0] for p in pacientes if f"{p[1]} {p[2]}" == paciente_seleccionado][0]
+                                            [f"{p.nombre} {p.apellido}" for p in pacientes])
+            paciente_id = [p.id for p in pacientes if f"{p.nombre} {p.apellido}" == paciente_seleccionado][0]
             
             # Crear columnas para organizar mejor la interfaz
             col1, col2 = st.columns(2)
@@ -872,25 +1253,26 @@ def main():
                 sesiones_filtradas = sesiones
                 if filtro_fecha:
                     sesiones_filtradas = [s for s in sesiones_filtradas 
-                                        if datetime.strptime(s[2], '%Y-%m-%d').date() == filtro_fecha]
+                                        if datetime.strptime(s.fecha, '%Y-%m-%d').date() == filtro_fecha]
                 if filtro_pago != "Todos":
                     sesiones_filtradas = [s for s in sesiones_filtradas 
-                                        if (s[5] and filtro_pago == "Pagados") or 
-                                        (not s[5] and filtro_pago == "Pendientes")]
+                                        if (s.pago and filtro_pago == "Pagados") or 
+                                        (not s.pago and filtro_pago == "Pendientes")]
                 
                 # Mostrar total de deuda
-                total_deuda = sum([s[6] for s in sesiones_filtradas if not s[5]])
+                total_deuda = sum([s.monto for s in sesiones_filtradas if not s.pago])
                 if total_deuda > 0:
                     st.error(f"💸 Deuda total pendiente: ${total_deuda:.2f}")
                 else:
                     st.success("✨ No hay deuda pendiente")
                 
                 for sesion in sesiones_filtradas:
-                    sesion_id, _, fecha, notas, asistio, pago, monto, numero_factura = sesion
+                    sesion_id, fecha, notas = sesion.id, sesion.fecha, sesion.notas
+                    asistio, pago, monto, numero_factura = sesion.asistio, sesion.pago, sesion.monto, sesion.numero_factura
                     
                     with st.expander(f"Sesión del {fecha} - {'✅ Pagada' if pago else '⏳ Pendiente'}"):
                         # Verificar si esta sesión está en modo edición
-                        is_editing = st.session_state.get(f'editing_session_{sesion_id}', False)
+                        is_editing = sesiones_en_edicion.obtener(sesion_id, False)
                         
                         if is_editing:
                             # Modo edición
@@ -926,12 +1308,12 @@ def main():
                                         nuevo_asistio, nuevo_pago, nuevo_monto,
                                         nuevo_numero_factura
                                     )
-                                    st.session_state[f'editing_session_{sesion_id}'] = False
+                                    sesiones_en_edicion.quitar(sesion_id)
                                     st.success("Sesión actualizada")
                                     st.rerun()
                                 
                                 if st.button("❌ Cancelar", key=f"cancel_edit_{sesion_id}"):
-                                    st.session_state[f'editing_session_{sesion_id}'] = False
+                                    sesiones_en_edicion.quitar(sesion_id)
                                     st.rerun()
                         
                         else:
@@ -951,7 +1333,7 @@ def main():
                             
                             with col2:
                                 if st.button("✏️ Editar", key=f"edit_session_{sesion_id}"):
-                                    st.session_state[f'editing_session_{sesion_id}'] = True
+                                    sesiones_en_edicion.guardar(sesion_id)
                                     st.rerun()
                                 
                                 if st.button("🗑️ Eliminar", key=f"del_session_{sesion_id}"):
@@ -961,12 +1343,59 @@ def main():
             else:
                 st.info("No hay sesiones registradas para este paciente")
 
+            # Edición de muchas sesiones a la vez (p. ej. marcar varias como pagadas)
+            with st.expander("✏️ Edición en bloque"):
+                alcance = st.radio("Sesiones de", ["Este paciente", "Un mes"], horizontal=True)
+                if alcance == "Este paciente":
+                    editor_sesiones(sesiones, f"paciente_{paciente_id}")
+                else:
+                    hoy = datetime.now()
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        año_edicion = st.number_input("Año", min_value=2000, max_value=2100,
+                                                      value=hoy.year, key="edicion_año")
+                    with col2:
+                        mes_edicion = st.selectbox("Mes", range(1, 13), index=hoy.month - 1,
+                                                   format_func=num_txt, key="edicion_mes")
+                    nombres = {p.id: f"{p.apellido}, {p.nombre}" for p in pacientes}
+                    editor_sesiones(obtener_sesiones_mes(int(año_edicion), mes_edicion),
+                                    f"mes_{año_edicion}_{mes_edicion}", nombres)
+
                                                 ### TURNOS ###
     elif menu == "Calendario de Turnos":
         st.title("Gestión de Turnos")
 
         # Crear pestañas para separar la vista de turnos y el registro
-        tab1, tab2, tab3 = st.tabs(["📅 Ver Turnos", "➕ Registrar Turno", "🗑️ Eliminar Turnos"])
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["📅 Ver Turnos", "➕ Registrar Turno", "🗑️ Eliminar Turnos",
+                                                "🏢 Consultorio compartido", "⏳ Lista de espera"])
+
+        # Horarios que quedaron libres al cancelar turnos y pacientes de la lista de espera que pueden tomarlos
+        if 'huecos_espera' in st.session_state:
+            with st.container():
+                st.subheader("Horarios liberados")
+                for fecha_libre, hora_libre, candidatos, turno_asignado in st.session_state['huecos_espera']:
+                    if turno_asignado:
+                        st.success(f"{fecha_libre} a las {hora_libre}: asignado a {candidatos[0][2]} desde la lista de espera")
+                        continue
+                    st.write(f"**{fecha_libre} a las {hora_libre}**")
+                    for espera_id, _, nombre_candidato, prioridad, alta in candidatos:
+                        col1, col2 = st.columns([3, 1])
+                        with col1:
+                            st.write(f"{nombre_candidato} (prioridad {prioridad}, en espera desde {alta})")
+                        with col2:
+                            if st.button("Asignar", key=f"asignar_espera_{espera_id}_{fecha_libre}_{hora_libre}"):
+                                if espera.asignar(conn, espera_id, fecha_libre, hora_libre):
+                                    st.session_state['huecos_espera'] = [
+                                        hueco for hueco in st.session_state['huecos_espera']
+                                        if (hueco[0], hueco[1]) != (fecha_libre, hora_libre)]
+                                    if not st.session_state['huecos_espera']:
+                                        del st.session_state['huecos_espera']
+                                    st.rerun()
+                                else:
+                                    st.error("El horario ya no está libre o el paciente dejó la lista de espera")
+                if st.button("Cerrar", key="cerrar_huecos_espera"):
+                    del st.session_state['huecos_espera']
+                    st.rerun()
 
         with tab1:
             st.header("Calendario de Turnos")
@@ -1028,7 +1457,7 @@ def main():
             # Organizar turnos por fecha
             turnos_por_fecha = {}
             for turno in turnos_mes:
-                fecha = turno[2]
+                fecha = turno.fecha
                 if fecha not in turnos_por_fecha:
                     turnos_por_fecha[fecha] = []
                 turnos_por_fecha[fecha].append(turno)
@@ -1046,7 +1475,7 @@ def main():
                         # Añadir turnos del día
                         if fecha in turnos_por_fecha:
                             for turno in turnos_por_fecha[fecha]:
-                                tabla_html += f"<div class='turno'>{turno[3]} - {turno[1]}</div>"
+                                tabla_html += f"<div class='turno'>{turno.hora} - {turno.nombre}</div>"
                         
                         tabla_html += "</td>"
                 tabla_html += "</tr>"
@@ -1058,15 +1487,47 @@ def main():
             if turnos_mes:            
                 st.markdown("### Lista de Turnos del Mes")
                 for turno in turnos_mes:
-                    with st.expander(f"{turno[2]} - {turno[3]} - {turno[1]}"):
+                    with st.expander(f"{turno.fecha} - {turno.hora} - {turno.nombre}"):
                         col1, col2 = st.columns([3, 1])
                         with col1:
-                            st.write(f"**Nombre:** {turno[1]}")
+                            st.write(f"**Nombre:** {turno.nombre}")
+                            if recurrencias.es_ocurrencia(turno.id):
+                                st.write("🔁 Turno recurrente")
                         with col2:
-                            if st.button("🗑️ Cancelar", key=f"del_turno_{turno[0]}"):
-                                eliminar_turno(turno[0])
+                            if st.button("🗑️ Cancelar", key=f"del_turno_{turno.id}"):
+                                eliminar_turno(turno.id)
+                                ofrecer_horarios_liberados([turno])
                                 st.success("Turno cancelado")
                                 st.rerun()
+                            if recurrencias.es_ocurrencia(turno.id):
+                                if st.button("🗑️ Cancelar serie", key=f"del_regla_{turno.id}"):
+                                    recurrencias.eliminar_regla(conn, recurrencias.separar_ocurrencia(turno.id)[0])
+                                    st.success("Turno recurrente eliminado")
+                                    st.rerun()
+
+            with st.expander("📆 Calendario externo (.ics)"):
+                st.write("Descargue la agenda para verla en el calendario del teléfono, o cargue los turnos de otra agenda")
+                col1, col2 = st.columns(2)
+                with col1:
+                    desde_ics = st.date_input("Desde", datetime(año, mes, 1), key="ics_desde")
+                with col2:
+                    hasta_ics = st.date_input("Hasta", datetime(año + 1, mes, 1), key="ics_hasta")
+                if hasta_ics < desde_ics:
+                    st.warning("La fecha final es anterior a la inicial")
+                else:
+                    st.download_button("⬇️ Descargar agenda (.ics)", agenda_en_ics(desde_ics, hasta_ics),
+                                       file_name=f"agenda_{desde_ics}_{hasta_ics}.ics", mime="text/calendar")
+
+                archivo_ics = st.file_uploader("Importar turnos desde un archivo .ics", type=["ics"])
+                if archivo_ics is not None and st.button("Importar turnos"):
+                    reporte = agenda_ics.importar_ics(conn, archivo_ics.getvalue().decode('utf-8-sig').splitlines(True))
+                    st.success(f"Se importaron {reporte['importados']} turnos")
+                    if reporte['conflictos']:
+                        st.warning(f"{len(reporte['conflictos'])} turnos no se importaron por conflictos de horario: "
+                                   + ", ".join(f"{fecha} {hora} ({nombre})" for fecha, hora, nombre in reporte['conflictos']))
+                    if reporte['omitidos']:
+                        st.info(f"{len(reporte['omitidos'])} eventos omitidos: "
+                                + ", ".join(f"{nombre} ({motivo})" for nombre, motivo in reporte['omitidos']))
         
         with tab2:
             st.header("Registrar Nuevo Turno")
@@ -1078,29 +1539,28 @@ def main():
             col1, col2 = st.columns(2)
             with col1:
                 if es_recurrente:
-                    dia_semana = st.selectbox("Día de la semana", 
-                                            ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"])
-                    primer_dia = datetime(año, mes, 1)
-                    ultimo_dia = datetime(año, mes, calendar.monthrange(año, mes)[1])
-                    
-                    dias_map = {"Lunes": 0, "Martes": 1, "Miércoles": 2, "Jueves": 3, "Viernes": 4}
-                    fechas_dia = []
-                    fecha_actual = primer_dia
-                    while fecha_actual <= ultimo_dia:
-                        if fecha_actual.weekday() == dias_map[dia_semana]:
-                            fechas_dia.append(fecha_actual.date())
-                        fecha_actual += timedelta(days=1)
+                    # Solo los días en que se atiende, según el horario de atención
+                    dia_semana = st.selectbox("Día de la semana", jornada.dias_laborables(conn),
+                                              format_func=lambda dia: jornada.DIAS[dia])
+
+                    # El turno recurrente se guarda como una regla; las fechas se calculan al consultar
+                    fecha_desde = st.date_input("Desde", datetime.today())
+                    sin_fin = st.checkbox("Sin fecha de finalización", value=False)
+                    fecha_hasta = None
+                    if not sin_fin:
+                        fecha_hasta = st.date_input("Hasta", datetime(datetime.today().year, 12, 31))
                 else:
                     fecha = st.date_input("Fecha", min_value=datetime.today())
             
             with col2:
-                horarios = []
-                hora_actual = datetime.strptime("08:00", "%H:%M")
-                hora_fin = datetime.strptime("20:00", "%H:%M")
-                while hora_actual < hora_fin:
-                    horarios.append(hora_actual.strftime("%H:%M"))
-                    hora_actual += timedelta(minutes=40)
-                hora = st.selectbox("Hora", horarios)
+                if es_recurrente:
+                    opciones_hora = jornada.horarios_dia_semana(conn, dia_semana) if dia_semana is not None else []
+                else:
+                    # Plantilla del día menos los horarios ya dados
+                    opciones_hora = horarios_disponibles(fecha)
+                hora = st.selectbox("Hora", opciones_hora)
+                if not opciones_hora:
+                    st.caption("No hay horarios libres ese día (o no se atiende)")
             
             # Inicializar estado si no existe
             if 'turno_registrado' not in st.session_state:
@@ -1109,23 +1569,20 @@ def main():
             if st.button("Registrar Turno"):
                 if nombre and hora:
                     if es_recurrente:
-                        turnos_exitosos = 0
-                        turnos_fallidos = 0
-                        for fecha_dia in fechas_dia:
-                            if verificar_disponibilidad(fecha_dia, hora):
-                                agregar_turno(nombre, fecha_dia, hora)
-                                turnos_exitosos += 1
-                            else:
-                                turnos_fallidos += 1
-                        
-                        if turnos_exitosos > 0:
+                        try:
+                            _, conflictos = recurrencias.agregar_regla(conn, nombre, dia_semana, hora, fecha_desde,
+                                                                       fecha_hasta, jornada.duracion_turno(conn))
+                        except ValueError as e:
+                            st.error(str(e))
+                        else:
                             st.session_state.turno_registrado = True
-                        if turnos_fallidos > 0:
-                            st.warning(f"No se pudieron registrar {turnos_fallidos} turnos por conflictos de horario")
-                        st.rerun()
+                            if conflictos:
+                                st.session_state['mensaje_conflictos'] = (
+                                    f"No se pudieron registrar {len(conflictos)} turnos por conflictos de horario: "
+                                    + ", ".join(conflictos))
+                            st.rerun()
                     else:
-                        if verificar_disponibilidad(fecha, hora):
-                            agregar_turno(nombre, fecha, hora)
+                        if reservar_turno(nombre, fecha, hora):
                             st.session_state.turno_registrado = True
                             st.rerun()
                         else:
@@ -1137,6 +1594,9 @@ def main():
             if st.session_state.turno_registrado:
                 st.success("Turno registrado exitosamente")
                 st.session_state.turno_registrado = False
+            if 'mensaje_conflictos' in st.session_state:
+                st.warning(st.session_state['mensaje_conflictos'])
+                del st.session_state['mensaje_conflictos']
         
         with tab3:
             st.header("Eliminar Turnos por Paciente")
@@ -1159,19 +1619,13 @@ def main():
                 )
                 
                 # Mostrar turnos del paciente seleccionado
-                cursor.execute('''
-                    SELECT fecha, hora
-                    FROM turnos
-                    WHERE nombre = ? AND strftime('%Y', fecha) = ? AND strftime('%m', fecha) = ?
-                    ORDER BY fecha, hora
-                ''', (paciente_seleccionado, str(año), str(mes).zfill(2)))
-                
-                turnos_paciente = cursor.fetchall()
+                turnos_paciente = [turno for turno in obtener_turnos_mes(año, mes)
+                                   if turno.nombre == paciente_seleccionado]
                 
                 if turnos_paciente:
                     st.write("Turnos programados para", paciente_seleccionado)
-                    for fecha, hora in turnos_paciente:
-                        st.write(f"- {fecha} a las {hora}")
+                    for turno in turnos_paciente:
+                        st.write(f"- {turno.fecha} a las {turno.hora}")
                     
                     # Opciones de eliminación
                     opcion_eliminar = st.radio(
@@ -1182,23 +1636,21 @@ def main():
                     if opcion_eliminar == "Todos los turnos":
                         if st.button("Eliminar Todos los Turnos", type="primary"):
                             turnos_eliminados = eliminar_turnos_por_nombre(paciente_seleccionado)
+                            ofrecer_horarios_liberados(turnos_paciente)
                             st.session_state['mensaje_exito'] = f"Se eliminaron {turnos_eliminados} turnos del paciente {paciente_seleccionado}"
                             st.rerun()
                     else:
                         # Permitir selección múltiple de turnos
                         turnos_a_eliminar = st.multiselect(
                             "Seleccione los turnos a eliminar",
-                            [(fecha, hora) for fecha, hora in turnos_paciente],
-                            format_func=lambda x: f"{x[0]} a las {x[1]}"
+                            turnos_paciente,
+                            format_func=lambda x: f"{x.fecha} a las {x.hora}"
                         )
                         
                         if turnos_a_eliminar and st.button("Eliminar Turnos Seleccionados", type="primary"):
-                            for fecha, hora in turnos_a_eliminar:
-                                cursor.execute('''
-                                    DELETE FROM turnos 
-                                    WHERE nombre = ? AND fecha = ? AND hora = ?
-                                ''', (paciente_seleccionado, fecha, hora))
-                            conn.commit()
+                            for turno in turnos_a_eliminar:
+                                eliminar_turno(turno.id)
+                            ofrecer_horarios_liberados(turnos_a_eliminar)
                             st.session_state['mensaje_exito'] = f"Se eliminaron {len(turnos_a_eliminar)} turnos seleccionados"
                             st.rerun()
             else:
@@ -1208,6 +1660,212 @@ def main():
             if 'mensaje_exito' in st.session_state:
                 st.success(st.session_state['mensaje_exito'])
                 del st.session_state['mensaje_exito']  # Limpiar el mensaje después de mostrarlo
+
+        with tab4:
+            st.header("Turnos de todos los profesionales")
+            col1, col2 = st.columns(2)
+            with col1:
+                desde_compartido = st.date_input("Desde", datetime.today(), key="compartido_desde")
+            with col2:
+                hasta_compartido = st.date_input("Hasta", datetime.today(), key="compartido_hasta")
+            if hasta_compartido < desde_compartido:
+                st.warning("La fecha final es anterior a la inicial")
+            else:
+                with obtener_autenticador().pool.conexion() as central:
+                    bases_centro = profesionales.bases(central)
+                agenda = _agenda_centro(bases_centro, desde_compartido, hasta_compartido,
+                                        version_centro(bases_centro, *recurrencias.TABLAS))
+                # Los pacientes de otro profesional solo los ve el administrador; el resto ve la ocupación
+                propios = None if es_administrador() else {usuario for usuario, ruta in bases_centro if ruta == ruta_db}
+                if agenda:
+                    st.dataframe(pd.DataFrame([(turno.fecha, turno.hora, usuario,
+                                                turno.nombre if propios is None or usuario in propios else "Ocupado")
+                                               for usuario, turno in agenda],
+                                              columns=['Fecha', 'Hora', 'Profesional', 'Paciente']),
+                                 use_container_width=True, hide_index=True)
+                else:
+                    st.info("No hay turnos en ese período")
+
+        with tab5:
+            st.header("Lista de espera")
+            automatico = st.checkbox("Asignar automáticamente el horario liberado al primer candidato",
+                                     value=espera.asignacion_automatica(conn), key="espera_automatica")
+            if automatico != espera.asignacion_automatica(conn):
+                espera.activar_asignacion_automatica(conn, automatico)
+
+            en_espera = obtener_lista_espera()
+            if en_espera:
+                for espera_id, _, nombre_espera, prioridad, alta, franjas, notas in en_espera:
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.write(f"**{nombre_espera}** (prioridad {prioridad}, desde {alta}): {franjas}")
+                        if notas:
+                            st.caption(notas)
+                    with col2:
+                        if st.button("Quitar", key=f"baja_espera_{espera_id}"):
+                            espera.dar_de_baja(conn, espera_id)
+                            st.rerun()
+            else:
+                st.info("No hay pacientes en espera")
+
+            st.subheader("Agregar a la lista")
+            pacientes_espera = obtener_pacientes()
+            dias_atencion = jornada.obtener_jornada(conn)
+            if not dias_atencion:
+                st.info("Configure el horario de atención para poder anotar pacientes en espera")
+            elif pacientes_espera:
+                paciente_espera = st.selectbox("Paciente", pacientes_espera,
+                                               format_func=lambda p: f"{p.nombre} {p.apellido}", key="paciente_espera")
+                dias_espera = st.multiselect("Días que puede asistir", sorted(dias_atencion),
+                                             format_func=lambda d: espera.DIAS[d], key="dias_espera")
+                # Horas enteras desde la primera apertura hasta el último cierre de la semana
+                apertura = min(recurrencias.a_minutos(inicio) for inicio, _, _ in dias_atencion.values()) // 60
+                cierre = -(-max(recurrencias.a_minutos(fin) for _, fin, _ in dias_atencion.values()) // 60)
+                horas_espera = [f"{hora:02d}:00" for hora in range(apertura, cierre + 1)]
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    desde_espera = st.selectbox("Desde", horas_espera, key="desde_espera")
+                with col2:
+                    hasta_espera = st.selectbox("Hasta", horas_espera, len(horas_espera) - 1, key="hasta_espera")
+                with col3:
+                    prioridad_espera = st.number_input("Prioridad", 0, 10, 0, key="prioridad_espera")
+                notas_espera = st.text_input("Notas", key="notas_espera")
+                if st.button("Agregar a la lista de espera"):
+                    try:
+                        espera.agregar_a_espera(conn, paciente_espera.id,
+                                                [(dia, desde_espera, hasta_espera) for dia in dias_espera],
+                                                prioridad_espera, notas_espera or None)
+                        st.rerun()
+                    except ValueError as e:
+                        st.warning(str(e))
+
+                                                ### ESTADISTICAS ###
+    elif menu == "Estadísticas":
+        st.title("Estadísticas del Consultorio")
+
+        # Los gráficos leen las tablas de resumen mensual, no las sesiones una por una
+        columnas = ['mes', 'obra_social', 'sesiones', 'asistidas', 'pagadas', 'facturado', 'cobrado', 'pacientes']
+        df_resumen = pd.DataFrame(estadisticas.resumen_mensual(conn), columns=columnas)
+
+        if df_resumen.empty:
+            st.info("Todavía no hay sesiones registradas")
+        else:
+            años = sorted({mes[:4] for mes in df_resumen['mes']})
+            col1, col2 = st.columns(2)
+            with col1:
+                año_desde = st.selectbox("Desde", años, 0)
+            with col2:
+                año_hasta = st.selectbox("Hasta", años, len(años) - 1)
+            df_resumen = df_resumen[(df_resumen['mes'] >= año_desde) & (df_resumen['mes'] <= f"{año_hasta}-12")]
+
+            st.subheader("Facturación por mes")
+            por_mes = df_resumen.groupby('mes')[['facturado', 'cobrado']].sum()
+            por_mes['pendiente'] = por_mes['facturado'] - por_mes['cobrado']
+            st.bar_chart(por_mes[['cobrado', 'pendiente']])
+
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Facturado", f"${por_mes['facturado'].sum():,.2f}")
+            with col2:
+                st.metric("Cobrado", f"${por_mes['cobrado'].sum():,.2f}")
+            with col3:
+                st.metric("Pendiente", f"${por_mes['pendiente'].sum():,.2f}")
+
+            st.subheader("Asistencia por obra social")
+            por_obra_social = df_resumen.groupby('obra_social')[['sesiones', 'asistidas', 'pagadas', 'facturado']].sum()
+            por_obra_social['asistencia (%)'] = (por_obra_social['asistidas'] / por_obra_social['sesiones'] * 100).round(1)
+            st.bar_chart(por_obra_social['asistencia (%)'])
+            st.dataframe(por_obra_social, use_container_width=True)
+
+        st.subheader("Pacientes por año de inicio de consulta")
+        df_años = pd.DataFrame(estadisticas.pacientes_por_año(conn), columns=['Año', 'Activos', 'Inactivos'])
+        if not df_años.empty:
+            st.bar_chart(df_años.set_index('Año'))
+
+        st.subheader("Deudas por antigüedad")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            agrupar = st.radio("Agrupar por", ["Paciente", "Obra social"], horizontal=True)
+            agrupar = 'paciente' if agrupar == "Paciente" else 'obra_social'
+        with col2:
+            filtro_obra_social = st.selectbox("Obra social", ["Todas"] + obras_sociales[:-1], key="deuda_os")
+        with col3:
+            orden_deuda = st.selectbox("Ordenar por", ["total", "antiguedad", "90+", "nombre"])
+        deuda_minima = st.number_input("Mostrar deudas mayores a ($)", min_value=0.0, step=100.0)
+
+        filas_deuda = deudas.antiguedad_deudas(conn, agrupar,
+                                               obra_social=None if filtro_obra_social == "Todas" else filtro_obra_social,
+                                               minimo=deuda_minima, orden=orden_deuda)
+        if filas_deuda:
+            df_deudas = pd.DataFrame(filas_deuda, columns=deudas.COLUMNAS[agrupar])
+            st.dataframe(df_deudas.drop(columns=['paciente_id'], errors='ignore'), use_container_width=True)
+            # download_button necesita el archivo entero: acá el CSV se arma en memoria (la CLI sí lo escribe por partes)
+            st.download_button("⬇️ Exportar CSV", ''.join(deudas.exportar_csv(filas_deuda, agrupar)),
+                               file_name=f"deudas_{agrupar}.csv", mime="text/csv")
+        else:
+            st.success("✨ No hay deudas pendientes")
+
+        if st.button("Reconstruir resúmenes"):
+            meses = estadisticas.reconstruir_resumenes(conn)
+            st.success(f"Se recalcularon {meses} meses")
+
+    elif menu == "Facturación":
+        st.title("Facturación")
+
+        hoy = datetime.now()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            obra_social = st.selectbox("Obra social", obras_sociales[:-1], key="factura_os")
+        with col2:
+            año_factura = st.number_input("Año", min_value=2000, max_value=2100, value=hoy.year, key="factura_año")
+        with col3:
+            mes_factura = st.selectbox("Mes", range(1, 13), index=hoy.month - 1, format_func=num_txt, key="factura_mes")
+        mes = f"{int(año_factura):04d}-{mes_factura:02d}"
+
+        pendientes = facturacion.sesiones_a_facturar(conn, obra_social, mes)
+        if pendientes:
+            pacientes_a_facturar = len({fila[1] for fila in pendientes})
+            st.info(f"{len(pendientes)} sesiones impagas sin facturar de {pacientes_a_facturar} pacientes, "
+                    f"por ${sum(fila[3] for fila in pendientes):,.2f}")
+            if st.button("🧾 Facturar mes"):
+                numeros = facturacion.facturar_mes(conn, obra_social, mes)
+                barra = st.progress(0.0)
+                facturacion.renderizar_facturas(conn, numeros, carpeta_de(ruta_db, facturacion.FACTURAS_DIR),
+                                                progreso=lambda hechas, total: barra.progress(hechas / total))
+                st.success(f"Se emitieron {len(numeros)} facturas")
+        else:
+            st.success("No hay sesiones pendientes de facturar para ese mes")
+
+        st.subheader("Facturas emitidas")
+        facturas = facturacion.facturas_del_mes(conn, mes, obra_social)
+        if facturas:
+            st.dataframe(pd.DataFrame(facturas, columns=['Número', 'Paciente', 'Obra social', 'Emitida', 'Total']),
+                         use_container_width=True, hide_index=True)
+            numero = st.selectbox("Documento", [fila[0] for fila in facturas])
+            ruta = pathlib.Path(carpeta_de(ruta_db, facturacion.FACTURAS_DIR)) / f"factura_{numero}.html"
+            if not ruta.exists():
+                facturacion.renderizar_facturas(conn, [numero], str(ruta.parent))
+            st.download_button("⬇️ Descargar factura", ruta.read_text(encoding='utf-8'),
+                               file_name=ruta.name, mime="text/html")
+        else:
+            st.info("Todavía no hay facturas para este mes")
+
+        # Vista de todo el centro (solo el administrador): se consulta la base de cada profesional en paralelo
+        if es_administrador():
+            with st.expander("🏢 Resumen del centro"):
+                with obtener_autenticador().pool.conexion() as central:
+                    bases_centro = profesionales.bases(central)
+                filas_centro, totales_centro = _facturacion_centro(bases_centro, mes,
+                                                                   version_centro(bases_centro, 'pacientes', 'sesiones'))
+                if filas_centro:
+                    st.dataframe(pd.DataFrame(filas_centro, columns=['Obra social', 'Profesional', 'Sesiones',
+                                                                     'Monto', 'Cobrado', 'Facturadas']),
+                                 use_container_width=True, hide_index=True)
+                    st.dataframe(pd.DataFrame([(obra, *total) for obra, total in totales_centro.items()],
+                                              columns=['Obra social', 'Sesiones', 'Monto', 'Cobrado', 'Facturadas']),
+                                 use_container_width=True, hide_index=True)
+                else:
+                    st.info("Ningún profesional registró sesiones en este mes")
                         
     
 if __name__ == "__main__":
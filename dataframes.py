@@ -0,0 +1,73 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+LOTE = 10_000  # Filas leídas del cursor por tanda
+
+# Tipos de las columnas de pacientes. Las que no figuran quedan como texto (object)
+TIPOS_PACIENTES = {
+    'id': 'int64',
+    'dni': 'Int64',
+    'año_inicio_consulta': 'Int64',
+    'obra_social': 'category',
+    'actividad': 'bool',
+    'archivado': 'bool',
+}
+
+
+def _convertir(serie, tipo):
+    if tipo == 'category':
+        return serie.astype('category')
+    if tipo == 'bool':
+        # None en la base se muestra como inactivo, igual que antes
+        return serie.fillna(False).astype(bool)
+    if tipo == 'Int64':
+        numeros = pd.to_numeric(serie, errors='coerce')
+        if numeros.isna().sum() > serie.isna().sum():
+            return serie  # Hay texto que no es un número (p. ej. un DNI con puntos): no se pierde
+        try:
+            return numeros.astype('Int64')
+        except TypeError:
+            return serie  # Números con decimales
+    return serie.astype(tipo)
+
+
+def _tipar(parte, tipos):
+    for columna, tipo in tipos.items():
+        if columna in parte:
+            parte[columna] = _convertir(parte[columna], tipo)
+    return parte
+
+
+def leer_df(conn, sql, parametros=(), tipos=None, lote=LOTE):
+    """
+    Arma un DataFrame leyendo el cursor por tandas y tipando cada tanda apenas se lee,
+    así nunca conviven la lista completa de tuplas y el DataFrame de objetos.
+    Las columnas 'category' se unen al final sin pasar por object
+    """
+    tipos = tipos or {}
+    cursor = conn.execute(sql, parametros)
+    nombres = [descripcion[0] for descripcion in cursor.description]
+    categoricas = [c for c in nombres if tipos.get(c) == 'category']
+
+    partes, categorias = [], {c: [] for c in categoricas}
+    while True:
+        filas = cursor.fetchmany(lote)
+        if not filas:
+            break
+        parte = _tipar(pd.DataFrame.from_records(filas, columns=nombres), tipos)
+        for columna in categoricas:
+            categorias[columna].append(parte.pop(columna))
+        partes.append(parte)
+
+    if not partes:
+        return pd.DataFrame({c: pd.Series(dtype=tipos.get(c, object)) for c in nombres})
+    df = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+    for columna in categoricas:
+        df[columna] = union_categoricals(categorias[columna]) if len(partes) > 1 else categorias[columna][0].values
+    return df[nombres]
+
+
+def memoria_df(df):
+    """Bytes que ocupa cada columna (contando el contenido de los textos) y el total"""
+    por_columna = df.memory_usage(deep=True, index=False)
+    return {'columnas': por_columna.to_dict(), 'total': int(por_columna.sum())}
@@ -0,0 +1,376 @@
+import calendar
+from datetime import datetime, timedelta
+
+import archivo
+import borrado
+import cifrado
+import compresion
+import deudas
+import espera
+import estadisticas
+import facturacion
+import jornada
+import recordatorios
+import recurrencias
+from configuracion import crear_tabla_configuracion
+from modelos import Paciente, Sesion, Turno, columnas, consultar
+from versiones import crear_versiones, crear_versiones_pacientes
+
+# Capa de datos sin Streamlit: todas las funciones reciben la conexión, así las usan
+# tanto la interfaz (consult.py) como la API (api.py) o cualquier script
+
+# Valores de siempre; el horario de atención y la duración configurados están en jornada
+DURACION_TURNO = jornada.DURACION_TURNO  # minutos
+HORA_INICIO = jornada.HORA_INICIO
+HORA_FIN = jornada.HORA_FIN
+
+# Columnas que se devuelven al buscar pacientes: solo identificación y contacto, sin datos clínicos
+CAMPOS_BUSQUEDA = ('id', 'nombre', 'apellido', 'dni', 'obra_social', 'telefono_paciente', 'email', 'actividad')
+
+
+def crear_esquema(conn):
+    """Crea las tablas, índices y triggers que faltan (idempotente)"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS pacientes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        apellido TEXT NOT NULL,
+        dni INTEGER NOT NULL,
+        fecha_nacimiento TEXT,
+        nombre_padre TEXT,
+        telefono_padre TEXT,
+        nombre_madre TEXT,
+        telefono_madre TEXT,
+        nombre_familiar TEXT,
+        telefono_familiar TEXT,
+        domicilio TEXT,
+        motivo_consulta TEXT,
+        datos_escolares TEXT,
+        año_inicio_consulta INTEGER,
+        telefono_paciente INTEGRER,
+        obra_social TEXT,
+        numero_afiliado INTEGRER,
+        diagnostico TEXT,
+        actividad BOOL,
+        email TEXT
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sesiones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        paciente_id INTEGER,
+        fecha TEXT,
+        notas TEXT,
+        asistio BOOLEAN,
+        pago BOOLEAN,
+        monto REAL,
+        numero_factura TEXT,
+        FOREIGN KEY (paciente_id) REFERENCES pacientes(id) ON DELETE CASCADE
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS turnos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        fecha DATE NOT NULL,
+        hora TIME NOT NULL
+    )
+    ''')
+    conn.commit()
+
+    crear_tabla_configuracion(conn)
+    crear_versiones(conn)
+    crear_versiones_pacientes(conn)
+    estadisticas.crear_resumenes(conn)
+    deudas.crear_indice_deudas(conn)
+    recurrencias.crear_tablas_recurrencias(conn)
+    recordatorios.crear_tablas_recordatorios(conn)
+    borrado.preparar_borrado(conn)
+    facturacion.crear_tablas_facturacion(conn)
+    espera.crear_tablas_espera(conn)
+    jornada.crear_tablas_jornada(conn)
+
+
+def rango_mes(año, mes):
+    return datetime(año, mes, 1).date(), datetime(año, mes, calendar.monthrange(año, mes)[1]).date()
+
+
+def _iso(fecha):
+    return recurrencias.a_fecha(fecha).isoformat()
+
+
+# Pacientes
+
+def agregar_paciente(conn, paciente):
+    """
+    Inserta un Paciente (el id se ignora, lo asigna la base). Devuelve el id nuevo
+    """
+    marcas = ', '.join('?' * (len(Paciente._fields) - 1))
+    cursor = conn.execute(f'''
+    INSERT INTO pacientes ({columnas(Paciente, sin_id=True)})
+    VALUES ({marcas})
+    ''', cifrado.cifrar_paciente(conn, paciente)[1:])
+    conn.commit()
+    return cursor.lastrowid
+
+
+def obtener_pacientes(conn):
+    """
+    Todos los pacientes vigentes. El diagnóstico y el motivo de consulta quedan como se
+    guardaron (cifrados o no): se descifran solo al mostrar una ficha
+    """
+    return consultar(conn, Paciente, f'''
+    SELECT {columnas(Paciente)} FROM pacientes
+    WHERE eliminado IS NULL
+    ORDER BY apellido, nombre
+    ''')
+
+
+def obtener_paciente(conn, paciente_id):
+    filas = consultar(conn, Paciente, f'''
+    SELECT {columnas(Paciente)} FROM pacientes
+    WHERE id = ? AND eliminado IS NULL
+    ''', (paciente_id,))
+    return cifrado.descifrar_paciente(filas[0]) if filas else None
+
+
+def buscar_pacientes(conn, texto, limite=20):
+    """
+    Pacientes vigentes cuyo nombre, apellido, "nombre apellido", "apellido nombre"
+    o DNI contienen el texto (sin distinguir mayúsculas). Devuelve dicts con CAMPOS_BUSQUEDA
+    """
+    patron = f'%{texto.strip().lower()}%'
+    cursor = conn.execute(f'''
+    SELECT {', '.join(CAMPOS_BUSQUEDA)} FROM pacientes
+    WHERE eliminado IS NULL
+      AND (lower(nombre || ' ' || apellido) LIKE :patron
+           OR lower(apellido || ' ' || nombre) LIKE :patron
+           OR CAST(dni AS TEXT) LIKE :patron)
+    ORDER BY apellido, nombre
+    LIMIT :limite
+    ''', {'patron': patron, 'limite': limite})
+    return [dict(zip(CAMPOS_BUSQUEDA, fila)) for fila in cursor]
+
+
+def actualizar_paciente(conn, paciente):
+    """
+    Guarda todos los campos de un Paciente existente
+    """
+    asignaciones = ', '.join(f'{campo} = ?' for campo in Paciente._fields[1:])
+    conn.execute(f'''
+    UPDATE pacientes SET {asignaciones} WHERE id = ?
+    ''', (*cifrado.cifrar_paciente(conn, paciente)[1:], paciente.id))
+    conn.commit()
+
+
+# Sesiones
+
+def agregar_sesion(conn, paciente_id, fecha, notas, asistio, pago, monto, numero_factura):
+    cursor = conn.execute('''
+    INSERT INTO sesiones (paciente_id, fecha, notas, asistio, pago, monto, numero_factura)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (paciente_id, fecha, compresion.preparar_nota(conn, notas), asistio, pago, monto, numero_factura))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def obtener_sesiones(conn, paciente_id, limite=None):
+    """Sesiones del paciente, de la más reciente a la más vieja, con las notas descomprimidas"""
+    query = f'''
+    SELECT {columnas(Sesion)}
+    FROM sesiones
+    WHERE paciente_id = ?
+    ORDER BY fecha DESC
+    '''
+    if limite:
+        query += f' LIMIT {int(limite)}'
+    return compresion.descomprimir_filas(consultar(conn, Sesion, query, (paciente_id,)))
+
+
+def obtener_sesiones_mes(conn, año, mes):
+    desde, hasta = rango_mes(año, mes)
+    sesiones = consultar(conn, Sesion, f'''
+    SELECT {columnas(Sesion)}
+    FROM sesiones
+    WHERE fecha BETWEEN ? AND ?
+    ORDER BY fecha, id
+    ''', (desde.isoformat(), hasta.isoformat()))
+    return compresion.descomprimir_filas(sesiones)
+
+
+def actualizar_sesion(conn, sesion_id, fecha, notas, asistio, pago, monto, numero_factura):
+    conn.execute('''
+    UPDATE sesiones
+    SET fecha = ?, notas = ?, asistio = ?, pago = ?, monto = ?, numero_factura = ?
+    WHERE id = ?
+    ''', (fecha, compresion.preparar_nota(conn, notas), asistio, pago, monto, numero_factura, sesion_id))
+    conn.commit()
+
+
+def eliminar_sesion(conn, sesion_id):
+    conn.execute('DELETE FROM sesiones WHERE id = ?', (sesion_id,))
+    conn.commit()
+
+
+def estadisticas_sesiones(conn, paciente_id, incluir_archivo=False):
+    """
+    Totales de sesiones, pagadas, asistidas y deuda de un paciente
+    """
+    sesiones = archivo.fuente(conn, 'sesiones', True) if incluir_archivo else 'sesiones'
+    result = conn.execute(f'''
+    SELECT
+        COUNT(*) as total_sesiones,
+        SUM(CASE WHEN pago = 1 THEN 1 ELSE 0 END) as sesiones_pagadas,
+        SUM(CASE WHEN asistio = 1 THEN 1 ELSE 0 END) as sesiones_asistidas,
+        SUM(CASE WHEN pago = 0 THEN monto ELSE 0 END) as deuda_total
+    FROM {sesiones}
+    WHERE paciente_id = ?
+    ''', (paciente_id,)).fetchone()
+    return {
+        'total_sesiones': result[0],
+        'sesiones_pagadas': result[1] or 0,
+        'sesiones_asistidas': result[2] or 0,
+        'deuda_total': result[3] or 0
+    }
+
+
+def ultima_sesion(conn, paciente_id, incluir_archivo=False):
+    """
+    Fecha de la última sesión del paciente, o None
+    """
+    sesiones = archivo.fuente(conn, 'sesiones', True) if incluir_archivo else 'sesiones'
+    result = conn.execute(f'''
+    SELECT fecha
+    FROM {sesiones}
+    WHERE paciente_id = ?
+    ORDER BY fecha DESC
+    LIMIT 1
+    ''', (paciente_id,)).fetchone()
+    return result[0] if result else None
+
+
+# Turnos
+
+def agregar_turno(conn, nombre, fecha, hora):
+    cursor = conn.execute('''
+    INSERT INTO turnos (nombre, fecha, hora)
+    VALUES (?, ?, ?)
+    ''', (nombre, _iso(fecha), hora))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def obtener_turnos_dia(conn, fecha):
+    """Turnos concretos del día más las ocurrencias de los turnos recurrentes, por hora"""
+    fecha = recurrencias.a_fecha(fecha)
+    turnos = consultar(conn, Turno, f'''
+    SELECT {columnas(Turno)}
+    FROM turnos
+    WHERE fecha = ?
+    ORDER BY hora
+    ''', (fecha.isoformat(),))
+    turnos += recurrencias.expandir(conn, fecha, fecha)
+    return sorted(turnos, key=lambda turno: turno.hora)
+
+
+def obtener_turnos_rango(conn, desde, hasta):
+    """Turnos concretos y ocurrencias de turnos recurrentes entre dos fechas (inclusive)"""
+    desde, hasta = recurrencias.a_fecha(desde), recurrencias.a_fecha(hasta)
+    turnos = consultar(conn, Turno, f'''
+    SELECT {columnas(Turno)}
+    FROM turnos
+    WHERE fecha BETWEEN ? AND ?
+    ORDER BY fecha, hora
+    ''', (desde.isoformat(), hasta.isoformat()))
+    turnos += recurrencias.expandir(conn, desde, hasta)
+    return sorted(turnos, key=lambda turno: (turno.fecha, turno.hora))
+
+
+def obtener_turnos_mes(conn, año, mes):
+    """
+    Turnos concretos del mes más las ocurrencias de los turnos recurrentes
+    """
+    return obtener_turnos_rango(conn, *rango_mes(año, mes))
+
+
+def horas_ocupadas(conn, fecha):
+    """Horas de inicio de los turnos del día, concretos y recurrentes"""
+    fecha = recurrencias.a_fecha(fecha)
+    ocupadas = [fila[0] for fila in conn.execute('SELECT hora FROM turnos WHERE fecha = ?', (fecha.isoformat(),))]
+    ocupadas += [turno.hora for turno in recurrencias.expandir(conn, fecha, fecha, dia_semana=fecha.weekday())]
+    return ocupadas
+
+
+def verificar_disponibilidad(conn, fecha, hora_consulta, duracion=None):
+    """
+    Verifica si hay disponibilidad para un turno en la fecha y hora especificadas
+    (por defecto, con la duración de turno configurada): tiene que caer dentro del
+    horario de atención y no superponerse con ningún turno
+    """
+    duracion = duracion or jornada.duracion_turno(conn)
+    if not jornada.dentro_del_horario(conn, fecha, hora_consulta, duracion):
+        return False
+    return not any(recurrencias.se_superponen(hora_consulta, hora, duracion)
+                   for hora in horas_ocupadas(conn, fecha))
+
+
+def horarios(inicio=HORA_INICIO, fin=HORA_FIN, duracion=DURACION_TURNO):
+    """Horas de inicio de los turnos de un día, de `inicio` a `fin` cada `duracion` minutos"""
+    resultado = []
+    hora_actual = datetime.strptime(inicio, '%H:%M')
+    hora_fin = datetime.strptime(fin, '%H:%M')
+    while hora_actual < hora_fin:
+        resultado.append(hora_actual.strftime('%H:%M'))
+        hora_actual += timedelta(minutes=duracion)
+    return resultado
+
+
+def horarios_libres(conn, fecha, duracion=None):
+    """
+    Horarios del día según el horario de atención que no se superponen con ningún turno:
+    la plantilla precalculada del día menos los horarios ocupados
+    """
+    return jornada.horarios_libres(conn, fecha, horas_ocupadas(conn, fecha), duracion)
+
+
+def reservar_turno(conn, nombre, fecha, hora, duracion=None):
+    """
+    Comprueba la disponibilidad y agenda el turno en la misma transacción, así dos
+    pedidos simultáneos no pueden tomar el mismo horario. Devuelve el id o None si está ocupado
+    """
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not verificar_disponibilidad(conn, fecha, hora, duracion):
+            conn.rollback()
+            return None
+        cursor = conn.execute('INSERT INTO turnos (nombre, fecha, hora) VALUES (?, ?, ?)',
+                              (nombre, _iso(fecha), hora))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cursor.lastrowid
+
+
+def eliminar_turno(conn, turno_id):
+    """
+    Elimina un turno concreto, o cancela solo esa fecha si es parte de un turno recurrente
+    """
+    if recurrencias.es_ocurrencia(turno_id):
+        recurrencias.cancelar_ocurrencia(conn, turno_id)
+        return
+    conn.execute('DELETE FROM turnos WHERE id = ?', (turno_id,))
+    conn.commit()
+
+
+def eliminar_turnos_por_nombre(conn, nombre):
+    """
+    Elimina todos los turnos de un paciente específico, incluidos sus turnos recurrentes.
+    Devuelve cuántos se eliminaron
+    """
+    eliminados = conn.execute('DELETE FROM turnos WHERE nombre = ?', (nombre,)).rowcount
+    conn.commit()
+    return eliminados + recurrencias.eliminar_reglas_por_nombre(conn, nombre)
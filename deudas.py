@@ -0,0 +1,104 @@
+import argparse
+import csv
+import io
+import sys
+from datetime import date
+
+from configuracion import conectar
+
+TRAMOS = ('0-30', '31-60', '61-90', '90+')
+COLUMNAS = {
+    'paciente': ['paciente_id', 'paciente', 'obra_social'] + list(TRAMOS) + ['total', 'sesiones', 'mas_antigua', 'porcentaje'],
+    'obra_social': ['obra_social'] + list(TRAMOS) + ['total', 'sesiones', 'mas_antigua', 'porcentaje'],
+}
+ORDENES = {
+    'total': 'total DESC',
+    'antiguedad': 'mas_antigua ASC',
+    '90+': '"90+" DESC',
+    'nombre': None,  # Columna del nombre, según cómo se agrupe
+}
+
+
+def crear_indice_deudas(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sesiones_pago_fecha ON sesiones (pago, fecha)')
+    conn.commit()
+
+
+def antiguedad_deudas(conn, agrupar='paciente', hoy=None, obra_social=None, minimo=0, orden='total'):
+    """
+    Sesiones impagas agrupadas por paciente u obra social y por antigüedad
+    (0-30, 31-60, 61-90 y más de 90 días), calculado en una sola pasada agrupada.
+    El porcentaje es sobre toda la deuda, antes de filtrar por obra social o mínimo
+    """
+    hoy = (hoy or date.today()).isoformat()
+    if agrupar == 'paciente':
+        claves = "p.id, p.apellido || ', ' || p.nombre, COALESCE(NULLIF(p.obra_social, ''), 'Ninguna')"
+        agrupado = 'p.id'
+        columna_nombre = '2'
+    else:
+        claves = "COALESCE(NULLIF(p.obra_social, ''), 'Ninguna')"
+        agrupado = '1'
+        columna_nombre = '1'
+
+    return conn.execute(f'''
+    WITH impagas AS (
+        SELECT paciente_id, fecha, COALESCE(monto, 0) AS monto,
+               julianday(:hoy) - julianday(fecha) AS dias
+        FROM sesiones
+        WHERE pago = 0 AND fecha <= :hoy
+    ),
+    deuda_total AS (
+        SELECT SUM(i.monto) AS monto FROM impagas i JOIN pacientes p ON p.id = i.paciente_id
+    )
+    SELECT {claves},
+           SUM(CASE WHEN s.dias <= 30 THEN s.monto ELSE 0 END) AS "0-30",
+           SUM(CASE WHEN s.dias > 30 AND s.dias <= 60 THEN s.monto ELSE 0 END) AS "31-60",
+           SUM(CASE WHEN s.dias > 60 AND s.dias <= 90 THEN s.monto ELSE 0 END) AS "61-90",
+           SUM(CASE WHEN s.dias > 90 THEN s.monto ELSE 0 END) AS "90+",
+           SUM(s.monto) AS total,
+           COUNT(*) AS sesiones,
+           MIN(s.fecha) AS mas_antigua,
+           ROUND(SUM(s.monto) * 100.0 / (SELECT monto FROM deuda_total), 1) AS porcentaje
+    FROM impagas s
+    JOIN pacientes p ON p.id = s.paciente_id
+    WHERE (:obra_social IS NULL OR COALESCE(NULLIF(p.obra_social, ''), 'Ninguna') = :obra_social)
+    GROUP BY {agrupado}
+    HAVING SUM(s.monto) > :minimo
+    ORDER BY {ORDENES[orden] or columna_nombre}
+    ''', {'hoy': hoy, 'obra_social': obra_social, 'minimo': minimo}).fetchall()
+
+
+def exportar_csv(filas, agrupar='paciente'):
+    """
+    Genera el reporte en CSV línea por línea, sin armar el texto completo en memoria
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS[agrupar])
+    for fila in filas:
+        escritor.writerow(fila)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Antigüedad de deudas por paciente u obra social")
+    parser.add_argument('--agrupar', choices=list(COLUMNAS), default='paciente')
+    parser.add_argument('--obra-social')
+    parser.add_argument('--minimo', type=float, default=0)
+    parser.add_argument('--orden', choices=list(ORDENES), default='total')
+    parser.add_argument('--salida', help="Archivo CSV (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_indice_deudas(conn)
+    filas = antiguedad_deudas(conn, args.agrupar, obra_social=args.obra_social,
+                              minimo=args.minimo, orden=args.orden)
+    salida = open(args.salida, 'w', newline='', encoding='utf-8') if args.salida else sys.stdout
+    for linea in exportar_csv(filas, args.agrupar):
+        salida.write(linea)
+    if args.salida:
+        salida.close()
+    conn.close()
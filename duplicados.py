@@ -0,0 +1,213 @@
+import argparse
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from functools import lru_cache
+from itertools import combinations
+from typing import NamedTuple
+
+import archivo
+from borrado import NOMBRES_TURNO, nombre_compartido
+from configuracion import conectar
+from modelos import Paciente
+
+# Detección de pacientes cargados dos veces. En vez de comparar todos contra todos
+# (n² pares), se agrupa a los pacientes por claves de bloqueo y solo se comparan
+# los de un mismo bloque: mismo DNI, mismo apellido y fecha de nacimiento, o nombre
+# y apellido que suenan igual
+UMBRAL = 0.5  # Puntaje mínimo para sugerir una fusión
+MAX_BLOQUE = 50  # Bloques más grandes (un DNI 0 de relleno, un apellido muy común) no se comparan par a par
+
+# Reglas fonéticas del castellano rioplatense, en orden: ch, ll/y, b/v, c/s/z, g/j, qu/k, h muda
+_FONETICA = [(re.compile(patron), reemplazo) for patron, reemplazo in (
+    (r'ch', 'X'), (r'll', 'y'), (r'qu', 'k'), (r'gu(?=[ei])', 'g'), (r'g(?=[ei])', 'j'),
+    (r'c(?=[ei])', 's'), (r'z', 's'), (r'[cq]', 'k'), (r'[vw]', 'b'), (r'x', 'ks'), (r'h', ''),
+    (r'y(?![aeiou])', 'i'), (r'(.)\1+', r'\1'), (r'(?<=.)[aeiou]', ''),
+)]
+
+
+class Sugerencia(NamedTuple):
+    puntaje: float
+    conservar: int
+    duplicado: int
+    motivos: tuple
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes ni signos, con un espacio entre palabras"""
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z ]+', ' ', texto.lower()).split())
+
+
+@lru_cache(maxsize=2**16)  # Nombres y apellidos se repiten mucho entre pacientes
+def clave_fonetica(texto):
+    """Cómo suena cada palabra: 'Vázquez' y 'Basques' dan la misma clave"""
+    palabras = []
+    for palabra in normalizar(texto).split():
+        for patron, reemplazo in _FONETICA:
+            palabra = patron.sub(reemplazo, palabra)
+        palabras.append(palabra)
+    return ' '.join(palabras)
+
+
+def claves_bloqueo(dni, nombre, apellido, fecha_nacimiento):
+    """Bloques a los que pertenece un paciente"""
+    claves = []
+    if dni:
+        claves.append(('dni', dni))
+    apellido_normalizado = normalizar(apellido)
+    if fecha_nacimiento:
+        claves.append(('nacimiento', apellido_normalizado, fecha_nacimiento))
+    primer_nombre = normalizar(nombre).split()[:1]
+    # La clave fonética va última: _cargar la usa también para puntuar
+    claves.append(('fonetica', clave_fonetica(apellido_normalizado), clave_fonetica(' '.join(primer_nombre))))
+    return claves
+
+
+def _puntaje(a, b):
+    """Qué tan probable es que dos filas sean la misma persona, entre 0 y 1, y por qué"""
+    puntaje, motivos = 0.0, []
+    if a['dni'] and a['dni'] == b['dni']:
+        puntaje += 0.45
+        motivos.append('DNI')
+    elif a['dni'] and b['dni']:
+        puntaje -= 0.15
+    if a['nacimiento'] and a['nacimiento'] == b['nacimiento']:
+        puntaje += 0.25
+        motivos.append('fecha de nacimiento')
+    parecido = SequenceMatcher(None, a['nombre'], b['nombre']).ratio()
+    puntaje += 0.25 * parecido
+    if parecido == 1:
+        motivos.append('nombre')
+    elif a['fonetica'] == b['fonetica']:
+        puntaje += 0.15
+        motivos.append('nombre que suena igual')
+    elif parecido >= 0.85:
+        motivos.append('nombre parecido')
+    if (a['email'] and a['email'] == b['email']) or (a['telefono'] and a['telefono'] == b['telefono']):
+        puntaje += 0.1
+        motivos.append('contacto')
+    return round(puntaje, 3), tuple(motivos)
+
+
+def _cargar(conn):
+    pacientes = {}
+    for paciente_id, nombre, apellido, dni, nacimiento, telefono, email in conn.execute('''
+    SELECT id, nombre, apellido, dni, fecha_nacimiento, telefono_paciente, email
+    FROM pacientes WHERE eliminado IS NULL
+    '''):
+        claves = claves_bloqueo(dni, nombre, apellido, nacimiento)
+        pacientes[paciente_id] = {
+            'nombre': normalizar(f'{apellido} {nombre}'), 'dni': dni or None, 'nacimiento': nacimiento or None,
+            'telefono': telefono or None, 'email': (email or '').strip().lower() or None,
+            'claves': claves, 'fonetica': claves[-1],
+        }
+    return pacientes
+
+
+def sugerencias(conn, umbral=UMBRAL, max_bloque=MAX_BLOQUE):
+    """
+    Pares de pacientes que probablemente son la misma persona, del más al menos probable.
+    En cada par se propone conservar al que tiene más sesiones (a igualdad, el más antiguo)
+    """
+    pacientes = _cargar(conn)
+    bloques = {}
+    for paciente_id, paciente in pacientes.items():
+        for clave in paciente['claves']:
+            bloques.setdefault(clave, []).append(paciente_id)
+
+    pares = set()
+    for ids in bloques.values():
+        if 1 < len(ids) <= max_bloque:
+            pares.update(combinations(sorted(ids), 2))
+    if not pares:
+        return []
+
+    sesiones = dict(conn.execute('SELECT paciente_id, COUNT(*) FROM sesiones GROUP BY paciente_id'))
+    resultado = []
+    for a, b in pares:
+        puntaje, motivos = _puntaje(pacientes[a], pacientes[b])
+        if puntaje >= umbral:
+            conservar, duplicado = (b, a) if sesiones.get(b, 0) > sesiones.get(a, 0) else (a, b)
+            resultado.append(Sugerencia(puntaje, conservar, duplicado, motivos))
+    resultado.sort(key=lambda sugerencia: (-sugerencia.puntaje, sugerencia.conservar, sugerencia.duplicado))
+    return resultado
+
+
+def _fusionar(conn, conservar, duplicado):
+    filas = {fila[0]: fila for fila in conn.execute(
+        'SELECT id, nombre, apellido FROM pacientes WHERE id IN (?, ?)', (conservar, duplicado))}
+    if conservar == duplicado or len(filas) != 2:
+        raise ValueError('Hay que elegir dos pacientes distintos que existan')
+    reporte = {}
+
+    # Los datos que le falten al que se conserva se toman del duplicado
+    campos = [campo for campo in Paciente._fields if campo != 'id']
+    conn.execute(f'''
+    UPDATE pacientes SET {', '.join(f"{campo} = COALESCE(NULLIF(pacientes.{campo}, ''), d.{campo})" for campo in campos)}
+    FROM (SELECT * FROM pacientes WHERE id = ?) AS d
+    WHERE pacientes.id = ?
+    ''', (duplicado, conservar))
+
+    reporte['sesiones'] = conn.execute('UPDATE sesiones SET paciente_id = ? WHERE paciente_id = ?',
+                                       (conservar, duplicado)).rowcount
+    if archivo.archivo_adjunto(conn):
+        reporte['sesiones'] += conn.execute(f'UPDATE {archivo.ESQUEMA}.sesiones SET paciente_id = ? WHERE paciente_id = ?',
+                                            (conservar, duplicado)).rowcount
+    for tabla in ('facturas', 'lista_espera'):
+        conn.execute(f'UPDATE {tabla} SET paciente_id = ? WHERE paciente_id = ?', (conservar, duplicado))
+
+    # Los turnos guardan el nombre, no el id: pasan al nombre del paciente que queda,
+    # salvo que un tercero se llame como el duplicado (no se sabe de quién son)
+    _, nombre, apellido = filas[conservar]
+    nombres = {'nombre': filas[duplicado][1].strip(), 'apellido': filas[duplicado][2].strip(),
+               'nuevo': f'{nombre.strip()} {apellido.strip()}'}
+    reporte['ambiguos'] = nombre_compartido(conn, nombres, {conservar, duplicado})
+    if reporte['ambiguos']:
+        reporte['turnos'] = reporte['reglas'] = 0
+    else:
+        reporte['turnos'] = conn.execute(f'UPDATE turnos SET nombre = :nuevo WHERE {NOMBRES_TURNO}',
+                                         nombres).rowcount
+        reporte['reglas'] = conn.execute(f'UPDATE turnos_recurrentes SET nombre = :nuevo WHERE {NOMBRES_TURNO}',
+                                         nombres).rowcount
+    conn.execute('DELETE FROM pacientes WHERE id = ?', (duplicado,))
+    return reporte
+
+
+def fusionar(conn, conservar, duplicado):
+    """
+    Fusiona `duplicado` en `conservar` en una sola transacción: sus sesiones (también las
+    archivadas), facturas, lugar en la lista de espera y turnos pasan al paciente que queda,
+    que completa con los datos del duplicado los campos que tenía vacíos.
+    Devuelve cuántas sesiones, turnos y reglas recurrentes se movieron
+    """
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        reporte = _fusionar(conn, conservar, duplicado)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return reporte
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pacientes duplicados")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    buscar = sub.add_parser('buscar', help="Sugerir fusiones")
+    buscar.add_argument('--umbral', type=float, default=UMBRAL)
+    unir = sub.add_parser('fusionar', help="Fusionar un paciente duplicado en otro")
+    unir.add_argument('conservar', type=int)
+    unir.add_argument('duplicado', type=int)
+    args = parser.parse_args()
+
+    conn = conectar()
+    conn.execute('PRAGMA foreign_keys = ON')
+    if args.accion == 'buscar':
+        for sugerencia in sugerencias(conn, args.umbral):
+            print(f'{sugerencia.puntaje:.2f} conservar {sugerencia.conservar} <- {sugerencia.duplicado} '
+                  f'({", ".join(sugerencia.motivos)})')
+    else:
+        print(fusionar(conn, args.conservar, args.duplicado))
+    conn.close()
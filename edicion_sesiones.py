@@ -0,0 +1,93 @@
+from datetime import date, datetime
+
+import cifrado
+import compresion
+from modelos import Sesion, columnas, consultar
+
+# Columnas que se pueden modificar desde la grilla; id y paciente_id quedan fijos
+EDITABLES = ('fecha', 'notas', 'asistio', 'pago', 'monto', 'numero_factura')
+LOTE = 500  # Ids por consulta IN (...), por debajo del límite de parámetros de SQLite
+
+
+def normalizar(sesion):
+    """
+    Lleva una sesión a una forma comparable: la grilla devuelve fechas, booleanos
+    y celdas vacías con tipos distintos a los que guarda la base
+    """
+    fecha = sesion.fecha
+    if isinstance(fecha, datetime):
+        fecha = fecha.date()
+    if isinstance(fecha, date):
+        fecha = fecha.isoformat()
+    return sesion._replace(
+        fecha=fecha,
+        notas=sesion.notas or '',
+        asistio=bool(sesion.asistio),
+        pago=bool(sesion.pago),
+        monto=float(sesion.monto or 0),
+        numero_factura=sesion.numero_factura or None,
+    )
+
+
+def diferencias(originales, editadas):
+    """
+    Compara las filas mostradas con las editadas y devuelve [(original, editada)]
+    solo para las sesiones en las que cambió alguna celda
+    """
+    editadas = {sesion.id: normalizar(sesion) for sesion in editadas}
+    cambios = []
+    for original in originales:
+        editada = editadas.get(original.id)
+        if editada is not None and normalizar(original) != editada:
+            cambios.append((original, editada))
+    return cambios
+
+
+def _actuales(conn, ids):
+    filas = []
+    for inicio in range(0, len(ids), LOTE):
+        parte = ids[inicio:inicio + LOTE]
+        filas += consultar(conn, Sesion, f'''
+        SELECT {columnas(Sesion)} FROM sesiones
+        WHERE id IN ({','.join('?' * len(parte))})
+        ''', parte)
+    return {sesion.id: sesion for sesion in compresion.descomprimir_filas(filas)}
+
+
+def aplicar_cambios(conn, cambios):
+    """
+    Guarda todos los cambios en una sola transacción con executemany.
+    Una sesión que otro usuario modificó (o borró) desde que se abrió la grilla
+    no se pisa: se devuelve como conflicto. Devuelve (actualizadas, conflictos)
+    """
+    if not cambios:
+        return 0, []
+    comprimir = compresion.compresion_activa(conn)
+    sellar = cifrado.cifrador(conn)
+    conn.commit()
+    try:
+        # BEGIN IMMEDIATE toma el lock de escritura antes de leer, así nadie
+        # puede modificar las filas entre la verificación y el UPDATE
+        conn.execute('BEGIN IMMEDIATE')
+        actuales = _actuales(conn, [original.id for original, _ in cambios])
+        filas, conflictos = [], []
+        for original, editada in cambios:
+            actual = actuales.get(original.id)
+            if actual is None or normalizar(actual) != normalizar(original):
+                conflictos.append(original.id)
+                continue
+            notas = compresion.comprimir_nota(editada.notas) if comprimir else editada.notas
+            if sellar:
+                notas = sellar(notas)
+            filas.append((editada.fecha, notas, editada.asistio, editada.pago,
+                          editada.monto, editada.numero_factura, editada.id))
+        conn.executemany('''
+        UPDATE sesiones
+        SET fecha = ?, notas = ?, asistio = ?, pago = ?, monto = ?, numero_factura = ?
+        WHERE id = ?
+        ''', filas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(filas), conflictos
@@ -0,0 +1,242 @@
+import argparse
+from datetime import date
+
+import datos  # datos.crear_esquema importa este módulo: solo se usa dentro de las funciones
+import jornada
+import recurrencias
+from configuracion import conectar, obtener_bool, guardar_bool
+from jornada import DIAS
+from versiones import crear_versiones
+
+# Tablas de las que depende la lista que se muestra
+TABLAS = ('lista_espera', 'pacientes')
+CLAVE_AUTOMATICA = 'espera_asignacion_automatica'
+CANDIDATOS = 5  # Candidatos propuestos por cada hueco
+
+
+def crear_tablas_espera(conn):
+    """
+    Lista de espera y sus franjas preferidas. Cada preferencia se guarda como una fila
+    por (día de la semana, hora): la clave primaria empieza por día y hora, así los
+    candidatos para un hueco se encuentran por índice sin recorrer toda la lista
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS lista_espera (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
+        prioridad INTEGER NOT NULL DEFAULT 0,
+        alta DATE NOT NULL,
+        estado TEXT NOT NULL DEFAULT 'esperando',  -- esperando | asignado | baja
+        turno_id INTEGER,
+        notas TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS espera_franjas (
+        dia_semana INTEGER NOT NULL,
+        hora INTEGER NOT NULL,
+        espera_id INTEGER NOT NULL REFERENCES lista_espera(id) ON DELETE CASCADE,
+        PRIMARY KEY (dia_semana, hora, espera_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_espera_activos ON lista_espera (estado, prioridad DESC, alta)")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_espera_franjas_espera ON espera_franjas (espera_id)')
+    conn.commit()
+    crear_versiones(conn, TABLAS[:1])
+
+
+def asignacion_automatica(conn):
+    return obtener_bool(conn, CLAVE_AUTOMATICA, False)
+
+
+def activar_asignacion_automatica(conn, activo=True):
+    guardar_bool(conn, CLAVE_AUTOMATICA, activo)
+
+
+def horas_franja(desde, hasta):
+    """Horas enteras que toca una franja 'HH:MM'-'HH:MM' (sin incluir el final)"""
+    inicio, fin = recurrencias.a_minutos(desde), recurrencias.a_minutos(hasta)
+    return list(range(inicio // 60, (fin - 1) // 60 + 1)) if fin > inicio else []
+
+
+def agregar_a_espera(conn, paciente_id, preferencias, prioridad=0, notas=None, hoy=None):
+    """
+    Anota al paciente en la lista de espera. `preferencias` son (dia_semana, desde, hasta)
+    con horas 'HH:MM'. Devuelve el id de la entrada
+    """
+    franjas = {(dia, hora) for dia, desde, hasta in preferencias for hora in horas_franja(desde, hasta)}
+    if not franjas:
+        raise ValueError('Indique al menos un día y un horario')
+    cursor = conn.execute('''
+    INSERT INTO lista_espera (paciente_id, prioridad, alta, notas) VALUES (?, ?, ?, ?)
+    ''', (paciente_id, prioridad, (hoy or date.today()).isoformat(), notas))
+    espera_id = cursor.lastrowid
+    conn.executemany('INSERT INTO espera_franjas (dia_semana, hora, espera_id) VALUES (?, ?, ?)',
+                     [(dia, hora, espera_id) for dia, hora in sorted(franjas)])
+    conn.commit()
+    return espera_id
+
+
+def dar_de_baja(conn, espera_id):
+    conn.execute("UPDATE lista_espera SET estado = 'baja' WHERE id = ?", (espera_id,))
+    conn.commit()
+
+
+def _resumir_franjas(horas):
+    """[(dia, hora)] -> 'Lunes 14-17, Jueves 9-11'"""
+    partes, actual = [], None
+    for dia, hora in sorted(horas):
+        if actual and actual[0] == dia and actual[2] == hora:
+            actual[2] = hora + 1
+        else:
+            if actual:
+                partes.append(actual)
+            actual = [dia, hora, hora + 1]
+    if actual:
+        partes.append(actual)
+    return ', '.join(f'{DIAS[dia]} {desde}-{hasta}' for dia, desde, hasta in partes)
+
+
+def lista_espera(conn):
+    """Entradas que siguen esperando: (id, paciente_id, nombre, prioridad, alta, franjas, notas)"""
+    filas = conn.execute('''
+    SELECT e.id, e.paciente_id, p.nombre || ' ' || p.apellido, e.prioridad, e.alta, e.notas
+    FROM lista_espera e
+    JOIN pacientes p ON p.id = e.paciente_id
+    WHERE e.estado = 'esperando' AND p.eliminado IS NULL
+    ORDER BY e.prioridad DESC, e.alta, e.id
+    ''').fetchall()
+    franjas = {}
+    for dia, hora, espera_id in conn.execute('''
+    SELECT f.dia_semana, f.hora, f.espera_id FROM espera_franjas f
+    JOIN lista_espera e ON e.id = f.espera_id
+    WHERE e.estado = 'esperando'
+    '''):
+        franjas.setdefault(espera_id, []).append((dia, hora))
+    return [(espera_id, paciente_id, nombre, prioridad, alta, _resumir_franjas(franjas.get(espera_id, [])), notas)
+            for espera_id, paciente_id, nombre, prioridad, alta, notas in filas]
+
+
+def candidatos(conn, fecha, hora, duracion=None, limite=CANDIDATOS):
+    """
+    Pacientes en espera cuyas preferencias cubren todo el horario (fecha, hora), del mejor
+    al peor: más prioridad primero y, a igual prioridad, quien espera hace más tiempo.
+    Se descartan los que ya tienen turno ese día. Devuelve (espera_id, paciente_id, nombre, prioridad, alta)
+    """
+    fecha = recurrencias.a_fecha(fecha)
+    duracion = duracion or jornada.duracion_turno(conn)
+    inicio = recurrencias.a_minutos(hora)
+    horas = list(range(inicio // 60, (inicio + duracion - 1) // 60 + 1))
+    filas = conn.execute(f'''
+    SELECT e.id, e.paciente_id, p.nombre || ' ' || p.apellido, e.prioridad, e.alta
+    FROM espera_franjas f
+    JOIN lista_espera e ON e.id = f.espera_id
+    JOIN pacientes p ON p.id = e.paciente_id
+    WHERE f.dia_semana = ? AND f.hora IN ({', '.join('?' * len(horas))})
+      AND e.estado = 'esperando' AND p.eliminado IS NULL
+    GROUP BY e.id
+    HAVING COUNT(*) = ?
+    ORDER BY e.prioridad DESC, e.alta, e.id
+    ''', (fecha.weekday(), *horas, len(horas))).fetchall()
+    if not filas:
+        return []
+    ocupados = {turno.nombre.lower() for turno in datos.obtener_turnos_dia(conn, fecha)}
+    return [fila for fila in filas if fila[2].lower() not in ocupados][:limite]
+
+
+def _asignar(conn, espera_id, nombre, fecha, hora):
+    turno_id = conn.execute('INSERT INTO turnos (nombre, fecha, hora) VALUES (?, ?, ?)',
+                            (nombre, recurrencias.a_fecha(fecha).isoformat(), hora)).lastrowid
+    conn.execute("UPDATE lista_espera SET estado = 'asignado', turno_id = ? WHERE id = ?", (turno_id, espera_id))
+    return turno_id
+
+
+def _en_transaccion(conn, funcion, *args):
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        resultado = funcion(*args)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return resultado
+
+
+def asignar(conn, espera_id, fecha, hora, duracion=None):
+    """
+    Da el turno a una entrada de la lista. Comprueba que siga esperando y que el horario
+    siga libre dentro de la misma transacción. Devuelve el id del turno o None
+    """
+    def _hacer():
+        fila = conn.execute('''
+        SELECT p.nombre || ' ' || p.apellido FROM lista_espera e
+        JOIN pacientes p ON p.id = e.paciente_id
+        WHERE e.id = ? AND e.estado = 'esperando'
+        ''', (espera_id,)).fetchone()
+        if fila is None or not datos.verificar_disponibilidad(conn, fecha, hora, duracion):
+            return None
+        return _asignar(conn, espera_id, fila[0], fecha, hora)
+    return _en_transaccion(conn, _hacer)
+
+
+def cubrir_hueco(conn, fecha, hora, automatico=None, duracion=None, limite=CANDIDATOS):
+    """
+    Busca candidatos para un horario que quedó libre. En modo automático el mejor recibe
+    el turno en la misma transacción en que se lo eligió. Devuelve (candidatos, turno_id o None)
+    """
+    if automatico is None:
+        automatico = asignacion_automatica(conn)
+    if not automatico:
+        return candidatos(conn, fecha, hora, duracion, limite), None
+
+    def _hacer():
+        if not datos.verificar_disponibilidad(conn, fecha, hora, duracion):
+            return [], None
+        encontrados = candidatos(conn, fecha, hora, duracion, limite)
+        if not encontrados:
+            return [], None
+        espera_id, _, nombre, _, _ = encontrados[0]
+        return encontrados, _asignar(conn, espera_id, nombre, fecha, hora)
+    return _en_transaccion(conn, _hacer)
+
+
+def huecos_liberados(conn, turnos, hoy=None, automatico=None):
+    """
+    Después de cancelar turnos: para cada horario futuro que quedó libre, los candidatos
+    de la lista de espera (o el turno asignado en modo automático).
+    Devuelve [(fecha, hora, candidatos, turno_id)] solo de los horarios con candidatos
+    """
+    hoy = (hoy or date.today()).isoformat()
+    if automatico is None:
+        automatico = asignacion_automatica(conn)
+    resultado = []
+    for fecha, hora in sorted({(turno.fecha, turno.hora) for turno in turnos if str(turno.fecha) >= hoy}):
+        encontrados, turno_id = cubrir_hueco(conn, fecha, hora, automatico)
+        if encontrados:
+            resultado.append((fecha, hora, encontrados, turno_id))
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lista de espera")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    sub.add_parser('lista', help="Pacientes en espera")
+    buscar = sub.add_parser('candidatos', help="Candidatos para un horario libre")
+    buscar.add_argument('fecha')
+    buscar.add_argument('hora')
+    buscar.add_argument('--asignar', action='store_true', help="Dar el turno al mejor candidato")
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tablas_espera(conn)
+    if args.accion == 'lista':
+        for fila in lista_espera(conn):
+            print(*fila)
+    else:
+        encontrados, turno_id = cubrir_hueco(conn, args.fecha, args.hora, automatico=args.asignar)
+        for fila in encontrados:
+            print(*fila)
+        if turno_id:
+            print(f'Turno {turno_id} asignado a {encontrados[0][2]}')
+    conn.close()
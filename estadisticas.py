@@ -0,0 +1,177 @@
+import argparse
+import os
+
+import archivo
+from configuracion import conectar
+
+
+def crear_resumenes(conn):
+    """
+    Crea las tablas de resumen mensual y los triggers que marcan como pendientes
+    los meses afectados por cada cambio en sesiones o en la obra social de un paciente
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS resumen_mensual (
+        mes TEXT NOT NULL,
+        obra_social TEXT NOT NULL,
+        sesiones INTEGER NOT NULL,
+        asistidas INTEGER NOT NULL,
+        pagadas INTEGER NOT NULL,
+        facturado REAL NOT NULL,
+        cobrado REAL NOT NULL,
+        pacientes INTEGER NOT NULL,
+        PRIMARY KEY (mes, obra_social)
+    )
+    ''')
+    conn.execute('CREATE TABLE IF NOT EXISTS resumen_pendientes (mes TEXT PRIMARY KEY)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sesiones_fecha ON sesiones (fecha)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sesiones_paciente ON sesiones (paciente_id, fecha)')
+
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_sesiones_insert AFTER INSERT ON sesiones
+    BEGIN
+        INSERT OR IGNORE INTO resumen_pendientes (mes) VALUES (substr(NEW.fecha, 1, 7));
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_sesiones_update AFTER UPDATE ON sesiones
+    BEGIN
+        INSERT OR IGNORE INTO resumen_pendientes (mes) VALUES (substr(OLD.fecha, 1, 7));
+        INSERT OR IGNORE INTO resumen_pendientes (mes) VALUES (substr(NEW.fecha, 1, 7));
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_sesiones_delete AFTER DELETE ON sesiones
+    BEGIN
+        INSERT OR IGNORE INTO resumen_pendientes (mes) VALUES (substr(OLD.fecha, 1, 7));
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_pacientes_obra_social
+    AFTER UPDATE OF obra_social ON pacientes
+    WHEN OLD.obra_social IS NOT NEW.obra_social
+    BEGIN
+        INSERT OR IGNORE INTO resumen_pendientes (mes)
+        SELECT DISTINCT substr(fecha, 1, 7) FROM sesiones WHERE paciente_id = NEW.id;
+    END
+    ''')
+    conn.commit()
+
+
+def _fuentes(conn):
+    """Sesiones y pacientes a resumir: las tablas vivas más el archivo, si existe"""
+    incluir = archivo.archivo_adjunto(conn) or os.path.exists(archivo.ruta_archivo(conn))
+    return archivo.fuente(conn, 'sesiones', incluir), archivo.fuente(conn, 'pacientes', incluir)
+
+
+def refrescar_resumenes(conn):
+    """
+    Recalcula solo los meses marcados como pendientes. Devuelve cuántos meses recalculó
+    """
+    conn.execute('DELETE FROM resumen_pendientes WHERE mes IS NULL')  # Sesiones sin fecha
+    meses = [fila[0] for fila in conn.execute('SELECT mes FROM resumen_pendientes')]
+    if not meses:
+        conn.commit()
+        return 0
+    sesiones, pacientes = _fuentes(conn)
+    try:
+        for mes in meses:
+            conn.execute('DELETE FROM resumen_mensual WHERE mes = ?', (mes,))
+            conn.execute(f'''
+            INSERT INTO resumen_mensual
+            SELECT
+                substr(s.fecha, 1, 7),
+                COALESCE(NULLIF(p.obra_social, ''), 'Ninguna'),
+                COUNT(*),
+                SUM(CASE WHEN s.asistio THEN 1 ELSE 0 END),
+                SUM(CASE WHEN s.pago THEN 1 ELSE 0 END),
+                COALESCE(SUM(s.monto), 0),
+                COALESCE(SUM(CASE WHEN s.pago THEN s.monto ELSE 0 END), 0),
+                COUNT(DISTINCT s.paciente_id)
+            FROM {sesiones} s
+            LEFT JOIN {pacientes} p ON p.id = s.paciente_id
+            WHERE s.fecha >= ? AND s.fecha < ?
+            GROUP BY 1, 2
+            ''', (mes, mes + '~'))
+            conn.execute('DELETE FROM resumen_pendientes WHERE mes = ?', (mes,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(meses)
+
+
+def reconstruir_resumenes(conn):
+    """
+    Marca todos los meses con sesiones como pendientes y los recalcula desde cero
+    """
+    sesiones, _ = _fuentes(conn)
+    conn.execute('DELETE FROM resumen_mensual')
+    conn.execute(f'INSERT OR IGNORE INTO resumen_pendientes (mes) SELECT DISTINCT substr(fecha, 1, 7) FROM {sesiones}')
+    conn.commit()
+    return refrescar_resumenes(conn)
+
+
+def verificar_resumenes(conn):
+    """
+    Compara los totales del resumen con los de las sesiones originales.
+    Devuelve la lista de diferencias (vacía si todo coincide)
+    """
+    refrescar_resumenes(conn)
+    sesiones, _ = _fuentes(conn)
+    crudo = conn.execute(f'''
+    SELECT COUNT(*),
+           SUM(CASE WHEN asistio THEN 1 ELSE 0 END),
+           SUM(CASE WHEN pago THEN 1 ELSE 0 END),
+           COALESCE(SUM(monto), 0),
+           COALESCE(SUM(CASE WHEN pago THEN monto ELSE 0 END), 0)
+    FROM {sesiones} WHERE fecha IS NOT NULL
+    ''').fetchone()
+    resumen = conn.execute('''
+    SELECT COALESCE(SUM(sesiones), 0), SUM(asistidas), SUM(pagadas),
+           COALESCE(SUM(facturado), 0), COALESCE(SUM(cobrado), 0)
+    FROM resumen_mensual
+    ''').fetchone()
+    campos = ('sesiones', 'asistidas', 'pagadas', 'facturado', 'cobrado')
+    return [(campo, a, b) for campo, a, b in zip(campos, crudo, resumen)
+            if round(a or 0, 2) != round(b or 0, 2)]
+
+
+def resumen_mensual(conn, desde=None, hasta=None):
+    """Filas del resumen mensual entre dos meses ('AAAA-MM'), incluidos"""
+    refrescar_resumenes(conn)
+    return conn.execute('''
+    SELECT mes, obra_social, sesiones, asistidas, pagadas, facturado, cobrado, pacientes
+    FROM resumen_mensual
+    WHERE mes >= COALESCE(?, '') AND mes <= COALESCE(?, '9999-99')
+    ORDER BY mes, obra_social
+    ''', (desde, hasta)).fetchall()
+
+
+def pacientes_por_año(conn):
+    """Pacientes activos e inactivos agrupados por año de inicio de consulta"""
+    return conn.execute('''
+    SELECT año_inicio_consulta,
+           SUM(CASE WHEN actividad THEN 1 ELSE 0 END),
+           SUM(CASE WHEN actividad THEN 0 ELSE 1 END)
+    FROM pacientes
+    GROUP BY año_inicio_consulta
+    ORDER BY año_inicio_consulta
+    ''').fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resúmenes mensuales de sesiones")
+    parser.add_argument('accion', choices=['refrescar', 'reconstruir', 'verificar'])
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_resumenes(conn)
+    if args.accion == 'refrescar':
+        print(f"{refrescar_resumenes(conn)} meses recalculados")
+    elif args.accion == 'reconstruir':
+        print(f"{reconstruir_resumenes(conn)} meses recalculados")
+    else:
+        diferencias = verificar_resumenes(conn)
+        print("Los resúmenes coinciden con las sesiones" if not diferencias else diferencias)
+    conn.close()
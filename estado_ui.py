@@ -0,0 +1,78 @@
+import pickle
+from collections import OrderedDict
+
+# Todas las banderas de la interfaz viven bajo claves con este prefijo en st.session_state,
+# una por ámbito, así se pueden acotar, medir y borrar juntas
+PREFIJO = '_ui_'
+MAXIMO = 20
+
+
+class EstadoUI:
+    """
+    Banderas de la interfaz (qué sesión se está editando, grillas abiertas...) de un
+    ámbito, guardadas en un solo diccionario dentro de st.session_state. Tiene un tope
+    de entradas: al superarlo se descartan las usadas hace más tiempo
+    """
+
+    def __init__(self, estado, ambito, maximo=MAXIMO):
+        self.estado = estado
+        self.clave = PREFIJO + ambito
+        self.maximo = maximo
+
+    @property
+    def _entradas(self):
+        if self.clave not in self.estado:
+            self.estado[self.clave] = OrderedDict()
+        return self.estado[self.clave]
+
+    def obtener(self, clave, defecto=None):
+        entradas = self._entradas
+        if clave not in entradas:
+            return defecto
+        entradas.move_to_end(clave)
+        return entradas[clave]
+
+    def guardar(self, clave, valor=True):
+        entradas = self._entradas
+        entradas[clave] = valor
+        entradas.move_to_end(clave)
+        while len(entradas) > self.maximo:
+            entradas.popitem(last=False)
+
+    def quitar(self, clave):
+        self._entradas.pop(clave, None)
+
+    def limpiar(self):
+        if self.clave in self.estado:
+            del self.estado[self.clave]
+
+    def __contains__(self, clave):
+        return clave in self._entradas
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+def limpiar_ambitos(estado, conservar=()):
+    """Borra todos los ámbitos de la interfaz salvo los indicados (p. ej. al cambiar de pantalla)"""
+    for clave in [clave for clave in estado.keys() if clave.startswith(PREFIJO)]:
+        if clave[len(PREFIJO):] not in conservar:
+            del estado[clave]
+
+
+def tamaño_estado(estado, mayores=5):
+    """
+    Cantidad de claves y tamaño aproximado (serializado) del estado de la sesión,
+    con las claves que más ocupan
+    """
+    tamaños = {}
+    for clave in list(estado.keys()):
+        try:
+            tamaños[clave] = len(pickle.dumps(estado[clave]))
+        except Exception:
+            tamaños[clave] = 0  # Objetos no serializables (widgets, conexiones)
+    return {
+        'claves': len(tamaños),
+        'bytes': sum(tamaños.values()),
+        'mayores': sorted(tamaños.items(), key=lambda item: item[1], reverse=True)[:mayores],
+    }
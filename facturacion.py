@@ -0,0 +1,213 @@
+import argparse
+import html
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from configuracion import conectar, obtener_config, crear_tabla_configuracion
+
+FACTURAS_DIR = 'facturas'
+SERIE = 'factura'
+CLAVE_PUNTO_VENTA = 'facturacion_punto_venta'
+PUNTO_VENTA = 1
+PROCESOS = None  # None: tantos procesos como núcleos
+
+
+def crear_tablas_facturacion(conn):
+    """
+    Crea la tabla de secuencias (un contador por serie) y la de facturas emitidas.
+    El número de factura es único; las sesiones facturadas lo guardan en numero_factura
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS secuencias (
+        nombre TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS facturas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        numero TEXT NOT NULL,
+        paciente_id INTEGER REFERENCES pacientes(id) ON DELETE SET NULL,
+        obra_social TEXT,
+        mes TEXT NOT NULL,
+        emitida DATE NOT NULL,
+        total REAL NOT NULL
+    )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_facturas_numero ON facturas (numero)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_facturas_mes ON facturas (mes, obra_social)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sesiones_factura ON sesiones (numero_factura)')
+    conn.commit()
+
+
+def siguiente_numero(conn, serie=SERIE):
+    """
+    Toma el próximo valor de la secuencia. Debe llamarse dentro de la transacción
+    que usa el número: si esa transacción se deshace, el número no se consume
+    """
+    conn.execute('INSERT OR IGNORE INTO secuencias (nombre, valor) VALUES (?, 0)', (serie,))
+    return conn.execute('UPDATE secuencias SET valor = valor + 1 WHERE nombre = ? RETURNING valor',
+                        (serie,)).fetchone()[0]
+
+
+def formatear_numero(punto_venta, valor):
+    return f'{int(punto_venta):04d}-{valor:08d}'
+
+
+def sesiones_a_facturar(conn, obra_social, mes):
+    """
+    Sesiones impagas y sin factura de los pacientes de una obra social en un mes (AAAA-MM)
+    """
+    return conn.execute('''
+    SELECT s.id, s.paciente_id, s.fecha, COALESCE(s.monto, 0)
+    FROM sesiones s
+    JOIN pacientes p ON p.id = s.paciente_id
+    WHERE s.fecha >= ? AND s.fecha < ?
+      AND s.pago = 0
+      AND (s.numero_factura IS NULL OR s.numero_factura = '')
+      AND COALESCE(NULLIF(p.obra_social, ''), 'Ninguna') = ?
+    ORDER BY s.paciente_id, s.fecha
+    ''', (mes, mes + '~', obra_social)).fetchall()
+
+
+def facturar_mes(conn, obra_social, mes, hoy=None):
+    """
+    Emite una factura por paciente con todas sus sesiones impagas del mes para la
+    obra social indicada. Todo ocurre en una transacción: numeración, facturas y
+    sesiones quedan consistentes o no se guarda nada. Devuelve los números emitidos
+    """
+    emitida = (hoy or date.today()).isoformat()
+    punto_venta = obtener_config(conn, CLAVE_PUNTO_VENTA, PUNTO_VENTA)
+    conn.commit()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        por_paciente = {}
+        for sesion_id, paciente_id, _, monto in sesiones_a_facturar(conn, obra_social, mes):
+            por_paciente.setdefault(paciente_id, []).append((sesion_id, monto))
+
+        numeros, asignaciones = [], []
+        for paciente_id, sesiones in por_paciente.items():
+            numero = formatear_numero(punto_venta, siguiente_numero(conn))
+            conn.execute('''
+            INSERT INTO facturas (numero, paciente_id, obra_social, mes, emitida, total)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (numero, paciente_id, obra_social, mes, emitida, sum(monto for _, monto in sesiones)))
+            asignaciones += [(numero, sesion_id) for sesion_id, _ in sesiones]
+            numeros.append(numero)
+        conn.executemany('UPDATE sesiones SET numero_factura = ? WHERE id = ?', asignaciones)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return numeros
+
+
+def facturas_del_mes(conn, mes, obra_social=None):
+    return conn.execute('''
+    SELECT f.numero, p.apellido || ', ' || p.nombre, f.obra_social, f.emitida, f.total
+    FROM facturas f
+    LEFT JOIN pacientes p ON p.id = f.paciente_id
+    WHERE f.mes = ? AND (? IS NULL OR f.obra_social = ?)
+    ORDER BY f.numero
+    ''', (mes, obra_social, obra_social)).fetchall()
+
+
+def datos_factura(conn, numero):
+    """Todo lo necesario para renderizar una factura, en tipos simples que se pueden enviar a otro proceso"""
+    factura = conn.execute('''
+    SELECT f.numero, f.emitida, f.mes, f.obra_social, f.total,
+           p.nombre, p.apellido, p.dni, p.numero_afiliado
+    FROM facturas f
+    LEFT JOIN pacientes p ON p.id = f.paciente_id
+    WHERE f.numero = ?
+    ''', (numero,)).fetchone()
+    campos = ('numero', 'emitida', 'mes', 'obra_social', 'total', 'nombre', 'apellido', 'dni', 'numero_afiliado')
+    datos = dict(zip(campos, factura))
+    datos['sesiones'] = conn.execute(
+        'SELECT fecha, COALESCE(monto, 0) FROM sesiones WHERE numero_factura = ? ORDER BY fecha', (numero,)).fetchall()
+    return datos
+
+
+def renderizar_factura(datos):
+    """Arma el documento HTML de una factura"""
+    e = lambda valor: html.escape('' if valor is None else str(valor))
+    filas = ''.join(f'<tr><td>{e(fecha)}</td><td class="monto">${monto:,.2f}</td></tr>'
+                    for fecha, monto in datos['sesiones'])
+    return f'''<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>Factura {e(datos['numero'])}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; width: 100%; }}
+td, th {{ border-bottom: 1px solid #ddd; padding: 4px 8px; text-align: left; }}
+.monto {{ text-align: right; }}
+</style>
+</head>
+<body>
+<h1>Factura N° {e(datos['numero'])}</h1>
+<p>Fecha de emisión: {e(datos['emitida'])} &mdash; Período: {e(datos['mes'])}</p>
+<p>Paciente: {e(datos['apellido'])}, {e(datos['nombre'])} (DNI {e(datos['dni'])})</p>
+<p>Obra social: {e(datos['obra_social'])} &mdash; N° de afiliado: {e(datos['numero_afiliado'])}</p>
+<table>
+<tr><th>Sesión</th><th class="monto">Monto</th></tr>
+{filas}
+<tr><th>Total</th><th class="monto">${datos['total']:,.2f}</th></tr>
+</table>
+</body>
+</html>
+'''
+
+
+def _escribir_factura(datos, directorio):
+    ruta = os.path.join(directorio, f"factura_{datos['numero']}.html")
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write(renderizar_factura(datos))
+    return ruta
+
+
+def renderizar_facturas(conn, numeros, directorio=FACTURAS_DIR, procesos=PROCESOS, progreso=None):
+    """
+    Genera los documentos de varias facturas en un pool de procesos. Los datos se leen
+    antes en este proceso (las conexiones no se comparten entre procesos). Una sola
+    factura se arma acá mismo: no vale la pena levantar un proceso para una página.
+    progreso(hechas, total) se llama a medida que termina cada documento
+    """
+    os.makedirs(directorio, exist_ok=True)
+    datos = [datos_factura(conn, numero) for numero in numeros]
+    rutas = []
+    if not datos:
+        return rutas
+    if len(datos) == 1:
+        rutas.append(_escribir_factura(datos[0], directorio))
+        if progreso:
+            progreso(1, 1)
+        return rutas
+    # 'spawn' y no fork: el proceso que llama puede ser el servidor de Streamlit, con sus hilos
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pendientes = [pool.submit(_escribir_factura, factura, directorio) for factura in datos]
+        for hechas, futuro in enumerate(as_completed(pendientes), 1):
+            rutas.append(futuro.result())
+            if progreso:
+                progreso(hechas, len(pendientes))
+    return sorted(rutas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Facturación mensual por obra social")
+    parser.add_argument('obra_social')
+    parser.add_argument('mes', help="AAAA-MM")
+    parser.add_argument('--directorio', default=FACTURAS_DIR)
+    parser.add_argument('--procesos', type=int)
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tabla_configuracion(conn)
+    crear_tablas_facturacion(conn)
+    numeros = facturar_mes(conn, args.obra_social, args.mes)
+    for ruta in renderizar_facturas(conn, numeros, args.directorio, args.procesos):
+        print(ruta)
+    conn.close()
@@ -0,0 +1,265 @@
+import argparse
+import glob
+import html
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import archivo
+import cifrado
+import compresion
+from configuracion import DB_PATH, conectar
+from modelos import Paciente, columnas
+from versiones import version_paciente
+
+HISTORIAS_DIR = 'historias'
+LOTE = 200  # Sesiones leídas (y escritas) por vez
+PROCESOS = None  # None: tantos procesos como núcleos
+
+# Etiquetas en el mismo orden en que se muestran en la ficha del paciente
+SECCIONES = {
+    'Información Personal': [
+        ('dni', 'DNI'), ('fecha_nacimiento', 'Fecha Nac.'), ('domicilio', 'Domicilio'),
+        ('obra_social', 'Obra Social'), ('numero_afiliado', 'N° de afiliado'),
+        ('año_inicio_consulta', 'Año de inicio'), ('diagnostico', 'Diagnóstico'),
+        ('motivo_consulta', 'Motivo de consulta'), ('datos_escolares', 'Datos escolares'),
+    ],
+    'Información de Contacto': [
+        ('nombre_padre', 'Padre/Tutor'), ('telefono_padre', 'Tel. Padre'),
+        ('nombre_madre', 'Madre/Tutora'), ('telefono_madre', 'Tel. Madre'),
+        ('nombre_familiar', 'Familiar'), ('telefono_familiar', 'Tel. Familiar'),
+        ('telefono_paciente', 'Tel. Paciente'), ('email', 'Email'),
+    ],
+}
+
+# Un solo hilo para los pedidos desde la interfaz: la página no espera al documento
+_ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='historias')
+_pedidos = {}  # (ruta_db, paciente_id, versión) -> Future; se descartan al entregarlos o si quedan viejos
+_bloqueo_pedidos = threading.Lock()
+
+
+def _e(valor):
+    return html.escape('' if valor is None else str(valor)).replace('\n', '<br>')
+
+
+def ruta_historia(paciente_id, version, directorio=HISTORIAS_DIR):
+    return os.path.join(directorio, f'historia_{paciente_id}_v{version}.html')
+
+
+def _fuentes(conn):
+    incluir = archivo.archivo_adjunto(conn) or os.path.exists(archivo.ruta_archivo(conn))
+    return archivo.fuente(conn, 'pacientes', incluir), archivo.fuente(conn, 'sesiones', incluir)
+
+
+def _escribir(conn, paciente_id, salida):
+    pacientes, sesiones = _fuentes(conn)
+    fila = conn.execute(f'SELECT {columnas(Paciente)} FROM {pacientes} WHERE id = ?', (paciente_id,)).fetchone()
+    if fila is None:
+        raise ValueError(f'No existe el paciente {paciente_id}')
+    paciente = cifrado.descifrar_paciente(Paciente._make(fila))
+
+    salida.write(f'''<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>Historia clínica - {_e(paciente.apellido)}, {_e(paciente.nombre)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+.sesion {{ border-top: 1px solid #ddd; padding: 0.5em 0; page-break-inside: avoid; }}
+.estado {{ color: #555; font-size: 0.9em; }}
+</style>
+</head>
+<body>
+<h1>{_e(paciente.nombre)} {_e(paciente.apellido)}</h1>
+<p>Estado: {'Activo' if paciente.actividad else 'Inactivo'}</p>
+''')
+    for titulo, campos in SECCIONES.items():
+        salida.write(f'<h2>{titulo}</h2>\n<dl>\n')
+        for campo, etiqueta in campos:
+            salida.write(f'<dt>{etiqueta}</dt><dd>{_e(getattr(paciente, campo))}</dd>\n')
+        salida.write('</dl>\n')
+
+    salida.write('<h2>Sesiones</h2>\n')
+    cursor = conn.execute(f'''
+    SELECT fecha, notas, asistio, pago, monto, numero_factura
+    FROM {sesiones}
+    WHERE paciente_id = ?
+    ORDER BY fecha
+    ''', (paciente_id,))
+    total = 0
+    while True:
+        # Las sesiones se leen y se escriben por tandas: nunca está toda la historia en memoria
+        filas = cursor.fetchmany(LOTE)
+        if not filas:
+            break
+        for fecha, notas, asistio, pago, monto, numero_factura in filas:
+            factura = f' &middot; Factura N° {_e(numero_factura)}' if numero_factura else ''
+            salida.write(f'''<div class="sesion">
+<h3>{_e(fecha)}</h3>
+<p class="estado">Asistió: {'Sí' if asistio else 'No'} &middot; Pagó: {'Sí' if pago else 'No'} &middot; Monto: ${monto or 0:,.2f}{factura}</p>
+<p>{_e(compresion.descomprimir_nota(notas))}</p>
+</div>
+''')
+        total += len(filas)
+    if not total:
+        salida.write('<p>No hay sesiones registradas.</p>\n')
+    salida.write('</body>\n</html>\n')
+    return total
+
+
+def borrar_historias(directorio=HISTORIAS_DIR, paciente_id=None):
+    """Borra las historias guardadas (de un paciente o de todos)"""
+    patron = f'historia_{paciente_id}_v*.html' if paciente_id is not None else 'historia_*_v*.html'
+    for ruta in glob.glob(os.path.join(directorio, patron)):
+        os.remove(ruta)
+
+
+def _generar(conn, paciente_id, directorio):
+    ruta = ruta_historia(paciente_id, version_paciente(conn, paciente_id), directorio)
+    if os.path.exists(ruta):
+        return ruta
+    os.makedirs(directorio, exist_ok=True)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as salida:
+        _escribir(conn, paciente_id, salida)
+    os.replace(temporal, ruta)
+    # Las versiones anteriores del mismo paciente ya no sirven
+    for vieja in glob.glob(os.path.join(directorio, f'historia_{paciente_id}_v*.html')):
+        if vieja != ruta:
+            os.remove(vieja)
+    return ruta
+
+
+def generar_historia(paciente_id, ruta_db=DB_PATH, directorio=HISTORIAS_DIR):
+    """
+    Escribe la historia clínica (ficha + todas las sesiones) de un paciente en HTML.
+    El archivo lleva la versión de los datos del paciente en el nombre: si ya existe
+    para la versión actual se reutiliza. Abre su propia conexión, así puede correr
+    en otro hilo o proceso. Devuelve la ruta del archivo.
+    Con el cifrado activo no se escribe: el archivo dejaría en texto plano lo que la base guarda cifrado
+    """
+    conn = conectar(ruta_db)
+    try:
+        if cifrado.cifrado_activo(conn):
+            raise RuntimeError('Con el cifrado activo las historias clínicas no se guardan en disco')
+        return _generar(conn, paciente_id, directorio)
+    finally:
+        conn.close()
+
+
+def historia_paciente(paciente_id, ruta_db=DB_PATH, directorio=HISTORIAS_DIR):
+    """
+    La historia lista para descargar: (nombre de archivo, contenido en bytes). Sin cifrado
+    se reutiliza el archivo de la versión actual; con el cifrado activo se arma en memoria,
+    no se guarda, y se borran las copias que hubieran quedado de antes
+    """
+    conn = conectar(ruta_db)
+    try:
+        if not cifrado.cifrado_activo(conn):
+            ruta = _generar(conn, paciente_id, directorio)
+            with open(ruta, 'rb') as archivo_html:
+                return os.path.basename(ruta), archivo_html.read()
+        borrar_historias(directorio, paciente_id)
+        salida = io.StringIO()
+        _escribir(conn, paciente_id, salida)
+        nombre = os.path.basename(ruta_historia(paciente_id, version_paciente(conn, paciente_id), directorio))
+        return nombre, salida.getvalue().encode('utf-8')
+    finally:
+        conn.close()
+
+
+def _version_actual(paciente_id, ruta_db):
+    conn = conectar(ruta_db)
+    try:
+        return version_paciente(conn, paciente_id)
+    finally:
+        conn.close()
+
+
+def _descartar_viejos(ruta_db, paciente_id, version):
+    """Saca los pedidos del paciente hechos para otra versión de sus datos (con _bloqueo_pedidos tomado)"""
+    for clave in [clave for clave in _pedidos if clave[:2] == (ruta_db, paciente_id) and clave[2] != version]:
+        _pedidos.pop(clave).cancel()
+
+
+def solicitar_historia(paciente_id, ruta_db=DB_PATH, directorio=HISTORIAS_DIR):
+    """
+    Encola la generación en segundo plano y devuelve el Future (su resultado es el de
+    historia_paciente). Pedidos repetidos del mismo paciente y la misma versión de sus
+    datos mientras el anterior sigue pendiente reciben el mismo Future. Los pedidos ya
+    terminados que nadie retiró se descartan: no quedan historias guardadas en memoria
+    """
+    version = _version_actual(paciente_id, ruta_db)
+    with _bloqueo_pedidos:
+        for clave in [clave for clave, pedido in _pedidos.items() if pedido.done()]:
+            del _pedidos[clave]
+        _descartar_viejos(ruta_db, paciente_id, version)
+        pedido = _pedidos.get((ruta_db, paciente_id, version))
+        if pedido is None:
+            pedido = _ejecutor.submit(historia_paciente, paciente_id, ruta_db, directorio)
+            _pedidos[(ruta_db, paciente_id, version)] = pedido
+    return pedido
+
+
+def pedido_historia(paciente_id, ruta_db=DB_PATH):
+    """
+    El pedido en segundo plano para la versión actual de los datos del paciente, o None.
+    Si ya terminó se entrega una sola vez: deja de estar registrado y el contenido no
+    queda en memoria una vez servido. Los pedidos de versiones anteriores se descartan
+    """
+    with _bloqueo_pedidos:
+        if not any(clave[:2] == (ruta_db, paciente_id) for clave in _pedidos):
+            return None  # Sin pedidos no hace falta consultar la versión
+    version = _version_actual(paciente_id, ruta_db)
+    with _bloqueo_pedidos:
+        _descartar_viejos(ruta_db, paciente_id, version)
+        pedido = _pedidos.get((ruta_db, paciente_id, version))
+        if pedido is not None and pedido.done():
+            del _pedidos[(ruta_db, paciente_id, version)]
+    return pedido
+
+
+def _en_paralelo(funcion, paciente_ids, ruta_db, directorio, procesos, progreso):
+    resultados = {}
+    if not paciente_ids:
+        return resultados
+    # spawn y no fork: se llama desde el servidor de Streamlit, que tiene varios hilos
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pendientes = {pool.submit(funcion, paciente_id, ruta_db, directorio): paciente_id
+                      for paciente_id in paciente_ids}
+        for hechas, futuro in enumerate(as_completed(pendientes), 1):
+            resultados[pendientes[futuro]] = futuro.result()
+            if progreso:
+                progreso(hechas, len(pendientes))
+    return resultados
+
+
+def generar_historias(paciente_ids, ruta_db=DB_PATH, directorio=HISTORIAS_DIR, procesos=PROCESOS, progreso=None):
+    """
+    Genera las historias de muchos pacientes en paralelo, un proceso por núcleo.
+    progreso(hechas, total) se llama a medida que termina cada una. Devuelve {paciente_id: ruta}
+    """
+    return _en_paralelo(generar_historia, paciente_ids, ruta_db, directorio, procesos, progreso)
+
+
+def historias_pacientes(paciente_ids, ruta_db=DB_PATH, directorio=HISTORIAS_DIR, procesos=PROCESOS, progreso=None):
+    """Como generar_historias, pero devuelve {paciente_id: (nombre, contenido)} como historia_paciente"""
+    return _en_paralelo(historia_paciente, paciente_ids, ruta_db, directorio, procesos, progreso)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Historias clínicas de pacientes en HTML")
+    parser.add_argument('pacientes', nargs='*', type=int, help="Ids de pacientes (por defecto, todos)")
+    parser.add_argument('--directorio', default=HISTORIAS_DIR)
+    parser.add_argument('--procesos', type=int)
+    args = parser.parse_args()
+
+    conn = conectar()
+    if cifrado.cifrado_activo(conn):
+        parser.exit(1, 'Con el cifrado activo las historias clínicas no se guardan en disco; descárguelas desde la aplicación\n')
+    ids = args.pacientes or [fila[0] for fila in conn.execute('SELECT id FROM pacientes ORDER BY id')]
+    conn.close()
+    for paciente_id, ruta in sorted(generar_historias(ids, directorio=args.directorio, procesos=args.procesos).items()):
+        print(paciente_id, ruta)
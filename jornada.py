@@ -0,0 +1,333 @@
+import argparse
+import bisect
+import threading
+from datetime import date
+from typing import NamedTuple
+
+import recurrencias
+from configuracion import conectar, crear_tabla_configuracion, obtener_config
+from versiones import crear_versiones
+
+# Horario de atención: de qué hora a qué hora se atiende cada día de la semana, con
+# sus pausas, los feriados y la duración de cada turno. Las plantillas de horarios
+# (las horas de inicio posibles de cada día) se calculan una vez por cada cambio de
+# configuración y después solo se les restan los turnos dados
+
+DURACION_TURNO = 40  # minutos, mientras no se configure otra
+HORA_INICIO = '08:00'
+HORA_FIN = '20:00'
+DIAS_LABORABLES = range(5)  # Lunes a viernes, hasta que se configure el horario
+DIAS = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+CLAVE_DURACION = 'duracion_turno'  # Donde se guardaba la duración antes de jornada_duracion
+
+# Tablas de las que dependen las plantillas. La duración tiene su propia tabla: si
+# estuviera en `configuracion`, cualquier otro ajuste invalidaría las plantillas
+TABLAS = ('jornada', 'jornada_pausas', 'feriados', 'jornada_duracion')
+
+
+class Plantillas(NamedTuple):
+    duracion: int
+    por_dia: dict  # dia_semana -> tupla ordenada de minutos de inicio
+    feriados: frozenset  # fechas ISO
+    tramos: dict  # dia_semana -> ((desde, hasta) en minutos) entre pausas
+
+
+_plantillas = {}  # (base, versiones) -> Plantillas
+_bloqueo = threading.Lock()  # La API consulta desde varios hilos
+
+
+def crear_tablas_jornada(conn):
+    """
+    Crea las tablas del horario de atención y, la primera vez, carga el horario de
+    siempre: lunes a viernes de 08:00 a 20:00
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS jornada (
+        dia_semana INTEGER PRIMARY KEY,
+        inicio TIME NOT NULL,
+        fin TIME NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS jornada_pausas (
+        dia_semana INTEGER NOT NULL REFERENCES jornada(dia_semana) ON DELETE CASCADE,
+        inicio TIME NOT NULL,
+        fin TIME NOT NULL,
+        PRIMARY KEY (dia_semana, inicio)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS feriados (
+        fecha DATE PRIMARY KEY,
+        descripcion TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS jornada_duracion (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        minutos INTEGER NOT NULL
+    )
+    ''')
+    if conn.execute('SELECT COUNT(*) FROM jornada').fetchone()[0] == 0:
+        conn.executemany('INSERT INTO jornada (dia_semana, inicio, fin) VALUES (?, ?, ?)',
+                         [(dia, HORA_INICIO, HORA_FIN) for dia in DIAS_LABORABLES])
+    crear_tabla_configuracion(conn)
+    conn.execute('INSERT OR IGNORE INTO jornada_duracion (id, minutos) VALUES (1, ?)',
+                 (int(obtener_config(conn, CLAVE_DURACION, DURACION_TURNO)),))
+    # `configuracion` ya no lleva versión: sus disparadores solo servían a las plantillas
+    for operacion in ('insert', 'update', 'delete'):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_version_configuracion_{operacion}')
+    conn.commit()
+    crear_versiones(conn, TABLAS)
+
+
+def duracion_turno(conn):
+    return plantillas(conn).duracion
+
+
+def guardar_duracion(conn, minutos):
+    minutos = validar_duracion(minutos)
+    conn.execute('''
+    INSERT INTO jornada_duracion (id, minutos) VALUES (1, ?)
+    ON CONFLICT(id) DO UPDATE SET minutos = excluded.minutos
+    ''', (int(minutos),))
+    conn.commit()
+
+
+def obtener_jornada(conn):
+    """{dia_semana: (inicio, fin, [(inicio_pausa, fin_pausa)])} de los días que se atiende"""
+    jornada = {dia: (inicio, fin, []) for dia, inicio, fin in
+               conn.execute('SELECT dia_semana, inicio, fin FROM jornada ORDER BY dia_semana')}
+    for dia, inicio, fin in conn.execute('SELECT dia_semana, inicio, fin FROM jornada_pausas ORDER BY dia_semana, inicio'):
+        if dia in jornada:
+            jornada[dia][2].append((inicio, fin))
+    return jornada
+
+
+def normalizar_dia(inicio, fin, pausas=()):
+    """(inicio, fin, pausas) como se guardan: 'HH:MM' aunque lleguen como '8:00' o con espacios"""
+    def hora(valor):
+        return _a_hora(recurrencias.a_minutos(valor.strip()))
+    return hora(inicio), hora(fin), [(hora(a), hora(b)) for a, b in pausas]
+
+
+def validar_dia(inicio, fin, pausas=()):
+    """El día normalizado (ver normalizar_dia); ValueError si el horario o alguna pausa no tienen sentido"""
+    inicio, fin, pausas = normalizar_dia(inicio, fin, pausas)
+    if recurrencias.a_minutos(fin) <= recurrencias.a_minutos(inicio):
+        raise ValueError('El fin de la jornada debe ser posterior al inicio')
+    for inicio_pausa, fin_pausa in pausas:
+        if not (recurrencias.a_minutos(inicio) <= recurrencias.a_minutos(inicio_pausa)
+                < recurrencias.a_minutos(fin_pausa) <= recurrencias.a_minutos(fin)):
+            raise ValueError(f'La pausa {inicio_pausa}-{fin_pausa} debe quedar dentro de la jornada')
+    return inicio, fin, pausas
+
+
+def validar_duracion(minutos):
+    if not 5 <= int(minutos) <= 240:
+        raise ValueError('La duración del turno debe estar entre 5 y 240 minutos')
+    return int(minutos)
+
+
+def guardar_dia(conn, dia_semana, inicio, fin, pausas=()):
+    """Define (o reemplaza) el horario de un día con sus pausas, en una sola transacción"""
+    inicio, fin, pausas = validar_dia(inicio, fin, pausas)
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM jornada_pausas WHERE dia_semana = ?', (dia_semana,))
+        conn.execute('''
+        INSERT INTO jornada (dia_semana, inicio, fin) VALUES (?, ?, ?)
+        ON CONFLICT(dia_semana) DO UPDATE SET inicio = excluded.inicio, fin = excluded.fin
+        ''', (dia_semana, inicio, fin))
+        conn.executemany('INSERT INTO jornada_pausas (dia_semana, inicio, fin) VALUES (?, ?, ?)',
+                         [(dia_semana, inicio_pausa, fin_pausa) for inicio_pausa, fin_pausa in pausas])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def quitar_dia(conn, dia_semana):
+    """El día deja de ser laborable (sus pausas caen en cascada)"""
+    conn.execute('DELETE FROM jornada WHERE dia_semana = ?', (dia_semana,))
+    conn.commit()
+
+
+def obtener_feriados(conn, desde=None):
+    return conn.execute('SELECT fecha, descripcion FROM feriados WHERE fecha >= ? ORDER BY fecha',
+                        ((desde or date.min).isoformat(),)).fetchall()
+
+
+def agregar_feriado(conn, fecha, descripcion=None):
+    conn.execute('INSERT OR REPLACE INTO feriados (fecha, descripcion) VALUES (?, ?)',
+                 (recurrencias.a_fecha(fecha).isoformat(), descripcion))
+    conn.commit()
+
+
+def quitar_feriado(conn, fecha):
+    conn.execute('DELETE FROM feriados WHERE fecha = ?', (recurrencias.a_fecha(fecha).isoformat(),))
+    conn.commit()
+
+
+def calcular_tramos(inicio, fin, pausas):
+    """Tramos de atención de un día, (desde, hasta) en minutos, separados por las pausas"""
+    tramos, desde = [], recurrencias.a_minutos(inicio)
+    for inicio_pausa, fin_pausa in sorted(pausas):
+        tramos.append((desde, recurrencias.a_minutos(inicio_pausa)))
+        desde = max(desde, recurrencias.a_minutos(fin_pausa))
+    tramos.append((desde, recurrencias.a_minutos(fin)))
+    return tuple(tramos)
+
+
+def _llenar(tramos, duracion):
+    return tuple(minuto for comienzo, final in tramos for minuto in range(comienzo, final - duracion + 1, duracion))
+
+
+def calcular_plantilla(inicio, fin, pausas, duracion):
+    """
+    Minutos de inicio de los turnos de un día: cada tramo entre pausas se llena de
+    turnos enteros desde su comienzo
+    """
+    return _llenar(calcular_tramos(inicio, fin, pausas), duracion)
+
+
+def armar_plantillas(duracion, dias, feriados):
+    """
+    Plantillas a partir de la duración, {dia_semana: (inicio, fin, pausas)} como lo devuelve
+    obtener_jornada y las fechas ISO de los feriados. No depende de la base: el almacenamiento
+    en PostgreSQL arma las suyas con lo que lee
+    """
+    tramos = {dia: calcular_tramos(inicio, fin, pausas) for dia, (inicio, fin, pausas) in dias.items()}
+    return Plantillas(duracion, {dia: _llenar(tramos[dia], duracion) for dia in tramos}, frozenset(feriados), tramos)
+
+
+def _clave(conn):
+    base = next((fila[2] for fila in conn.execute('PRAGMA database_list') if fila[1] == 'main'), '')
+    versiones = conn.execute(f'''
+    SELECT group_concat(tabla || ':' || version) FROM versiones_tablas
+    WHERE tabla IN ({', '.join('?' * len(TABLAS))})
+    ''', TABLAS).fetchone()[0]
+    return base or id(conn), versiones
+
+
+def plantillas(conn):
+    """
+    Plantillas de todos los días, calculadas una vez por versión de la configuración:
+    mientras no cambien el horario, las pausas, los feriados ni la duración, se reusan
+    """
+    clave = _clave(conn)
+    resultado = _plantillas.get(clave)
+    if resultado is None:
+        fila = conn.execute('SELECT minutos FROM jornada_duracion WHERE id = 1').fetchone()
+        resultado = armar_plantillas(fila[0] if fila else DURACION_TURNO, obtener_jornada(conn),
+                                     (fecha for fecha, _ in obtener_feriados(conn)))
+        with _bloqueo:
+            # Las versiones anteriores de la misma base ya no sirven
+            for vieja in [vieja for vieja in _plantillas if vieja[0] == clave[0]]:
+                del _plantillas[vieja]
+            _plantillas[clave] = resultado
+    return resultado
+
+
+def dias_laborables(conn):
+    return sorted(plantillas(conn).por_dia)
+
+
+def _a_hora(minuto):
+    return f'{minuto // 60:02d}:{minuto % 60:02d}'
+
+
+def horarios_dia_semana(conn, dia_semana):
+    """Horas de inicio ('HH:MM') de los turnos de un día de la semana, sin mirar feriados"""
+    return [_a_hora(minuto) for minuto in plantillas(conn).por_dia.get(dia_semana, ())]
+
+
+def horarios_del_dia(conn, fecha):
+    """Horas de inicio de los turnos de una fecha ('HH:MM'); ninguna si es feriado o no se atiende"""
+    fecha = recurrencias.a_fecha(fecha)
+    if fecha.isoformat() in plantillas(conn).feriados:
+        return []
+    return horarios_dia_semana(conn, fecha.weekday())
+
+
+def dentro_del_horario(conn, fecha, hora, duracion=None):
+    """
+    Si un turno de `duracion` minutos que empieza a `hora` cae entero dentro del horario
+    de atención: día laborable, no feriado y sin pisar una pausa ni el cierre
+    """
+    return dentro_de_plantillas(plantillas(conn), fecha, hora, duracion)
+
+
+def dentro_de_plantillas(actuales, fecha, hora, duracion=None):
+    """dentro_del_horario con plantillas ya armadas"""
+    fecha = recurrencias.a_fecha(fecha)
+    if fecha.isoformat() in actuales.feriados:
+        return False
+    inicio = recurrencias.a_minutos(hora)
+    fin = inicio + (duracion or actuales.duracion)
+    return any(desde <= inicio and fin <= hasta for desde, hasta in actuales.tramos.get(fecha.weekday(), ()))
+
+
+def horarios_libres(conn, fecha, ocupadas, duracion=None):
+    """
+    Plantilla del día menos los horarios que se superponen con algún turno dado
+    (`ocupadas`: horas de inicio). Con otra duración que la configurada, la plantilla
+    se calcula en el momento
+    """
+    return libres_de_plantillas(plantillas(conn), fecha, ocupadas, duracion)
+
+
+def libres_de_plantillas(actuales, fecha, ocupadas, duracion=None):
+    """horarios_libres con plantillas ya armadas"""
+    fecha = recurrencias.a_fecha(fecha)
+    if fecha.isoformat() in actuales.feriados or fecha.weekday() not in actuales.por_dia:
+        return []
+    if duracion is None or duracion == actuales.duracion:
+        duracion, plantilla = actuales.duracion, actuales.por_dia[fecha.weekday()]
+    else:
+        plantilla = _llenar(actuales.tramos[fecha.weekday()], duracion)
+    bloqueados = set()
+    for hora in ocupadas:
+        minuto = recurrencias.a_minutos(hora)
+        # Se superponen los que empiezan a menos de una duración de distancia
+        desde = bisect.bisect_right(plantilla, minuto - duracion)
+        hasta = bisect.bisect_left(plantilla, minuto + duracion)
+        bloqueados.update(plantilla[desde:hasta])
+    return [_a_hora(minuto) for minuto in plantilla if minuto not in bloqueados]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Horario de atención")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    sub.add_parser('ver', help="Mostrar el horario de cada día")
+    dia = sub.add_parser('dia', help="Definir el horario de un día (0 = lunes)")
+    dia.add_argument('dia_semana', type=int, choices=range(7))
+    dia.add_argument('inicio')
+    dia.add_argument('fin')
+    dia.add_argument('--pausa', nargs=2, action='append', default=[], metavar=('INICIO', 'FIN'))
+    libre = sub.add_parser('libre', help="Dejar de atender un día de la semana")
+    libre.add_argument('dia_semana', type=int, choices=range(7))
+    feriado = sub.add_parser('feriado', help="Agregar un feriado")
+    feriado.add_argument('fecha')
+    feriado.add_argument('descripcion', nargs='?')
+    duracion = sub.add_parser('duracion', help="Duración de los turnos en minutos")
+    duracion.add_argument('minutos', type=int)
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tablas_jornada(conn)
+    if args.accion == 'dia':
+        guardar_dia(conn, args.dia_semana, args.inicio, args.fin, args.pausa)
+    elif args.accion == 'libre':
+        quitar_dia(conn, args.dia_semana)
+    elif args.accion == 'feriado':
+        agregar_feriado(conn, args.fecha, args.descripcion)
+    elif args.accion == 'duracion':
+        guardar_duracion(conn, args.minutos)
+    actuales = plantillas(conn)
+    for dia_semana, (inicio, fin, pausas) in obtener_jornada(conn).items():
+        texto_pausas = ', '.join(f'{a}-{b}' for a, b in pausas)
+        print(f"{DIAS[dia_semana]}: {inicio}-{fin}" + (f" (pausas: {texto_pausas})" if pausas else "")
+              + f", {len(actuales.por_dia[dia_semana])} turnos de {actuales.duracion} min")
+    conn.close()
@@ -1,45 +1,51 @@
+import json
+
 import streamlit as st
-import hashlib
-import sqlite3
+import streamlit.components.v1 as components
 from functools import wraps
 
-def init_auth_db():
-    """Initialize authentication database and create admin user if not exists"""
-    conn = sqlite3.connect('consultorio.db')
-    cursor = conn.cursor()
-    
-    # Create users table if not exists
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
-    )
-    ''')
-    
-    # Check if admin user exists
-    cursor.execute('SELECT * FROM users WHERE username = ?', ('Mariel',))
-    if not cursor.fetchone():
-        
-        hashed_password = hashlib.sha256('kenti'.encode()).hexdigest()
-        cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', 
-                      ('Mariel', hashed_password))
-    
-    conn.commit()
-    conn.close()
+import profesionales
+from autenticacion import DURACION_TOKEN, Autenticador, DemasiadosIntentos
+
+# The signed token travels in a cookie (never the URL) so a reconnect or a new tab can skip the password hash
+COOKIE_SESION = 'consultorio_sesion'
+
+@st.cache_resource
+def obtener_autenticador():
+    """Create the authenticator (pooled connections, tables, signing secret) once per process"""
+    autenticador = Autenticador()
+    autenticador.preparar()
+    with autenticador.pool.conexion() as conn:
+        profesionales.preparar(conn)
+    return autenticador
+
+def _escribir_cookie(valor, duracion):
+    """Set (or, with duracion 0, expire) the session cookie from the page; Streamlit cannot send Set-Cookie headers"""
+    components.html(f"""<script>
+    const atributos = '; Path=/; Max-Age={duracion}; SameSite=Strict' + (parent.location.protocol === 'https:' ? '; Secure' : '');
+    parent.document.cookie = '{COOKIE_SESION}=' + encodeURIComponent({json.dumps(valor)}) + atributos;
+    </script>""", height=0)
+
+def current_user():
+    """Name of the logged-in user, resuming it from the signed session cookie if needed; None if nobody is logged in"""
+    if st.session_state.get('authenticated'):
+        return st.session_state.get('usuario')
+    token = st.context.cookies.get(COOKIE_SESION)
+    usuario = obtener_autenticador().validar_token(token) if token else None
+    if usuario:
+        st.session_state.authenticated = True
+        st.session_state.usuario = usuario
+        st.session_state.token = token
+    return usuario
+
+def database_path(username):
+    """Each practitioner works on their own database; before login, the main one"""
+    with obtener_autenticador().pool.conexion() as conn:
+        return profesionales.ruta_base(conn, username)
 
 def verify_password(username, password):
     """Verify user credentials"""
-    conn = sqlite3.connect('consultorio.db')
-    cursor = conn.cursor()
-    
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', 
-                  (username, hashed_password))
-    user = cursor.fetchone()
-    
-    conn.close()
-    return user is not None
+    return obtener_autenticador().verificar(username, password)
 
 def login_required(func):
     """Decorator to require login for accessing pages"""
@@ -47,28 +53,45 @@ def login_required(func):
     def wrapper(*args, **kwargs):
         if 'authenticated' not in st.session_state:
             st.session_state.authenticated = False
-            
+
         if not st.session_state.authenticated:
+            # Resume a previous login from its signed token, without hashing again
+            if current_user():
+                return func(*args, **kwargs)
+
+            if st.session_state.pop('borrar_cookie', False):
+                _escribir_cookie('', 0)
             st.title("Login")
             username = st.text_input("Usuario")
             password = st.text_input("Contraseña", type="password")
-            
+
             if st.button("Iniciar Sesión"):
-                if verify_password(username, password):
-                    st.session_state.authenticated = True
-                    st.rerun()
-                else:
-                    st.error("Usuario o contraseña incorrectos")
+                try:
+                    if verify_password(username, password):
+                        st.session_state.authenticated = True
+                        st.session_state.usuario = username
+                        st.session_state.token = obtener_autenticador().emitir_token(username)
+                        st.session_state.cookie_pendiente = True
+                        st.rerun()
+                    else:
+                        st.error("Usuario o contraseña incorrectos")
+                except DemasiadosIntentos as e:
+                    st.error(str(e))
             return
-        
+
+        # Written on the run after the login, since st.rerun() discards whatever the login run drew
+        if st.session_state.pop('cookie_pendiente', False):
+            _escribir_cookie(st.session_state.token, DURACION_TOKEN)
         return func(*args, **kwargs)
     return wrapper
 
 def logout():
-    """Logout user"""
+    """Logout user, revoking the session token so the cookie is useless even if the browser keeps it"""
     if st.sidebar.button("Cerrar Sesión"):
+        token = st.session_state.pop('token', None)
+        if token:
+            obtener_autenticador().revocar_token(token)
         st.session_state.authenticated = False
+        st.session_state.pop('usuario', None)
+        st.session_state.borrar_cookie = True
         st.rerun()
-
-# Initialize authentication database
-init_auth_db()
\ No newline at end of file
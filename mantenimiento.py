@@ -0,0 +1,195 @@
+import argparse
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import estadisticas
+import respaldo
+from configuracion import DB_PATH, carpeta_de, obtener_config, guardar_config, crear_tabla_configuracion
+
+# Cada cuántas horas corresponde volver a correr cada tarea
+INTERVALOS_HORAS = {
+    'optimizar': 24,
+    'vacuum': 24 * 7,
+    'resumenes': 24,
+    'respaldo': 24,
+}
+HORA_INICIO = 2   # Horario tranquilo por defecto: de 02:00 a 06:00
+HORA_FIN = 6
+CHEQUEO_SEGUNDOS = 60
+REINTENTO_MINUTOS = 60  # Una tarea que falló se reintenta, pero no en cada vuelta del hilo
+
+
+def tarea_optimizar(conn):
+    """ANALYZE + PRAGMA optimize para que el planificador tenga estadísticas"""
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA optimize')
+
+
+def tarea_vacuum(conn):
+    """
+    Devuelve al sistema las páginas libres que dejan los borrados.
+    La primera vez pasa la base a auto_vacuum incremental (requiere un VACUUM completo)
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    else:
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+
+
+def tarea_respaldo(conn):
+    ruta = conn.execute('PRAGMA database_list').fetchone()[2]
+    respaldo.crear_respaldo(ruta, carpeta_de(ruta, respaldo.RESPALDOS_DIR))
+
+
+def tarea_resumenes(conn):
+    """Recalcula los meses pendientes de las tablas de resumen"""
+    estadisticas.crear_resumenes(conn)
+    estadisticas.refrescar_resumenes(conn)
+
+
+TAREAS = {
+    'optimizar': tarea_optimizar,
+    'vacuum': tarea_vacuum,
+    'resumenes': tarea_resumenes,
+    'respaldo': tarea_respaldo,
+}
+
+
+def en_horario_tranquilo(ahora, inicio, fin):
+    if inicio <= fin:
+        return inicio <= ahora.hour < fin
+    return ahora.hour >= inicio or ahora.hour < fin  # Horario que cruza la medianoche
+
+
+class Programador:
+    """
+    Corre las tareas de mantenimiento en un hilo propio, con su propia conexión,
+    para que las recargas de la interfaz nunca esperen por ellas
+    """
+
+    def __init__(self, ruta=DB_PATH, chequeo=CHEQUEO_SEGUNDOS):
+        self.ruta = ruta
+        self.chequeo = chequeo
+        self._lock = threading.Lock()         # Protege self._estado
+        self._ejecutando = threading.Lock()   # Una sola tarea a la vez
+        self._parar = threading.Event()
+        self._pendientes = []
+        self._hilo = None
+        self._estado = {nombre: {'ultima': None, 'segundos': None, 'ok': None, 'error': None, 'fallo': None}
+                        for nombre in TAREAS}
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        crear_tabla_configuracion(conn)
+        return conn
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        conn = self._conectar()
+        for nombre in TAREAS:
+            ultima = obtener_config(conn, f'mantenimiento_ultima_{nombre}')
+            if ultima:
+                self._estado[nombre]['ultima'] = ultima
+            error = obtener_config(conn, f'mantenimiento_error_{nombre}')
+            if error:
+                self._estado[nombre].update(ok=False, error=error)
+        conn.close()
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='mantenimiento', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join()
+
+    def estado(self):
+        with self._lock:
+            return {nombre: dict(datos) for nombre, datos in self._estado.items()}
+
+    def solicitar(self, nombre):
+        """Pide correr una tarea en la próxima vuelta del hilo, sin esperar el horario tranquilo"""
+        with self._lock:
+            if nombre not in self._pendientes:
+                self._pendientes.append(nombre)
+
+    def _vencidas(self, ahora):
+        vencidas = []
+        with self._lock:
+            for nombre, datos in self._estado.items():
+                ultima, fallo = datos['ultima'], datos['fallo']
+                if fallo and ahora - datetime.fromisoformat(fallo) < timedelta(minutes=REINTENTO_MINUTOS):
+                    continue
+                if ultima is None or ahora - datetime.fromisoformat(ultima) >= timedelta(hours=INTERVALOS_HORAS[nombre]):
+                    vencidas.append(nombre)
+        return vencidas
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            with self._lock:
+                tareas, self._pendientes = self._pendientes, []
+            conn = self._conectar()
+            try:
+                inicio = int(obtener_config(conn, 'mantenimiento_hora_inicio', HORA_INICIO))
+                fin = int(obtener_config(conn, 'mantenimiento_hora_fin', HORA_FIN))
+                ahora = datetime.now()
+                if en_horario_tranquilo(ahora, inicio, fin):
+                    tareas += [nombre for nombre in self._vencidas(ahora) if nombre not in tareas]
+                for nombre in tareas:
+                    if self._parar.is_set():
+                        break
+                    self.ejecutar(nombre, conn)
+            finally:
+                conn.close()
+            self._parar.wait(self.chequeo)
+
+    def ejecutar(self, nombre, conn=None):
+        """
+        Corre una tarea ahora mismo en el hilo que llama y registra su duración. Solo una
+        corrida exitosa cuenta como última; si falla, queda el error y la tarea sigue vencida
+        """
+        propia = conn is None
+        if propia:
+            conn = self._conectar()
+        with self._ejecutando:
+            inicio = time.perf_counter()
+            error = None
+            try:
+                TAREAS[nombre](conn)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                error = f'{type(e).__name__}: {e}'
+            segundos = round(time.perf_counter() - inicio, 3)
+            ahora = datetime.now().isoformat(timespec='seconds')
+            if error is None:
+                guardar_config(conn, f'mantenimiento_ultima_{nombre}', ahora)
+            guardar_config(conn, f'mantenimiento_error_{nombre}', error or '')
+        if propia:
+            conn.close()
+        with self._lock:
+            estado = self._estado[nombre]
+            estado.update(segundos=segundos, ok=error is None, error=error)
+            if error is None:
+                estado.update(ultima=ahora, fallo=None)
+            else:
+                estado['fallo'] = ahora
+            return dict(estado)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tareas de mantenimiento de la base")
+    parser.add_argument('tareas', nargs='*', help=f"Tareas a correr ({', '.join(TAREAS)}); por defecto todas")
+    parser.add_argument('--base', default=DB_PATH)
+    args = parser.parse_args()
+    desconocidas = [nombre for nombre in args.tareas if nombre not in TAREAS]
+    if desconocidas:
+        parser.error(f"Tareas desconocidas: {', '.join(desconocidas)}")
+
+    programador = Programador(args.base)
+    for nombre in args.tareas or TAREAS:
+        print(nombre, programador.ejecutar(nombre))
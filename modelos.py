@@ -0,0 +1,71 @@
+from typing import NamedTuple, Optional, Any
+
+# Registros livianos para las filas de la base. Al ser tuplas con nombre no tienen
+# __dict__ por instancia, se pueden cachear/picklear y siguen admitiendo acceso por posición
+
+
+class Paciente(NamedTuple):
+    id: Optional[int]
+    nombre: str
+    apellido: str
+    dni: int
+    fecha_nacimiento: Any = None
+    nombre_padre: Optional[str] = None
+    telefono_padre: Optional[str] = None
+    nombre_madre: Optional[str] = None
+    telefono_madre: Optional[str] = None
+    nombre_familiar: Optional[str] = None
+    telefono_familiar: Optional[str] = None
+    domicilio: Optional[str] = None
+    motivo_consulta: Optional[str] = None
+    datos_escolares: Optional[str] = None
+    año_inicio_consulta: Optional[int] = None
+    telefono_paciente: Optional[str] = None
+    obra_social: Optional[str] = None
+    numero_afiliado: Optional[str] = None
+    diagnostico: Optional[str] = None
+    actividad: bool = True
+    email: Optional[str] = None
+
+
+class Sesion(NamedTuple):
+    id: Optional[int]
+    paciente_id: int
+    fecha: Any
+    notas: Optional[str] = None
+    asistio: bool = True
+    pago: bool = False
+    monto: float = 0.0
+    numero_factura: Optional[str] = None
+
+
+class Turno(NamedTuple):
+    id: Any  # int para turnos concretos, 'R<regla>-<fecha>' para ocurrencias de turnos recurrentes
+    nombre: str
+    fecha: str
+    hora: str
+
+
+def columnas(modelo, sin_id=False):
+    """Lista de columnas SQL de un modelo, en el orden de sus campos"""
+    campos = modelo._fields[1:] if sin_id else modelo._fields
+    return ', '.join(campos)
+
+
+def fabrica(modelo):
+    """Devuelve una row_factory de sqlite3 que construye instancias del modelo"""
+    construir = modelo._make
+
+    def row_factory(cursor, fila):
+        return construir(fila)
+    return row_factory
+
+
+_FABRICAS = {modelo: fabrica(modelo) for modelo in (Paciente, Sesion, Turno)}
+
+
+def consultar(conn, modelo, sql, parametros=()):
+    """Ejecuta una consulta cuyas columnas siguen el orden del modelo y devuelve sus filas tipadas"""
+    cursor = conn.cursor()
+    cursor.row_factory = _FABRICAS.get(modelo) or fabrica(modelo)
+    return cursor.execute(sql, parametros).fetchall()
@@ -0,0 +1,178 @@
+import argparse
+import heapq
+import os
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import datos
+from autenticacion import crear_tabla_usuarios, hashear
+from configuracion import DB_PATH, conectar
+
+# Cada profesional tiene su propia base (pacientes, sesiones, turnos, facturas...).
+# La base principal guarda los usuarios y a qué base va cada uno; el primer usuario
+# (sin base asignada) sigue trabajando sobre la base principal, como siempre
+PROFESIONALES_DIR = 'profesionales'
+HILOS = 8  # Bases consultadas a la vez en las vistas de todo el centro
+
+
+def preparar(conn):
+    """Agrega a la tabla de usuarios la columna con la base de cada profesional"""
+    if 'base' not in {fila[1] for fila in conn.execute('PRAGMA table_info(users)')}:
+        conn.execute('ALTER TABLE users ADD COLUMN base TEXT')
+        conn.commit()
+
+
+def _carpeta(usuario):
+    texto = unicodedata.normalize('NFKD', usuario).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_') or 'profesional'
+
+
+def ruta_base(conn, usuario):
+    """Ruta de la base del usuario; sin usuario (o sin base asignada), la base principal"""
+    if usuario is None:
+        return DB_PATH
+    fila = conn.execute('SELECT base FROM users WHERE username = ?', (usuario,)).fetchone()
+    return fila[0] if fila and fila[0] else DB_PATH
+
+
+def es_administrador(conn, usuario):
+    """Solo el usuario principal (el que trabaja sobre la base principal, sin base propia) administra el centro"""
+    fila = conn.execute('SELECT base FROM users WHERE username = ?', (usuario,)).fetchone()
+    return fila is not None and not fila[0]
+
+
+def agregar_profesional(conn, usuario, password, por, directorio=PROFESIONALES_DIR):
+    """
+    Crea el usuario y su base vacía (con todas las tablas). Devuelve la ruta de la base.
+    `por` es el usuario que lo pide (None desde la línea de comandos, que ya tiene acceso
+    a los archivos): tiene que ser el administrador, si no se lanza PermissionError.
+    Lanza ValueError si el usuario ya existe
+    """
+    if por is not None and not es_administrador(conn, por):
+        raise PermissionError('Solo el usuario principal puede agregar profesionales')
+    if conn.execute('SELECT 1 FROM users WHERE username = ?', (usuario,)).fetchone():
+        raise ValueError(f'Ya existe el usuario {usuario}')
+    carpeta = os.path.join(directorio, _carpeta(usuario))
+    ruta = os.path.join(carpeta, 'consultorio.db')
+    if os.path.exists(ruta) or ruta in {base for _, base in bases(conn)}:
+        raise ValueError(f'La base {ruta} ya está en uso')
+    os.makedirs(carpeta, exist_ok=True)
+    nueva = conectar(ruta)
+    try:
+        datos.crear_esquema(nueva)
+    finally:
+        nueva.close()
+    conn.execute('INSERT INTO users (username, password, base) VALUES (?, ?, ?)', (usuario, hashear(password), ruta))
+    conn.commit()
+    return ruta
+
+
+def bases(conn):
+    """(usuario, ruta) de cada profesional, una vez por base"""
+    vistas, resultado = set(), []
+    for usuario, base in conn.execute('SELECT username, base FROM users ORDER BY id'):
+        ruta = base or DB_PATH
+        if ruta not in vistas:
+            vistas.add(ruta)
+            resultado.append((usuario, ruta))
+    return resultado
+
+
+def _en_base(ruta, funcion, args):
+    conn = conectar(ruta, timeout=30)
+    try:
+        return funcion(conn, *args)
+    finally:
+        conn.close()
+
+
+def en_paralelo(bases_profesionales, funcion, *args, hilos=HILOS):
+    """
+    Corre funcion(conn, *args) sobre la base de cada profesional a la vez, cada una
+    con su propia conexión (SQLite suelta el GIL mientras consulta). Devuelve {usuario: resultado}
+    """
+    if not bases_profesionales:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(hilos, len(bases_profesionales))) as pool:
+        pendientes = {usuario: pool.submit(_en_base, ruta, funcion, args) for usuario, ruta in bases_profesionales}
+        return {usuario: futuro.result() for usuario, futuro in pendientes.items()}
+
+
+def agenda_compartida(bases_profesionales, desde, hasta):
+    """
+    Turnos de todos los profesionales entre dos fechas, como (profesional, Turno)
+    ordenados por fecha y hora: el calendario del consultorio compartido
+    """
+    por_profesional = en_paralelo(bases_profesionales, datos.obtener_turnos_rango, desde, hasta)
+    # Cada base ya viene ordenada: alcanza con intercalarlas
+    return list(heapq.merge(
+        *([(usuario, turno) for turno in turnos] for usuario, turnos in por_profesional.items()),
+        key=lambda fila: (fila[1].fecha, fila[1].hora, fila[0])))
+
+
+def _resumen_mes(conn, mes):
+    return conn.execute('''
+    SELECT COALESCE(NULLIF(p.obra_social, ''), 'Ninguna'), COUNT(*),
+           SUM(COALESCE(s.monto, 0)),
+           SUM(CASE WHEN s.pago = 1 THEN COALESCE(s.monto, 0) ELSE 0 END),
+           SUM(CASE WHEN s.numero_factura IS NOT NULL AND s.numero_factura != '' THEN 1 ELSE 0 END)
+    FROM sesiones s
+    JOIN pacientes p ON p.id = s.paciente_id
+    WHERE s.fecha >= ? AND s.fecha < ?
+    GROUP BY 1
+    ''', (mes, mes + '~')).fetchall()
+
+
+def facturacion_centro(bases_profesionales, mes):
+    """
+    Sesiones y montos de un mes (AAAA-MM) de todo el centro, por obra social y por profesional.
+    Devuelve filas (obra_social, profesional, sesiones, monto, cobrado, facturadas)
+    y los totales por obra social
+    """
+    por_profesional = en_paralelo(bases_profesionales, _resumen_mes, mes)
+    filas, totales = [], {}
+    for usuario, resumen in por_profesional.items():
+        for obra_social, sesiones, monto, cobrado, facturadas in resumen:
+            filas.append((obra_social, usuario, sesiones, monto or 0, cobrado or 0, facturadas))
+            total = totales.setdefault(obra_social, [0, 0.0, 0.0, 0])
+            total[0] += sesiones
+            total[1] += monto or 0
+            total[2] += cobrado or 0
+            total[3] += facturadas
+    filas.sort()
+    return filas, {obra_social: tuple(total) for obra_social, total in sorted(totales.items())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profesionales del centro y vistas compartidas")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    agregar = sub.add_parser('agregar', help="Crear un profesional con su propia base")
+    agregar.add_argument('usuario')
+    agregar.add_argument('password')
+    sub.add_parser('bases', help="Listar la base de cada profesional")
+    agenda = sub.add_parser('agenda', help="Turnos de todos los profesionales")
+    agenda.add_argument('desde')
+    agenda.add_argument('hasta')
+    resumen = sub.add_parser('facturacion', help="Sesiones y montos del mes de todo el centro")
+    resumen.add_argument('mes', help="AAAA-MM")
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tabla_usuarios(conn)
+    preparar(conn)
+    if args.accion == 'agregar':
+        print(agregar_profesional(conn, args.usuario, args.password, por=None))
+    elif args.accion == 'bases':
+        for usuario, ruta in bases(conn):
+            print(usuario, ruta)
+    elif args.accion == 'agenda':
+        for usuario, turno in agenda_compartida(bases(conn), args.desde, args.hasta):
+            print(turno.fecha, turno.hora, usuario, turno.nombre)
+    else:
+        filas, totales = facturacion_centro(bases(conn), args.mes)
+        for fila in filas:
+            print(*fila)
+        for obra_social, (sesiones, monto, cobrado, facturadas) in totales.items():
+            print(f'{obra_social}: {sesiones} sesiones, ${monto:,.2f} (cobrado ${cobrado:,.2f}, {facturadas} facturadas)')
+    conn.close()
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import random
+import smtplib
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime, timedelta
+from email.message import EmailMessage
+
+import recurrencias
+from configuracion import DB_PATH, conectar, obtener_config, crear_tabla_configuracion
+
+LOTE = 50
+MAX_INTENTOS = 5
+ESPERA_BASE = 60        # Segundos antes del primer reintento; se duplica en cada fallo
+INTERVALO_SEGUNDOS = 30  # Cada cuánto revisa la bandeja de salida el repartidor
+HORA_ENCOLAR = 9        # A partir de esta hora se encolan automáticamente los turnos del día siguiente
+CLAVE_TRANSPORTE = 'recordatorios_transporte'
+MENSAJE = ('Hola {nombre}, le recordamos su turno del {fecha} a las {hora} en el consultorio. '
+           'Si no puede asistir, por favor avísenos.')
+
+
+def crear_tablas_recordatorios(conn):
+    """
+    Crea la bandeja de salida de recordatorios y agrega el email de contacto a pacientes.
+    `clave` identifica el turno (concreto u ocurrencia recurrente): un turno se encola una sola vez
+    """
+    if 'email' not in {fila[1] for fila in conn.execute('PRAGMA table_info(pacientes)')}:
+        conn.execute('ALTER TABLE pacientes ADD COLUMN email TEXT')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS recordatorios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        clave TEXT NOT NULL UNIQUE,
+        destinatario TEXT NOT NULL,
+        asunto TEXT NOT NULL,
+        cuerpo TEXT NOT NULL,
+        estado TEXT NOT NULL DEFAULT 'pendiente',
+        intentos INTEGER NOT NULL DEFAULT 0,
+        proximo_intento TEXT NOT NULL,
+        error TEXT,
+        creado TEXT NOT NULL,
+        enviado TEXT
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recordatorios_pendientes ON recordatorios (estado, proximo_intento)')
+    conn.commit()
+
+
+def _ahora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _contactos(conn):
+    """Email de cada paciente indexado por su nombre completo, en los dos órdenes posibles"""
+    contactos = {}
+    for nombre, apellido, email in conn.execute('''
+    SELECT nombre, apellido, email FROM pacientes
+    WHERE email IS NOT NULL AND email != '' AND eliminado IS NULL
+    '''):
+        contactos[f'{nombre} {apellido}'.strip().lower()] = (nombre, email)
+        contactos[f'{apellido} {nombre}'.strip().lower()] = (nombre, email)
+    return contactos
+
+
+def encolar_recordatorios(conn, desde=None, hasta=None):
+    """
+    Encola un recordatorio por cada turno entre dos fechas (por defecto, los de mañana) cuyo
+    paciente tenga email. Los turnos concretos salen de una sola consulta por rango sobre
+    idx_turnos_fecha; los recurrentes, de expandir las reglas. Devuelve (encolados, sin_contacto)
+    """
+    desde = (desde or date.today() + timedelta(days=1)).isoformat()
+    hasta = hasta.isoformat() if hasta else desde
+    turnos = conn.execute('''
+    SELECT id, nombre, fecha, hora FROM turnos
+    WHERE fecha BETWEEN ? AND ?
+    ORDER BY fecha, hora
+    ''', (desde, hasta)).fetchall()
+    turnos += list(recurrencias.expandir(conn, desde, hasta))
+
+    contactos = _contactos(conn)
+    ahora = _ahora()
+    filas, sin_contacto = [], []
+    for turno_id, nombre, fecha, hora in turnos:
+        contacto = contactos.get(nombre.strip().lower())
+        if contacto is None:
+            sin_contacto.append(nombre)
+            continue
+        nombre_paciente, email = contacto
+        filas.append((f'{turno_id}@{fecha}', email, f'Recordatorio de turno - {fecha} {hora}',
+                      MENSAJE.format(nombre=nombre_paciente, fecha=fecha, hora=hora), ahora, ahora))
+    antes = conn.total_changes
+    conn.executemany('''
+    INSERT OR IGNORE INTO recordatorios (clave, destinatario, asunto, cuerpo, proximo_intento, creado)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', filas)
+    conn.commit()
+    return conn.total_changes - antes, sin_contacto
+
+
+def estado_bandeja(conn):
+    return dict(conn.execute('SELECT estado, COUNT(*) FROM recordatorios GROUP BY estado').fetchall())
+
+
+class TransporteDebug:
+    """No envía nada: escribe cada mensaje en un flujo (por defecto la salida estándar). Para pruebas"""
+
+    def __init__(self, salida=None):
+        self.salida = salida or sys.stdout
+
+    async def enviar(self, mensajes):
+        for _, destinatario, asunto, cuerpo in mensajes:
+            self.salida.write(f'Para: {destinatario}\nAsunto: {asunto}\n\n{cuerpo}\n---\n')
+        return {mensaje[0]: None for mensaje in mensajes}
+
+
+class TransporteSMTP:
+    """
+    Envía por SMTP reutilizando una conexión por tanda. Por defecto apunta a localhost:1025,
+    donde se puede levantar un servidor de prueba (p. ej. `python -m aiosmtpd -n -l localhost:1025`)
+    """
+
+    def __init__(self, host='localhost', puerto=1025, remitente='consultorio@localhost',
+                 usuario=None, password=None, tls=False):
+        self.host, self.puerto, self.remitente = host, puerto, remitente
+        self.usuario, self.password, self.tls = usuario, password, tls
+
+    def _enviar_lote(self, mensajes):
+        resultados = {}
+        with smtplib.SMTP(self.host, self.puerto, timeout=30) as smtp:
+            if self.tls:
+                smtp.starttls()
+            if self.usuario:
+                smtp.login(self.usuario, self.password)
+            for recordatorio_id, destinatario, asunto, cuerpo in mensajes:
+                correo = EmailMessage()
+                correo['From'], correo['To'], correo['Subject'] = self.remitente, destinatario, asunto
+                correo.set_content(cuerpo)
+                try:
+                    smtp.send_message(correo)
+                    resultados[recordatorio_id] = None
+                except smtplib.SMTPException as e:
+                    resultados[recordatorio_id] = f'{type(e).__name__}: {e}'
+        return resultados
+
+    async def enviar(self, mensajes):
+        # smtplib bloquea: se corre en un hilo para no frenar el bucle de eventos
+        return await asyncio.to_thread(self._enviar_lote, mensajes)
+
+
+def transporte_configurado(conn):
+    """Arma el transporte según la configuración guardada (por defecto, el de depuración)"""
+    nombre = obtener_config(conn, CLAVE_TRANSPORTE, 'debug')
+    if nombre == 'smtp':
+        return TransporteSMTP(
+            obtener_config(conn, 'recordatorios_smtp_host', 'localhost'),
+            int(obtener_config(conn, 'recordatorios_smtp_puerto', 1025)),
+            obtener_config(conn, 'recordatorios_remitente', 'consultorio@localhost'),
+            obtener_config(conn, 'recordatorios_smtp_usuario'),
+            obtener_config(conn, 'recordatorios_smtp_password'),
+            obtener_config(conn, 'recordatorios_smtp_tls') == '1',
+        )
+    return TransporteDebug()
+
+
+TRANSPORTES = {'debug': TransporteDebug, 'smtp': TransporteSMTP}
+
+
+async def entregar_pendientes(conn, transporte, lote=LOTE, max_intentos=MAX_INTENTOS, espera_base=ESPERA_BASE):
+    """
+    Envía una tanda de recordatorios vencidos. Los que fallan se reprograman con espera
+    exponencial (con algo de azar); tras max_intentos quedan como 'fallido'. Devuelve cuántos procesó
+    """
+    ahora = _ahora()
+    filas = conn.execute('''
+    SELECT id, destinatario, asunto, cuerpo, intentos FROM recordatorios
+    WHERE estado = 'pendiente' AND proximo_intento <= ?
+    ORDER BY proximo_intento
+    LIMIT ?
+    ''', (ahora, lote)).fetchall()
+    if not filas:
+        return 0
+    mensajes = [fila[:4] for fila in filas]
+    intentos = {fila[0]: fila[4] for fila in filas}
+
+    try:
+        resultados = await transporte.enviar(mensajes)
+    except Exception as e:  # Falló la tanda completa (p. ej. el servidor no responde)
+        resultados = {mensaje[0]: f'{type(e).__name__}: {e}' for mensaje in mensajes}
+
+    enviados, reintentos = [], []
+    for recordatorio_id, error in resultados.items():
+        if error is None:
+            enviados.append((_ahora(), recordatorio_id))
+            continue
+        numero = intentos[recordatorio_id] + 1
+        espera = espera_base * 2 ** (numero - 1) * random.uniform(0.8, 1.2)
+        proximo = (datetime.now() + timedelta(seconds=espera)).isoformat(timespec='seconds')
+        estado = 'fallido' if numero >= max_intentos else 'pendiente'
+        reintentos.append((estado, numero, proximo, error, recordatorio_id))
+    conn.executemany("UPDATE recordatorios SET estado = 'enviado', enviado = ?, error = NULL WHERE id = ?", enviados)
+    conn.executemany('''
+    UPDATE recordatorios SET estado = ?, intentos = ?, proximo_intento = ?, error = ? WHERE id = ?
+    ''', reintentos)
+    conn.commit()
+    return len(mensajes)
+
+
+def reintentar_fallidos(conn):
+    """Vuelve a poner en cola los recordatorios que agotaron sus intentos"""
+    cursor = conn.execute('''
+    UPDATE recordatorios SET estado = 'pendiente', intentos = 0, proximo_intento = ?
+    WHERE estado = 'fallido'
+    ''', (_ahora(),))
+    conn.commit()
+    return cursor.rowcount
+
+
+class Repartidor:
+    """
+    Bucle asyncio en un hilo propio que vacía la bandeja de salida. Una vez por día,
+    desde HORA_ENCOLAR, encola los turnos del día siguiente. La interfaz solo escribe
+    en la bandeja y nunca espera por los envíos
+    """
+
+    def __init__(self, ruta=DB_PATH, intervalo=INTERVALO_SEGUNDOS, transporte=None):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.transporte = transporte
+        self._hilo = None
+        self._bucle = None
+        self._despertar = None
+        self._parar = threading.Event()
+        self._ultimo_encolado = None
+        self.ultimo_error = None  # (momento, descripción) del último error del bucle
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=lambda: asyncio.run(self._correr()), name='recordatorios', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        self.despertar()
+        if self._hilo:
+            self._hilo.join()
+
+    def despertar(self):
+        """Pide una vuelta inmediata (p. ej. después de encolar a mano)"""
+        if self._bucle and self._despertar:
+            self._bucle.call_soon_threadsafe(self._despertar.set)
+
+    def _encolar_si_corresponde(self, conn):
+        ahora = datetime.now()
+        if ahora.hour >= HORA_ENCOLAR and self._ultimo_encolado != ahora.date():
+            encolar_recordatorios(conn)
+            self._ultimo_encolado = ahora.date()
+
+    async def _vuelta(self, conn):
+        crear_tabla_configuracion(conn)
+        self._encolar_si_corresponde(conn)
+        transporte = self.transporte or transporte_configurado(conn)
+        while await entregar_pendientes(conn, transporte) and not self._parar.is_set():
+            pass
+
+    async def _correr(self):
+        self._bucle = asyncio.get_running_loop()
+        self._despertar = asyncio.Event()
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            while not self._parar.is_set():
+                try:
+                    await self._vuelta(conn)
+                except Exception as e:
+                    # Un error (p. ej. la base bloqueada) no puede matar al hilo: nadie lo
+                    # volvería a arrancar. Se registra y se reintenta en la próxima vuelta
+                    conn.rollback()
+                    self.ultimo_error = (datetime.now().isoformat(timespec='seconds'), f'{type(e).__name__}: {e}')
+                    print(f'recordatorios: {self.ultimo_error[1]}', file=sys.stderr)
+                self._despertar.clear()
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recordatorios de turnos")
+    parser.add_argument('accion', choices=['encolar', 'enviar', 'estado', 'reintentar'])
+    parser.add_argument('--desde', type=date.fromisoformat, help="Primer día de turnos a recordar (por defecto, mañana)")
+    parser.add_argument('--hasta', type=date.fromisoformat, help="Último día (por defecto, igual a --desde)")
+    parser.add_argument('--transporte', choices=list(TRANSPORTES))
+    args = parser.parse_args()
+
+    conn = conectar()
+    crear_tabla_configuracion(conn)
+    crear_tablas_recordatorios(conn)
+    if args.accion == 'encolar':
+        encolados, sin_contacto = encolar_recordatorios(conn, args.desde, args.hasta)
+        print(f'Encolados: {encolados}. Sin email: {", ".join(sin_contacto) or "ninguno"}')
+    elif args.accion == 'enviar':
+        transporte = TRANSPORTES[args.transporte]() if args.transporte else transporte_configurado(conn)
+
+        async def vaciar():
+            total = 0
+            while procesados := await entregar_pendientes(conn, transporte):
+                total += procesados
+            return total
+        print(f'Procesados: {asyncio.run(vaciar())}')
+    elif args.accion == 'reintentar':
+        print(f'Reencolados: {reintentar_fallidos(conn)}')
+    print(estado_bandeja(conn))
+    conn.close()
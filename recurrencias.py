@@ -0,0 +1,217 @@
+from datetime import date, datetime, timedelta
+
+from modelos import Turno
+from versiones import crear_versiones
+
+# Tablas de las que depende cualquier lectura de turnos (concretos + recurrentes)
+TABLAS = ('turnos', 'turnos_recurrentes', 'turnos_excepciones')
+HORIZONTE_DIAS = 365  # Mínimo que se revisa hacia adelante en una regla sin fecha de fin
+PREFIJO = 'R'
+
+
+def crear_tablas_recurrencias(conn):
+    """
+    Crea las tablas de reglas de turnos recurrentes y de ocurrencias canceladas
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS turnos_recurrentes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        dia_semana INTEGER NOT NULL,
+        hora TIME NOT NULL,
+        desde DATE NOT NULL,
+        hasta DATE
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS turnos_excepciones (
+        regla_id INTEGER NOT NULL REFERENCES turnos_recurrentes(id) ON DELETE CASCADE,
+        fecha DATE NOT NULL,
+        PRIMARY KEY (regla_id, fecha)
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_turnos_recurrentes_dia ON turnos_recurrentes (dia_semana, desde, hasta)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_turnos_fecha ON turnos (fecha, hora)')
+    conn.commit()
+    crear_versiones(conn, TABLAS[1:])
+
+
+def a_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return datetime.strptime(valor, '%Y-%m-%d').date()
+
+
+def a_minutos(hora):
+    horas, minutos = hora.split(':')[:2]
+    return int(horas) * 60 + int(minutos)
+
+
+def se_superponen(hora_a, hora_b, duracion):
+    inicio_a, inicio_b = a_minutos(hora_a), a_minutos(hora_b)
+    return not (inicio_a + duracion <= inicio_b or inicio_a >= inicio_b + duracion)
+
+
+def es_ocurrencia(turno_id):
+    return isinstance(turno_id, str) and turno_id.startswith(PREFIJO)
+
+
+def id_ocurrencia(regla_id, fecha):
+    return f'{PREFIJO}{regla_id}-{fecha}'
+
+
+def separar_ocurrencia(turno_id):
+    regla_id, fecha = turno_id[len(PREFIJO):].split('-', 1)
+    return int(regla_id), fecha
+
+
+def expandir(conn, desde, hasta, nombre=None, dia_semana=None):
+    """
+    Genera las ocurrencias (Turno) de las reglas entre dos fechas,
+    incluidas, salteando las canceladas. No escribe nada en la base
+    """
+    desde, hasta = a_fecha(desde), a_fecha(hasta)
+    consulta = '''
+    SELECT id, nombre, dia_semana, hora, desde, hasta FROM turnos_recurrentes
+    WHERE desde <= ? AND (hasta IS NULL OR hasta >= ?)
+    '''
+    parametros = [hasta.isoformat(), desde.isoformat()]
+    if nombre is not None:
+        consulta += ' AND nombre = ?'
+        parametros.append(nombre)
+    if dia_semana is not None:
+        consulta += ' AND dia_semana = ?'
+        parametros.append(dia_semana)
+    reglas = conn.execute(consulta, parametros).fetchall()
+    if not reglas:
+        return
+
+    excepciones = set(conn.execute(
+        'SELECT regla_id, fecha FROM turnos_excepciones WHERE fecha BETWEEN ? AND ?',
+        (desde.isoformat(), hasta.isoformat())))
+    yield from ocurrencias(reglas, excepciones, desde, hasta)
+
+
+def ocurrencias(reglas, excepciones, desde, hasta):
+    """
+    Las fechas de cada regla (id, nombre, dia_semana, hora, desde, hasta) entre dos fechas,
+    sin las (regla_id, fecha ISO) de `excepciones`. No depende de la base
+    """
+    for regla_id, nombre_regla, dia, hora, regla_desde, regla_hasta in reglas:
+        inicio = max(desde, a_fecha(regla_desde))
+        fin = min(hasta, a_fecha(regla_hasta)) if regla_hasta else hasta
+        fecha = inicio + timedelta(days=(dia - inicio.weekday()) % 7)
+        while fecha <= fin:
+            iso = fecha.isoformat()
+            if (regla_id, iso) not in excepciones:
+                yield Turno(id_ocurrencia(regla_id, iso), nombre_regla, iso, hora)
+            fecha += timedelta(days=7)
+
+
+def fin_revision(desde, ultima_fecha):
+    """
+    Hasta dónde revisar una regla sin fecha de fin: después del último turno o de la
+    última regla con fin de ese día ya no queda nada finito con qué chocar
+    """
+    fin = desde + timedelta(days=HORIZONTE_DIAS)
+    return max(fin, a_fecha(ultima_fecha)) if ultima_fecha else fin
+
+
+def regla_sin_fin_superpuesta(reglas, hora, duracion):
+    """
+    De las reglas sin fecha de fin del mismo día (id, nombre, hora), la primera cuyo horario
+    se superpone con `hora`, o None. Dos reglas así chocan todas las semanas para siempre:
+    no se puede resolver con excepciones
+    """
+    return next((regla for regla in reglas if se_superponen(hora, regla[2], duracion)), None)
+
+
+def conflictos_regla(conn, dia_semana, hora, desde, hasta, duracion):
+    """
+    Fechas en las que una nueva regla chocaría con turnos concretos u otras reglas.
+    Se revisa con una consulta por tipo de turno, no una por fecha
+    """
+    desde = a_fecha(desde)
+    dia_sqlite = str((dia_semana + 1) % 7)  # strftime('%w'): 0 = domingo
+    if hasta:
+        hasta = a_fecha(hasta)
+    else:
+        hasta = fin_revision(desde, conn.execute('''
+        SELECT MAX(ultima) FROM (
+            SELECT MAX(fecha) AS ultima FROM turnos WHERE strftime('%w', fecha) = ?
+            UNION ALL SELECT MAX(hasta) FROM turnos_recurrentes WHERE dia_semana = ?
+        )
+        ''', (dia_sqlite, dia_semana)).fetchone()[0])
+    ocupados = conn.execute('''
+    SELECT fecha, hora FROM turnos
+    WHERE fecha BETWEEN ? AND ? AND strftime('%w', fecha) = ?
+    ''', (desde.isoformat(), hasta.isoformat(), dia_sqlite)).fetchall()
+    ocupados += [(fecha, hora_ocupada) for _, _, fecha, hora_ocupada
+                 in expandir(conn, desde, hasta, dia_semana=dia_semana)]
+    return sorted({fecha for fecha, hora_ocupada in ocupados
+                   if se_superponen(hora, hora_ocupada, duracion)})
+
+
+def agregar_regla(conn, nombre, dia_semana, hora, desde, hasta=None, duracion=40):
+    """
+    Guarda un turno recurrente como una sola regla. Las fechas que chocan con
+    otros turnos quedan registradas como excepciones; una regla sin fecha de fin que
+    choca con otra también sin fin se rechaza (ValueError). La revisión y el alta van en
+    la misma transacción: nadie reserva en el medio. Devuelve (regla_id, conflictos)
+    """
+    desde = a_fecha(desde)
+    hasta = a_fecha(hasta) if hasta else None
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if hasta is None:
+            otra = regla_sin_fin_superpuesta(conn.execute(
+                'SELECT id, nombre, hora FROM turnos_recurrentes WHERE dia_semana = ? AND hasta IS NULL',
+                (dia_semana,)), hora, duracion)
+            if otra is not None:
+                raise ValueError(f'Choca todas las semanas con el turno fijo de {otra[1]} a las {otra[2]}, '
+                                 'que tampoco tiene fecha de fin')
+        conflictos = conflictos_regla(conn, dia_semana, hora, desde, hasta, duracion)
+        cursor = conn.execute('''
+        INSERT INTO turnos_recurrentes (nombre, dia_semana, hora, desde, hasta)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (nombre, dia_semana, hora, desde.isoformat(), hasta.isoformat() if hasta else None))
+        regla_id = cursor.lastrowid
+        conn.executemany('INSERT OR IGNORE INTO turnos_excepciones (regla_id, fecha) VALUES (?, ?)',
+                         [(regla_id, fecha) for fecha in conflictos])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return regla_id, conflictos
+
+
+def cancelar_ocurrencia(conn, turno_id):
+    """Cancela una sola fecha de una regla sin tocar el resto de la serie"""
+    regla_id, fecha = separar_ocurrencia(turno_id)
+    conn.execute('INSERT OR IGNORE INTO turnos_excepciones (regla_id, fecha) VALUES (?, ?)', (regla_id, fecha))
+    conn.commit()
+
+
+def eliminar_regla(conn, regla_id):
+    conn.execute('DELETE FROM turnos_excepciones WHERE regla_id = ?', (regla_id,))
+    conn.execute('DELETE FROM turnos_recurrentes WHERE id = ?', (regla_id,))
+    conn.commit()
+
+
+def eliminar_reglas_por_nombre(conn, nombre):
+    """Elimina todas las reglas de un paciente. Devuelve cuántas se borraron"""
+    conn.execute('DELETE FROM turnos_excepciones WHERE regla_id IN (SELECT id FROM turnos_recurrentes WHERE nombre = ?)',
+                 (nombre,))
+    cursor = conn.execute('DELETE FROM turnos_recurrentes WHERE nombre = ?', (nombre,))
+    conn.commit()
+    return cursor.rowcount
+
+
+def obtener_reglas(conn, nombre=None):
+    consulta = 'SELECT id, nombre, dia_semana, hora, desde, hasta FROM turnos_recurrentes'
+    if nombre is not None:
+        return conn.execute(consulta + ' WHERE nombre = ? ORDER BY dia_semana, hora', (nombre,)).fetchall()
+    return conn.execute(consulta + ' ORDER BY nombre, dia_semana, hora').fetchall()
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import archivo
+from configuracion import DB_PATH
+
+RESPALDOS_DIR = 'respaldos'
+CONSERVAR = 7
+PAGINAS_POR_PASO = 64
+PAUSA_ENTRE_PASOS = 0.005
+HISTORIAL = 'historial.jsonl'
+CONTADORES = {'versiones_tablas': 'tabla', 'versiones_pacientes': 'paciente_id'}  # tabla -> clave (versiones.py)
+
+
+class RespaldoInvalido(Exception):
+    pass
+
+
+def verificar_integridad(ruta):
+    """
+    Corre PRAGMA integrity_check sobre un archivo y devuelve True si está sano
+    """
+    conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    try:
+        resultado = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    return resultado == [('ok',)]
+
+
+def _copiar(origen, destino, progreso=None, paginas=PAGINAS_POR_PASO, pausa=PAUSA_ENTRE_PASOS):
+    """
+    Copia una base en otra con la API de backup de SQLite, de a `paginas` por paso,
+    soltando el bloqueo entre pasos para no frenar a quien esté escribiendo
+    """
+    def avance(estado, restantes, total):
+        if progreso:
+            progreso(total - restantes, total)
+
+    origen.backup(destino, pages=paginas, progress=avance, sleep=pausa)
+
+
+def archivo_del_respaldo(ruta):
+    """La copia de archivo.db que acompaña a un respaldo (exista o no)"""
+    directorio, nombre = os.path.split(ruta)
+    return os.path.join(directorio, 'archivo-' + nombre[len('consultorio-'):])
+
+
+def listar_respaldos(directorio=RESPALDOS_DIR):
+    """
+    Devuelve las rutas de los respaldos existentes, del más nuevo al más viejo
+    """
+    if not os.path.isdir(directorio):
+        return []
+    archivos = [os.path.join(directorio, nombre) for nombre in os.listdir(directorio)
+                if nombre.startswith('consultorio-') and nombre.endswith('.db')]
+    return sorted(archivos, reverse=True)
+
+
+def rotar_respaldos(directorio=RESPALDOS_DIR, conservar=CONSERVAR):
+    """
+    Borra los respaldos más viejos dejando solo los últimos `conservar`
+    """
+    borrados = []
+    for ruta in listar_respaldos(directorio)[conservar:]:
+        os.remove(ruta)
+        if os.path.exists(archivo_del_respaldo(ruta)):
+            os.remove(archivo_del_respaldo(ruta))
+        borrados.append(ruta)
+    return borrados
+
+
+def _registrar(directorio, metricas):
+    with open(os.path.join(directorio, HISTORIAL), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(metricas, ensure_ascii=False) + '\n')
+
+
+def historial_respaldos(directorio=RESPALDOS_DIR, limite=20):
+    """
+    Devuelve las métricas de las últimas ejecuciones (más nuevas primero)
+    """
+    ruta = os.path.join(directorio, HISTORIAL)
+    if not os.path.exists(ruta):
+        return []
+    with open(ruta, encoding='utf-8') as f:
+        lineas = f.readlines()
+    return [json.loads(linea) for linea in reversed(lineas[-limite:])]
+
+
+def _copiar_archivo(origen, destino, progreso=None):
+    conn_origen = sqlite3.connect(origen, uri=True)
+    conn_destino = sqlite3.connect(destino)
+    try:
+        _copiar(conn_origen, conn_destino, progreso)
+        return conn_destino.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        conn_destino.close()
+        conn_origen.close()
+
+
+def crear_respaldo(origen=DB_PATH, directorio=RESPALDOS_DIR, conservar=CONSERVAR, progreso=None):
+    """
+    Crea una copia consistente de la base mientras la aplicación sigue en uso,
+    verifica su integridad y rota los respaldos viejos. Si la base tiene archivo.db
+    (sesiones y pacientes archivados) se copia al lado, con el mismo sello de tiempo.
+    Devuelve las métricas de la ejecución
+    """
+    os.makedirs(directorio, exist_ok=True)
+    nombre = f"consultorio-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+    ruta = os.path.join(directorio, nombre)
+    ruta_archivo = archivo_del_respaldo(ruta)
+    con_archivo = os.path.exists(archivo.archivo_de(origen))
+
+    inicio = time.perf_counter()
+    paginas = _copiar_archivo(origen, ruta, progreso)
+    if con_archivo:
+        paginas += _copiar_archivo(archivo.archivo_de(origen), ruta_archivo)
+    duracion_copia = time.perf_counter() - inicio
+
+    integro = verificar_integridad(ruta) and (not con_archivo or verificar_integridad(ruta_archivo))
+    metricas = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'archivo': ruta,
+        'bytes': os.path.getsize(ruta) + (os.path.getsize(ruta_archivo) if con_archivo else 0),
+        'paginas': paginas,
+        'segundos_copia': round(duracion_copia, 3),
+        'segundos_total': round(time.perf_counter() - inicio, 3),
+        'integro': integro,
+    }
+    if con_archivo:
+        metricas['archivo_archivados'] = ruta_archivo
+    _registrar(directorio, metricas)
+
+    if not integro:
+        os.remove(ruta)
+        if con_archivo:
+            os.remove(ruta_archivo)
+        raise RespaldoInvalido(f"El respaldo {ruta} no pasó integrity_check")
+
+    metricas['borrados'] = rotar_respaldos(directorio, conservar) if conservar else []
+    return metricas
+
+
+def _tablas_contadores(conn):
+    return [tabla for (tabla,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'") if tabla in CONTADORES]
+
+
+def _leer_contadores(ruta):
+    """{tabla de contadores: (versión máxima, claves con contador)} de una base"""
+    conn = sqlite3.connect(ruta)
+    try:
+        return {tabla: (conn.execute(f'SELECT COALESCE(MAX(version), 0) FROM {tabla}').fetchone()[0],
+                        [fila[0] for fila in conn.execute(f'SELECT {CONTADORES[tabla]} FROM {tabla}')])
+                for tabla in _tablas_contadores(conn)}
+    finally:
+        conn.close()
+
+
+def _adelantar_contadores(ruta, previos):
+    """
+    Los contadores de versión restaurados vuelven a números que ya se usaron con otros datos,
+    y las cachés (de consult.py, de jornada.py, las historias en disco) se indexan por ellos.
+    Se les suma el máximo que tenían antes de restaurar, incluidas las claves que el respaldo
+    no tenía (cuentan desde 0): cada versión posterior es nueva
+    """
+    conn = sqlite3.connect(ruta)
+    try:
+        for tabla in _tablas_contadores(conn):
+            if tabla not in previos:
+                continue
+            maximo, claves = previos[tabla]
+            conn.executemany(f'INSERT OR IGNORE INTO {tabla} ({CONTADORES[tabla]}, version) VALUES (?, 0)',
+                             [(clave,) for clave in claves])
+            conn.execute(f'UPDATE {tabla} SET version = version + ?', (maximo + 1,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def restaurar_respaldo(ruta, destino=DB_PATH, directorio=RESPALDOS_DIR, progreso=None):
+    """
+    Reemplaza la base actual (y su archivo.db) con el contenido de un respaldo.
+    Un respaldo sin archivo deja el archivo vacío: lo archivado después volvió a la base.
+    Antes de pisar nada guarda un respaldo del estado actual
+    """
+    ruta_archivo = archivo_del_respaldo(ruta)
+    con_archivo = os.path.exists(ruta_archivo)
+    if not verificar_integridad(ruta) or (con_archivo and not verificar_integridad(ruta_archivo)):
+        raise RespaldoInvalido(f"El respaldo {ruta} no pasó integrity_check")
+
+    previo = crear_respaldo(destino, directorio, conservar=None)
+    contadores = _leer_contadores(destino)
+
+    inicio = time.perf_counter()
+    conn_origen = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    conn_destino = sqlite3.connect(destino)
+    try:
+        _copiar(conn_origen, conn_destino, progreso)
+    finally:
+        conn_destino.close()
+        conn_origen.close()
+    if con_archivo or os.path.exists(archivo.archivo_de(destino)):
+        _copiar_archivo(f'file:{ruta_archivo}?mode=ro' if con_archivo else ':memory:', archivo.archivo_de(destino))
+    _adelantar_contadores(destino, contadores)
+
+    return {
+        'restaurado': ruta,
+        'respaldo_previo': previo['archivo'],
+        'segundos': round(time.perf_counter() - inicio, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Respaldos de consultorio.db")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    crear = sub.add_parser('crear')
+    crear.add_argument('--conservar', type=int, default=CONSERVAR)
+    sub.add_parser('listar')
+    sub.add_parser('historial')
+    verificar = sub.add_parser('verificar')
+    verificar.add_argument('archivo')
+    restaurar = sub.add_parser('restaurar')
+    restaurar.add_argument('archivo')
+    parser.add_argument('--base', default=DB_PATH)
+    parser.add_argument('--directorio', default=RESPALDOS_DIR)
+    args = parser.parse_args()
+
+    if args.accion == 'crear':
+        print(crear_respaldo(args.base, args.directorio, args.conservar))
+    elif args.accion == 'listar':
+        for ruta in listar_respaldos(args.directorio):
+            print(ruta, os.path.getsize(ruta))
+    elif args.accion == 'historial':
+        for metricas in historial_respaldos(args.directorio):
+            print(metricas)
+    elif args.accion == 'verificar':
+        print('ok' if verificar_integridad(args.archivo) else 'CORRUPTO')
+    elif args.accion == 'restaurar':
+        print(restaurar_respaldo(args.archivo, args.base, args.directorio))
@@ -0,0 +1,118 @@
+"""
+Los resúmenes mensuales (estadisticas.py) tienen que coincidir con lo que da un GROUP BY
+directo sobre las sesiones, después de altas, cambios y bajas. Uso: python -m pytest
+"""
+import sqlite3
+
+import pytest
+
+import archivo
+import datos
+import estadisticas
+from modelos import Paciente
+
+# Lo mismo que resume refrescar_resumenes, calculado de cero sobre las tablas
+CRUDO = '''
+SELECT substr(s.fecha, 1, 7),
+       COALESCE(NULLIF(p.obra_social, ''), 'Ninguna'),
+       COUNT(*),
+       SUM(CASE WHEN s.asistio THEN 1 ELSE 0 END),
+       SUM(CASE WHEN s.pago THEN 1 ELSE 0 END),
+       COALESCE(SUM(s.monto), 0),
+       COALESCE(SUM(CASE WHEN s.pago THEN s.monto ELSE 0 END), 0),
+       COUNT(DISTINCT s.paciente_id)
+FROM {sesiones} s
+LEFT JOIN {pacientes} p ON p.id = s.paciente_id
+WHERE s.fecha IS NOT NULL
+GROUP BY 1, 2
+ORDER BY 1, 2
+'''
+
+
+def _crudo(conn, incluir_archivo=False):
+    return [tuple(fila) for fila in conn.execute(CRUDO.format(
+        sesiones=archivo.fuente(conn, 'sesiones', incluir_archivo),
+        pacientes=archivo.fuente(conn, 'pacientes', incluir_archivo)))]
+
+
+def _resumen(conn):
+    return [tuple(fila) for fila in estadisticas.resumen_mensual(conn)]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conexion = sqlite3.connect(tmp_path / 'consultorio.db')
+    datos.crear_esquema(conexion)
+    yield conexion
+    conexion.close()
+
+
+@pytest.fixture
+def pacientes(conn):
+    return {
+        'ana': datos.agregar_paciente(conn, Paciente(None, 'Ana', 'Paz', 1, obra_social='OSDE')),
+        'beto': datos.agregar_paciente(conn, Paciente(None, 'Beto', 'Gil', 2, obra_social='IOMA')),
+        'carla': datos.agregar_paciente(conn, Paciente(None, 'Carla', 'Ruiz', 3)),
+    }
+
+
+def _cargar(conn, pacientes):
+    """Sesiones repartidas en tres meses y tres obras sociales; devuelve sus ids"""
+    filas = [
+        ('ana', '2025-01-07', 1, 1, 1000.0), ('ana', '2025-01-14', 1, 0, 1000.0), ('ana', '2025-02-04', 0, 0, 0.0),
+        ('beto', '2025-01-09', 1, 1, 1500.0), ('beto', '2025-02-06', 1, 1, 1500.0), ('beto', '2025-03-06', 1, 0, 1500.0),
+        ('carla', '2025-02-11', 1, 1, 800.0), ('carla', '2025-03-11', 0, 0, None),
+    ]
+    return [datos.agregar_sesion(conn, pacientes[quien], fecha, 'nota', asistio, pago, monto, None)
+            for quien, fecha, asistio, pago, monto in filas]
+
+
+def test_altas(conn, pacientes):
+    _cargar(conn, pacientes)
+    assert _resumen(conn) == _crudo(conn)
+    assert len(_resumen(conn)) == 7
+
+
+def test_cambios(conn, pacientes):
+    ids = _cargar(conn, pacientes)
+    _resumen(conn)  # Deja los resúmenes al día antes de cambiar nada
+    datos.actualizar_sesion(conn, ids[1], '2025-01-14', 'nota', 1, 1, 1200.0, None)  # Pagó y cambió el monto
+    datos.actualizar_sesion(conn, ids[5], '2025-04-03', 'nota', 1, 0, 1500.0, None)  # Pasa de marzo a abril
+    assert _resumen(conn) == _crudo(conn)
+    assert [fila[0] for fila in _resumen(conn)].count('2025-04') == 1
+
+
+def test_bajas(conn, pacientes):
+    ids = _cargar(conn, pacientes)
+    _resumen(conn)
+    datos.eliminar_sesion(conn, ids[2])
+    datos.eliminar_sesion(conn, ids[7])
+    assert _resumen(conn) == _crudo(conn)
+    assert ('2025-03', 'Ninguna') not in {fila[:2] for fila in _resumen(conn)}  # Se fue la única sesión
+
+
+def test_cambio_de_obra_social(conn, pacientes):
+    _cargar(conn, pacientes)
+    _resumen(conn)
+    carla = datos.obtener_paciente(conn, pacientes['carla'])
+    datos.actualizar_paciente(conn, carla._replace(obra_social='OSDE'))
+    assert _resumen(conn) == _crudo(conn)
+    assert 'Ninguna' not in {fila[1] for fila in _resumen(conn)}
+
+
+def test_reconstruir(conn, pacientes):
+    _cargar(conn, pacientes)
+    conn.execute('DELETE FROM resumen_mensual')  # Un resumen que quedó mal
+    conn.commit()
+    estadisticas.reconstruir_resumenes(conn)
+    assert _resumen(conn) == _crudo(conn)
+
+
+def test_sesiones_archivadas(conn, pacientes):
+    ids = _cargar(conn, pacientes)
+    _resumen(conn)
+    assert archivo.archivar(conn, años=1)['sesiones'] == len(ids)  # Todas tienen más de un año
+    # Archivar mueve filas pero no cambia los totales; una sesión nueva se suma a lo archivado
+    datos.agregar_sesion(conn, pacientes['ana'], '2025-01-21', 'nota', 1, 1, 1000.0, None)
+    assert _resumen(conn) == _crudo(conn, incluir_archivo=True)
+    assert estadisticas.verificar_resumenes(conn) == []
@@ -0,0 +1,96 @@
+TABLAS_VERSIONADAS = ('pacientes', 'sesiones', 'turnos')
+
+
+def crear_versiones(conn, tablas=TABLAS_VERSIONADAS):
+    """
+    Crea la tabla de contadores y los triggers que incrementan la versión de cada
+    tabla ante cualquier INSERT, UPDATE o DELETE, venga de esta conexión o de otro proceso
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS versiones_tablas (
+        tabla TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    for tabla in tablas:
+        conn.execute('INSERT OR IGNORE INTO versiones_tablas (tabla, version) VALUES (?, 0)', (tabla,))
+        for operacion in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{operacion.lower()}
+            AFTER {operacion} ON {tabla}
+            BEGIN
+                UPDATE versiones_tablas SET version = version + 1 WHERE tabla = '{tabla}';
+            END
+            ''')
+    conn.commit()
+
+
+def crear_versiones_pacientes(conn):
+    """
+    Contador de versión por paciente: cambia cuando se modifican sus datos
+    o cualquiera de sus sesiones (también al archivarlas o borrarlas)
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS versiones_pacientes (
+        paciente_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    incremento = '''
+        INSERT INTO versiones_pacientes (paciente_id, version) VALUES ({fila}, 1)
+        ON CONFLICT (paciente_id) DO UPDATE SET version = version + 1;'''
+    disparadores = {
+        'paciente_update': ('UPDATE', 'pacientes', ['NEW.id']),
+        'sesion_insert': ('INSERT', 'sesiones', ['NEW.paciente_id']),
+        'sesion_update': ('UPDATE', 'sesiones', ['NEW.paciente_id', 'OLD.paciente_id']),
+        'sesion_delete': ('DELETE', 'sesiones', ['OLD.paciente_id']),
+    }
+    for nombre, (operacion, tabla, filas) in disparadores.items():
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_version_{nombre}
+        AFTER {operacion} ON {tabla}
+        BEGIN{''.join(incremento.format(fila=fila) for fila in filas)}
+        END
+        ''')
+    conn.commit()
+
+
+def version_paciente(conn, paciente_id):
+    fila = conn.execute('SELECT version FROM versiones_pacientes WHERE paciente_id = ?', (paciente_id,)).fetchone()
+    return fila[0] if fila else 0
+
+
+class Versiones:
+    """
+    Informa la versión actual de cada tabla sin consultar la base en cada llamada:
+    solo vuelve a leer los contadores si PRAGMA data_version cambió (otra conexión escribió)
+    o si esta misma conexión hizo cambios desde la última lectura
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._data_version = None
+        self._cambios = None
+        self._versiones = {}
+
+    def _vigente(self):
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        cambios = self.conn.total_changes
+        if data_version == self._data_version and cambios == self._cambios:
+            return True
+        self._data_version = data_version
+        self._cambios = cambios
+        return False
+
+    def todas(self):
+        if not self._vigente():
+            self._versiones = dict(self.conn.execute('SELECT tabla, version FROM versiones_tablas'))
+        return dict(self._versiones)
+
+    def version(self, tabla):
+        return self.todas().get(tabla, 0)
+
+    def clave(self, *tablas):
+        """Tupla con las versiones de varias tablas, útil como parte de una clave de caché"""
+        versiones = self.todas()
+        return tuple(versiones.get(tabla, 0) for tabla in tablas)